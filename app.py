@@ -1,23 +1,220 @@
+import gc
 import os
-import struct
+import json
+import mmap
+import base64
+import time
 import subprocess
 import tempfile
-from flask import Flask, request, jsonify, send_file, render_template
+import zlib
+import zipfile
+import concurrent.futures
+import ebml
+import frame_stats
+import inspect_webm
+import upload_store
+import blob_store
+import webm_core
+from flask import Flask, Request, Response, g, request, jsonify, render_template, stream_with_context
+from werkzeug.datastructures import FileStorage
 from werkzeug.utils import secure_filename
 import io
 
-app = Flask(__name__)
+# File parts of requests larger than this are written to a named temp file
+# while the body is parsed, so the handlers can use them by path or mmap.
+# The file is not delete-on-close (Windows would not let ffmpeg open it by
+# name); it is removed once the response has been sent.
+UPLOAD_SPOOL_BYTES = int(os.environ.get('UPLOAD_SPOOL_BYTES', 512 * 1024))
+DOWNLOAD_CHUNK_BYTES = 256 * 1024
+
+# Endpoints whose single uploaded file is checked while it arrives, with the
+# video codecs each accepts (None: any). /compress decodes with libvpx-vp9.
+UPLOAD_CHECK_CODECS = {
+    'upload_file': None,
+    'patch_head': None,
+    'trim_file': None,
+    'stats_file': None,
+    'put_blob': None,
+    'compress_file': {'V_VP9'},
+}
 
-# Determine FFmpeg path - use local ffmpeg folder if exists, otherwise system ffmpeg
-def get_ffmpeg_path():
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    local_ffmpeg = os.path.join(script_dir, 'ffmpeg', 'ffmpeg.exe')
-    if os.path.exists(local_ffmpeg):
-        return local_ffmpeg
-    return 'ffmpeg'  # Fall back to system ffmpeg
+# File part stream that runs a HeadCheck over the bytes as the multipart
+# parser writes them. A failed check is passed to `reject` and raised; the
+# parser gives up quietly with empty form data, so the rest of the body is
+# never read.
+class CheckedFileStream:
+    def __init__(self, target, check, reject):
+        self.target = target
+        self.check = check
+        self.reject = reject
+    
+    def write(self, data):
+        if not self.check.done:
+            try:
+                self.check.feed(data)
+            except ebml.EBMLError as e:
+                self.reject(str(e))
+                raise
+        return self.target.write(data)
+    
+    def __getattr__(self, name):
+        return getattr(self.target, name)
+
+# Request whose file uploads are checked from their first bytes. A rejected
+# upload leaves empty form data and the reason in `upload_rejected`. Spooled
+# parts are listed in `spooled_files` and maps of uploads in `upload_maps`
+# for remove_spooled_files().
+class CheckedRequest(Request):
+    upload_rejected = None
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.spooled_files = []
+        self.upload_maps = []
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is None or total_content_length > UPLOAD_SPOOL_BYTES:
+            stream = tempfile.NamedTemporaryFile('w+b', suffix='.upload', delete=False)
+            self.spooled_files.append(stream)
+        else:
+            stream = io.BytesIO()
+        if self.endpoint not in UPLOAD_CHECK_CODECS:
+            return stream
+        check = inspect_webm.HeadCheck(UPLOAD_CHECK_CODECS[self.endpoint])
+        return CheckedFileStream(stream, check, lambda reason: setattr(self, 'upload_rejected', reason))
+
+app = Flask(__name__)
+app.request_class = CheckedRequest
 
-FFMPEG_PATH = get_ffmpeg_path()
 app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10MB limit
+HEAD_PATCH_LIMIT = 1024 * 1024  # /upload/head reads at most this much of the head
+
+# Resumable uploads (/uploads) bypass the per-request limit: each chunk is
+# its own request and the whole file may be this large
+UPLOAD_MAX_BYTES = 200 * 1024 * 1024
+UPLOAD_DIR = os.path.join(tempfile.gettempdir(), 'webm_uploads')
+uploads = upload_store.UploadStore(UPLOAD_DIR, UPLOAD_MAX_BYTES)
+
+# Content-addressed scratch store behind file handles (/blobs): files are
+# kept by SHA-256 for reuse across requests, within a TTL and a size cap
+BLOB_DIR = os.path.join(tempfile.gettempdir(), 'webm_blobs')
+BLOB_MAX_BYTES = 2 * 1024 * 1024 * 1024
+BLOB_TTL_SECONDS = 6 * 3600
+blobs = blob_store.BlobStore(BLOB_DIR, BLOB_MAX_BYTES, BLOB_TTL_SECONDS)
+BATCH_WORKERS = 4  # files edited at once by /upload/batch
+# Uncompressed size limits for a zip's .webm entries, checked against the
+# sizes the archive declares (zipfile never reads past them)
+BATCH_ENTRY_MAX_BYTES = 64 * 1024 * 1024
+BATCH_TOTAL_MAX_BYTES = 256 * 1024 * 1024
+PACK_WORKERS = os.cpu_count() or 1  # encode processes for /pack, one ffmpeg thread each
+pack_pool = None  # shared by every /pack request, started on first use
+
+# The /pack process pool, started again if a dead worker broke the last one
+def get_pack_pool():
+    global pack_pool
+    if pack_pool is None:
+        pack_pool = concurrent.futures.ProcessPoolExecutor(PACK_WORKERS)
+    return pack_pool
+
+def discard_pack_pool(pool):
+    global pack_pool
+    if pack_pool is pool:
+        pack_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+# The file a processing request works on: the multipart `file`, a stored
+# file named by its `handle` (SHA-256, with the original `filename`), or a
+# finalized resumable upload named by `upload_id`. Returns (file, error).
+def request_file():
+    handle = request.form.get('handle')
+    upload_id = request.form.get('upload_id')
+    if request.upload_rejected:
+        return None, request.upload_rejected
+    if handle or upload_id:
+        try:
+            if handle:
+                path = blobs.path(handle)
+                filename = secure_filename(request.form.get('filename') or 'video.webm')
+            else:
+                path, filename = uploads.open_path(upload_id)
+        except (upload_store.UploadError, blob_store.BlobError) as e:
+            return None, str(e)
+        file = FileStorage(open(path, 'rb'), filename=filename, content_type='video/webm')
+        g.setdefault('upload_files', []).append(file)
+        return file, None
+    if 'file' not in request.files:
+        return None, 'No file uploaded'
+    return request.files['file'], None
+
+# Path of the file behind an upload when it is on disk (a spooled part, a
+# stored blob or a finalized upload), otherwise None
+def upload_path(file):
+    path = getattr(file.stream, 'name', None)
+    if not isinstance(path, str) or not os.path.isfile(path):
+        return None
+    file.stream.flush()
+    return path
+
+# The bytes of an upload. Files on disk are memory-mapped through their open
+# handle instead of read in: copy-on-write when `writable` (in-place edits
+# stay private and only the touched pages take memory), read-only otherwise.
+# The map is closed after the response has been sent.
+def upload_buffer(file, writable=True):
+    path = upload_path(file)
+    if path is None or os.path.getsize(path) == 0:
+        data = file.read()
+        return bytearray(data) if writable else data
+    buffer = mmap.mmap(file.stream.fileno(), 0, access=mmap.ACCESS_COPY if writable else mmap.ACCESS_READ)
+    request.upload_maps.append(buffer)
+    return buffer
+
+# Download response streamed from a buffer (bytes, bytearray or mmap)
+# without copying it whole. The view is released once the body is done or
+# closed, so a map can be closed after it.
+def buffer_response(data, download_filename):
+    def chunks():
+        with memoryview(data) as view:
+            for pos in range(0, len(view), DOWNLOAD_CHUNK_BYTES):
+                yield bytes(view[pos:pos + DOWNLOAD_CHUNK_BYTES])
+    response = Response(chunks(), mimetype='video/webm')
+    response.headers['Content-Disposition'] = f'attachment; filename="{download_filename}"'
+    response.headers['Content-Length'] = str(len(data))
+    return response
+
+@app.teardown_request
+def close_upload_files(exc):
+    for file in g.pop('upload_files', []):
+        file.close()
+
+# Close this request's upload maps and delete its spooled parts after the
+# response, streamed bodies included, has been sent; a body may still be
+# reading a map until then
+@app.after_request
+def remove_spooled_files(response):
+    files, maps = request.spooled_files, request.upload_maps
+    if files or maps:
+        response.call_on_close(lambda: remove_files(files, maps))
+    return response
+
+# Maps go first: Windows cannot delete a file that is still mapped. Views
+# an edit took of a map can outlive it in reference cycles, so those are
+# collected before a second try.
+def remove_files(files, maps=()):
+    for buffer in maps:
+        try:
+            buffer.close()
+        except BufferError:
+            gc.collect()
+            try:
+                buffer.close()
+            except BufferError:
+                pass
+    for file in files:
+        file.close()
+        try:
+            os.unlink(file.name)
+        except OSError:
+            pass
 
 @app.route('/')
 def index():
@@ -26,10 +223,10 @@ def index():
 @app.route('/upload', methods=['POST'])
 def upload_file():
     try:
-        if 'file' not in request.files:
-            return jsonify({'error': 'No file uploaded'}), 400
+        file, error = request_file()
+        if error:
+            return jsonify({'error': error}), 400
         
-        file = request.files['file']
         if not file.filename or file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
         
@@ -42,83 +239,425 @@ def upload_file():
         except ValueError:
             return jsonify({'error': 'Invalid duration value'}), 400
         
-        # Read the entire file into memory
-        file_data = bytearray(file.read())
+        finalize = request.form.get('finalize', 'false').lower() == 'true'  # Write real sizes over unknown-size markers
+        cues = request.form.get('cues', 'false').lower() == 'true'  # Index keyframes in Cues at the front of the file
+        retime = request.form.get('retime', 'false').lower() == 'true'  # Make the duration real by rescaling timestamps
+        slim = request.form.get('slim', 'false').lower() == 'true'  # Strip audio, Tags, padding and other extras
         
-        # Search for EBML Duration tag (0x4489)
-        tag_found = False
-        tag_position = -1
+        # Large uploads are edited through a copy-on-write mapping of the
+        # spooled file rather than read into memory
+        file_data = upload_buffer(file)
         
-        # Search for the byte sequence 0x44 0x89
-        for i in range(len(file_data) - 1):
-            if file_data[i] == 0x44 and file_data[i + 1] == 0x89:
-                tag_position = i
-                tag_found = True
-                break
+        try:
+            file_data, edit_report = webm_core.edit_webm(file_data, duration_ms, finalize, cues, retime, slim)
+        except ebml.EBMLError as e:
+            return jsonify({'error': str(e)}), 400
         
-        if not tag_found:
-            return jsonify({'error': 'Duration tag (0x4489) not found in file'}), 400
+        # Generate filename for download
+        original_filename = secure_filename(file.filename or 'video')
+        name_without_ext = os.path.splitext(original_filename)[0]
+        download_filename = f"{name_without_ext}_fixed.webm"
+        
+        response = buffer_response(file_data, download_filename)
+        response.headers['X-Duration-Patch'] = edit_report['duration']
+        response.headers['X-Edit-Report'] = json.dumps(edit_report)
+        return response
+    
+    except Exception as e:
+        return jsonify({'error': f'Processing failed: {str(e)}'}), 500
+
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    try:
+        filename = request.form.get('filename', '')  # Original file name
+        if not filename.lower().endswith('.webm'):
+            return jsonify({'error': 'Only .webm files are supported'}), 400
+        try:
+            size = int(request.form.get('size', ''))  # Total bytes that will be sent
+            status = uploads.create(secure_filename(filename), size)
+        except ValueError as e:
+            return jsonify({'error': str(e) if isinstance(e, upload_store.UploadError) else 'Invalid size value'}), 400
+        return jsonify(status), 201
+    
+    except Exception as e:
+        return jsonify({'error': f'Upload failed: {str(e)}'}), 500
+
+# The body is the raw chunk; `offset` is where it starts in the file. A
+# refused chunk (409) comes back with the committed offset to resume from.
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    try:
+        try:
+            offset = int(request.args.get('offset', ''))
+        except ValueError:
+            return jsonify({'error': 'Invalid offset value'}), 400
+        try:
+            committed = uploads.write(upload_id, offset, request.stream)
+        except upload_store.UploadError as e:
+            try:
+                status = uploads.status(upload_id)
+            except upload_store.UploadError:
+                return jsonify({'error': str(e)}), 404
+            return jsonify({'error': str(e), 'offset': status['offset']}), 409
+        response = jsonify({'upload_id': upload_id, 'offset': committed})
+        response.headers['Upload-Offset'] = str(committed)
+        return response
+    
+    except Exception as e:
+        return jsonify({'error': f'Upload failed: {str(e)}'}), 500
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    try:
+        status = uploads.status(upload_id)
+    except upload_store.UploadError as e:
+        return jsonify({'error': str(e)}), 404
+    response = jsonify(status)
+    response.headers['Upload-Offset'] = str(status['offset'])
+    return response
+
+# A finalized upload is also filed in the blob store; its SHA-256 is the
+# handle
+@app.route('/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize_upload(upload_id):
+    try:
+        try:
+            status = uploads.finalize(upload_id)
+        except upload_store.UploadError as e:
+            return jsonify({'error': str(e)}), 409
+        path, _ = uploads.open_path(upload_id)
+        status['handle'], _, _ = blobs.put_file(path, status['sha256'])
+        return jsonify(status)
+    
+    except Exception as e:
+        return jsonify({'error': f'Upload failed: {str(e)}'}), 500
+
+# Store a file once and get back its handle for later processing requests
+@app.route('/blobs', methods=['POST'])
+def put_blob():
+    try:
+        file, error = request_file()
+        if error:
+            return jsonify({'error': error}), 400
+        handle, size, existed = blobs.put_stream(file.stream)
+        return jsonify({'handle': handle, 'size': size, 'existed': existed}), 200 if existed else 201
+    
+    except Exception as e:
+        return jsonify({'error': f'Upload failed: {str(e)}'}), 500
+
+# "Do you have this file?" (HEAD works too): 200 with its size, or 404
+@app.route('/blobs/<handle>', methods=['GET'])
+def get_blob(handle):
+    try:
+        size = blobs.lookup(handle)
+    except blob_store.BlobError as e:
+        return jsonify({'error': str(e)}), 400
+    if size is None:
+        return jsonify({'error': 'Unknown file handle'}), 404
+    return jsonify({'handle': handle, 'size': size})
+
+@app.route('/upload/head', methods=['POST'])
+def patch_head():
+    try:
+        # `file` is the start of the real file (everything up to the first
+        # Cluster); the client applies the returned patches to its own copy
+        file, error = request_file()
+        if error:
+            return jsonify({'error': error}), 400
+        if not file.filename or not file.filename.lower().endswith('.webm'):
+            return jsonify({'error': 'Only .webm files are supported'}), 400
         
-        # The duration value is stored 3 bytes after the tag
-        # According to EBML spec: tag (2 bytes) + size (1 byte) + data
-        # Size byte can be 0x88 (8-byte float) or 0x84 (4-byte float)
-        if tag_position + 2 >= len(file_data):
-            return jsonify({'error': 'File structure invalid - incomplete duration tag'}), 400
+        try:
+            duration_ms = float(request.form.get('duration', '3000'))
+        except ValueError:
+            return jsonify({'error': 'Invalid duration value'}), 400
         
-        size_byte = file_data[tag_position + 2]
+        head = file.read(HEAD_PATCH_LIMIT)
+        try:
+            patches, method = ebml.duration_patch(head, duration_ms / 1000.0)
+        except ebml.EBMLError as e:
+            # The client falls back to uploading the whole file to /upload
+            return jsonify({'error': str(e)}), 400
         
-        # Determine float size based on EBML size byte
-        if size_byte == 0x88:
-            float_size = 8  # double-precision
-            pack_format = '>d'
-        elif size_byte == 0x84:
-            float_size = 4  # single-precision
-            pack_format = '>f'
-        else:
-            return jsonify({'error': f'Unexpected EBML size byte: 0x{size_byte:02x} (expected 0x88 or 0x84)'}), 400
+        return jsonify({
+            'duration': method,
+            'head_bytes': len(head),
+            'patches': [{'offset': offset, 'data': base64.b64encode(blob).decode('ascii')} for offset, blob in patches],
+        })
+    
+    except Exception as e:
+        return jsonify({'error': f'Processing failed: {str(e)}'}), 500
+
+# Write-only file object for zipfile that hands back what has been written
+# so far, so an archive can be streamed entry by entry
+class ZipStream(io.RawIOBase):
+    def __init__(self):
+        self.pending = []
+    
+    def writable(self):
+        return True
+    
+    def write(self, b):
+        self.pending.append(bytes(b))
+        return len(b)
+    
+    def drain(self):
+        data = b''.join(self.pending)
+        self.pending = []
+        return data
+
+# Edit (name, source, data) inputs on a thread pool and yield the output zip
+# as each file completes. At most 2 * BATCH_WORKERS files are held at once;
+# entries come out in completion order and a batch_report.json entry goes
+# last. A file that fails for any reason only gets an error in the report.
+def stream_batch(inputs, durations, default_ms, options):
+    def work(name, source, read):
+        keys = (source, source.replace('\\', '/').rsplit('/', 1)[-1], name)
+        duration_ms = next((durations[key] for key in keys if key in durations), default_ms)
+        report = {'source': source} if source != name else {}
+        try:
+            data, edit_report = webm_core.edit_webm(bytearray(read()), duration_ms, **options)
+        except (zipfile.BadZipFile, zlib.error) as e:
+            report['error'] = f'Unreadable zip entry: {e}'
+            return name, None, report
+        except ebml.EBMLError as e:
+            report['error'] = str(e)
+            return name, None, report
+        except Exception as e:
+            report['error'] = f'Processing failed: {e}'
+            return name, None, report
+        report.update(edit_report, duration_ms=duration_ms)
+        return name, data, report
+    
+    stream = ZipStream()
+    reports = {}
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_STORED) as archive, \
+            concurrent.futures.ThreadPoolExecutor(BATCH_WORKERS) as pool:
+        pending = {}  # future: entry name
+        inputs = iter(inputs)
+        while True:
+            for name, source, read in inputs:
+                pending[pool.submit(work, name, source, read)] = name
+                if len(pending) >= 2 * BATCH_WORKERS:
+                    break
+            if not pending:
+                break
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                try:
+                    name, data, report = future.result()
+                except Exception as e:
+                    name, data, report = pending[future], None, {'error': f'Processing failed: {e}'}
+                del pending[future]
+                reports[name] = report
+                if data is not None:
+                    archive.writestr(name, bytes(data))
+                    yield stream.drain()
+        archive.writestr('batch_report.json', json.dumps(reports, indent=2))
+    yield stream.drain()
+
+# Archive entry names for client-supplied file names: the base name made
+# safe by secure_filename (no directories, so nothing can land outside the
+# extraction folder) with -2, -3... before the extension for repeats
+def unique_names(names, reserved=('batch_report.json', 'pack_report.json')):
+    seen = set(reserved)
+    for name in names:
+        root, ext = os.path.splitext(name.replace('\\', '/').rsplit('/', 1)[-1])
+        root = secure_filename(root) or 'video'
+        ext = secure_filename(ext).lower()
+        ext = f'.{ext}' if ext else ''
+        candidate = root + ext
+        count = 1
+        while candidate.lower() in seen:
+            count += 1
+            candidate = f'{root}-{count}{ext}'
+        seen.add(candidate.lower())
+        yield candidate
+
+# The .webm files of a multi-file request: one `file` that is a zip of them
+# or several `files`. Returns (inputs, archive_name, error) where inputs
+# yields (name, source, read), name being the unique safe entry name for the
+# output, source the name the client sent and read() the file's bytes (a zip
+# entry is only decompressed then, and may raise BadZipFile), and error is a
+# message for a bad request.
+def batch_inputs():
+    uploads = request.files.getlist('files')
+    archive_file = request.files.get('file')
+    if archive_file is not None and archive_file.filename.lower().endswith('.zip'):
+        try:
+            source = zipfile.ZipFile(archive_file.stream)
+        except zipfile.BadZipFile:
+            return None, None, 'Invalid zip file'
+        entries = [info for info in source.infolist()
+                   if not info.is_dir() and info.filename.lower().endswith('.webm')
+                   and not info.filename.startswith('__MACOSX/')]
+        if not entries:
+            return None, None, 'No .webm files found'
+        for info in entries:
+            if info.file_size > BATCH_ENTRY_MAX_BYTES:
+                return None, None, f'{info.filename} is too large when unzipped'
+        if sum(info.file_size for info in entries) > BATCH_TOTAL_MAX_BYTES:
+            return None, None, 'Zip contents are too large when unzipped'
+        archive_name = os.path.splitext(secure_filename(archive_file.filename))[0] or 'stickers'
+        names = unique_names([info.filename for info in entries])
+        return ((name, info.filename, lambda info=info: source.read(info)) for name, info in zip(names, entries)), archive_name, None
+    uploads = [upload for upload in uploads if upload.filename]
+    if not uploads:
+        return None, None, 'No zip or files uploaded'
+    if any(not upload.filename.lower().endswith('.webm') for upload in uploads):
+        return None, None, 'Only .webm files are supported'
+    names = unique_names([upload.filename for upload in uploads])
+    return ((name, upload.filename, upload.read) for name, upload in zip(names, uploads)), 'stickers', None
+
+@app.route('/upload/batch', methods=['POST'])
+def upload_batch():
+    try:
+        inputs, archive_name, error = batch_inputs()
+        if error:
+            return jsonify({'error': error}), 400
         
-        duration_offset = tag_position + 3
+        try:
+            duration_ms = float(request.form.get('duration', '3000'))  # Used for files missing from `durations`
+            durations = json.loads(request.form.get('durations') or '{}')  # {file name: milliseconds}
+            durations = {name: float(value) for name, value in durations.items()}
+        except (ValueError, TypeError, AttributeError):
+            return jsonify({'error': 'Invalid duration value'}), 400
+        
+        options = {
+            'finalize': request.form.get('finalize', 'false').lower() == 'true',
+            'cues': request.form.get('cues', 'false').lower() == 'true',
+            'retime': request.form.get('retime', 'false').lower() == 'true',
+            'slim': request.form.get('slim', 'false').lower() == 'true',
+        }
+        
+        response = Response(stream_with_context(stream_batch(inputs, durations, duration_ms, options)), mimetype='application/zip')
+        response.headers['Content-Disposition'] = f'attachment; filename="{archive_name}_fixed.zip"'
+        return response
+    
+    except Exception as e:
+        return jsonify({'error': f'Processing failed: {str(e)}'}), 500
+
+@app.route('/trim', methods=['POST'])
+def trim_file():
+    try:
+        file, error = request_file()
+        if error:
+            return jsonify({'error': error}), 400
         
-        # Ensure we have enough bytes to write the duration
-        if duration_offset + float_size > len(file_data):
-            return jsonify({'error': 'File structure invalid - not enough bytes after duration tag'}), 400
+        if not file.filename or file.filename == '':
+            return jsonify({'error': 'No file selected'}), 400
         
-        # Convert milliseconds to seconds (EBML Duration is stored in seconds)
-        duration_seconds = duration_ms / 1000.0
+        if not file.filename.lower().endswith('.webm'):
+            return jsonify({'error': 'Only .webm files are supported'}), 400
         
-        # Convert duration to IEEE 754 float (big-endian)
-        duration_bytes = struct.pack(pack_format, duration_seconds)
+        # In/out points in milliseconds; no end keeps everything after the in point
+        try:
+            start_ms = float(request.form.get('start', '0'))
+            end_ms = request.form.get('end', '').strip()
+            end_ms = float(end_ms) if end_ms else None
+        except ValueError:
+            return jsonify({'error': 'Invalid start or end value'}), 400
         
-        # Replace the duration value
-        for i in range(float_size):
-            file_data[duration_offset + i] = duration_bytes[i]
+        file_data = upload_buffer(file, writable=False)
         
-        # Create a BytesIO object for the modified file
-        modified_file = io.BytesIO(bytes(file_data))
-        modified_file.seek(0)
+        # Cut at the keyframe at or before the in point by dropping whole
+        # Clusters and blocks; nothing is decoded. The new file is streamed
+        # out one Cluster at a time.
+        try:
+            chunks, trim_report = ebml.trim(file_data, start_ms / 1000.0, end_ms / 1000.0 if end_ms is not None else None)
+        except ebml.EBMLError as e:
+            return jsonify({'error': str(e)}), 400
         
-        # Generate filename for download
         original_filename = secure_filename(file.filename or 'video')
         name_without_ext = os.path.splitext(original_filename)[0]
-        download_filename = f"{name_without_ext}_fixed.webm"
+        download_filename = f"{name_without_ext}_trimmed.webm"
         
-        return send_file(
-            modified_file,
-            mimetype='video/webm',
-            as_attachment=True,
-            download_name=download_filename
-        )
+        response = Response((bytes(chunk) for chunk in chunks), mimetype='video/webm')
+        response.headers['Content-Disposition'] = f'attachment; filename="{download_filename}"'
+        response.headers['Content-Length'] = str(trim_report['bytes'])
+        response.headers['X-Trim-Report'] = json.dumps(trim_report)
+        return response
     
     except Exception as e:
-        return jsonify({'error': f'Processing failed: {str(e)}'}), 500
+        return jsonify({'error': f'Trim failed: {str(e)}'}), 500
+
+@app.route('/stats', methods=['POST'])
+def stats_file():
+    try:
+        file, error = request_file()
+        if error:
+            return jsonify({'error': error}), 400
+        
+        if not file.filename or file.filename == '':
+            return jsonify({'error': 'No file selected'}), 400
+        
+        try:
+            window_ms = int(request.form.get('window_ms', '1000'))  # Rolling bitrate window
+            step_ms = int(request.form.get('step_ms', '100'))  # Bitrate sample spacing
+        except ValueError:
+            return jsonify({'error': 'Invalid window_ms or step_ms value'}), 400
+        if window_ms <= 0 or step_ms <= 0:
+            return jsonify({'error': 'window_ms and step_ms must be positive'}), 400
+        output_format = request.form.get('format', 'json').lower()  # json or binary
+        if output_format not in ('json', 'binary'):
+            return jsonify({'error': f'Unknown format: {output_format}'}), 400
+        
+        # Only block headers are read; the upload is consumed in chunks
+        try:
+            stats = frame_stats.frame_stats(frame_stats.iter_file(file.stream), window_ms, step_ms)
+        except ebml.EBMLError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        if output_format == 'binary':
+            return Response(frame_stats.to_binary(stats), mimetype='application/octet-stream')
+        return jsonify(stats)
+    
+    except Exception as e:
+        return jsonify({'error': f'Analysis failed: {str(e)}'}), 500
+
+@app.route('/inspect', methods=['POST'])
+def inspect_file():
+    try:
+        # `file` may be the whole file or just its first few hundred KB; in
+        # the latter case the client sends the last bytes as `tail` and the
+        # real total as `size`
+        file, error = request_file()
+        if error:
+            return jsonify({'error': error}), 400
+        tail_file = request.files.get('tail')
+        size = request.form.get('size')
+        try:
+            size = int(size) if size else None
+        except ValueError:
+            return jsonify({'error': 'Invalid size value'}), 400
+        
+        try:
+            if tail_file is not None:
+                tail = tail_file.read(inspect_webm.TAIL_BYTES)
+                report = inspect_webm.inspect(frame_stats.iter_file(file.stream), tail, size)
+            else:
+                # Whole file uploaded: take the tail from its end, then read the head
+                file.stream.seek(0, os.SEEK_END)
+                size = file.stream.tell()
+                file.stream.seek(max(size - inspect_webm.TAIL_BYTES, 0))
+                tail = file.stream.read()
+                file.stream.seek(0)
+                report = inspect_webm.inspect(frame_stats.iter_file(file.stream), tail, size)
+        except ebml.EBMLError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        return jsonify(report)
+    
+    except Exception as e:
+        return jsonify({'error': f'Inspection failed: {str(e)}'}), 500
 
 @app.route('/compress', methods=['POST'])
 def compress_file():
     try:
-        if 'file' not in request.files:
-            return jsonify({'error': 'No file uploaded'}), 400
+        file, error = request_file()
+        if error:
+            return jsonify({'error': error}), 400
         
-        file = request.files['file']
         if not file.filename or file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
         
@@ -132,6 +671,16 @@ def compress_file():
         real_duration = request.form.get('real_duration')  # Real video duration for bitrate calculation
         bitrate = request.form.get('bitrate', '500k')  # Manual bitrate selection
         duration_ms = request.form.get('duration')  # Optional duration to set
+        denoise = request.form.get('denoise', 'off').lower()  # off, auto, light, medium, strong
+        denoise_report = request.form.get('denoise_report', 'false').lower() == 'true'
+        decimate = request.form.get('decimate', 'off').lower()  # off, duplicates, near-static
+        alpha_cleanup = request.form.get('alpha_cleanup', 'off').lower()  # off, zero, edge
+        keyframe_policy = request.form.get('keyframe_policy', 'default').lower()  # default, single, scene, interval
+        keyframe_interval = request.form.get('keyframe_interval', '30')  # GOP length for the interval policy
+        alt_ref = request.form.get('alt_ref', 'off').lower()  # off, auto (enable when the source is opaque)
+        autocrop = request.form.get('autocrop', 'false').lower() == 'true'  # Crop fully transparent borders
+        autocrop_align = request.form.get('autocrop_align', '8')  # Crop box alignment in pixels
+        slim = request.form.get('slim', 'false').lower() == 'true'  # Strip container extras from the encoder output
         
         try:
             crf_value = int(crf)
@@ -140,166 +689,193 @@ def compress_file():
         except ValueError:
             return jsonify({'error': 'Invalid CRF value'}), 400
         
-        # Create temporary files
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.webm') as temp_input:
-            file.save(temp_input.name)
-            input_path = temp_input.name
+        if denoise not in ('off', 'auto') and denoise not in webm_core.DENOISE_FILTERS:
+            return jsonify({'error': f'Unknown denoise mode: {denoise}'}), 400
+        
+        if decimate != 'off' and decimate not in webm_core.DECIMATE_FILTERS:
+            return jsonify({'error': f'Unknown decimate mode: {decimate}'}), 400
+        
+        if alpha_cleanup != 'off' and alpha_cleanup not in webm_core.ALPHA_CLEANUP_MODES:
+            return jsonify({'error': f'Unknown alpha cleanup mode: {alpha_cleanup}'}), 400
         
-        output_path = tempfile.mktemp(suffix='_compressed.webm')
+        if keyframe_policy not in webm_core.KEYFRAME_POLICIES:
+            return jsonify({'error': f'Unknown keyframe policy: {keyframe_policy}'}), 400
         
         try:
-            # Build FFmpeg command for WebM compression with alpha preservation
-            ffmpeg_cmd = [
-                FFMPEG_PATH,
-                '-c:v', 'libvpx-vp9',
-                '-i', input_path,
-                '-vf', 'format=yuva420p',
-                '-c:v', 'libvpx-vp9',
-                '-pix_fmt', 'yuva420p',
-                '-auto-alt-ref', '0',
-                '-lag-in-frames', '0',
-                '-row-mt', '1',
-                '-cpu-used', '4',
-                '-deadline', 'good'
-            ]
-            
-            if auto_optimize:
-                # Automatic bitrate calculation to hit target file size
-                # Use user-provided real duration instead of ffprobe (since metadata duration may differ)
-                duration_seconds = 3.0  # default fallback
-                
-                if real_duration:
-                    try:
-                        duration_seconds = float(real_duration)
-                        if duration_seconds <= 0:
-                            return jsonify({'error': 'Real duration must be positive'}), 400
-                    except ValueError:
-                        return jsonify({'error': 'Invalid real duration value'}), 400
-                
-                try:
-                    target_size_bytes = max(1, int(float(target_size_kb) * 1024))
-                except ValueError:
-                    return jsonify({'error': 'Invalid target size value'}), 400
-                
-                # Reserve margin for container overhead and encoder variance (~42%)
-                # VP9 with alpha and WebM container adds overhead
-                target_video_bits = max(int(target_size_bytes * 8 * 0.58), 8000)
-                video_bitrate = max(int(target_video_bits / duration_seconds), 20000)  # bits per second
-                
-                ffmpeg_cmd.extend([
-                    '-b:v', str(video_bitrate),
-                    '-maxrate', str(video_bitrate),
-                    '-bufsize', str(int(video_bitrate * 1.5))
-                ])
-            else:
-                # Manual bitrate selection with CRF for quality control
-                ffmpeg_cmd.extend([
-                    '-crf', str(crf_value),
-                    '-b:v', bitrate
-                ])
-            
-            # Common parameters
-            ffmpeg_cmd.extend([
-                '-an',
-                '-metadata:s:v:0', 'alpha_mode=1',
-                '-y',
-                output_path
-            ])
-            
-            # Run FFmpeg
-            result = subprocess.run(
-                ffmpeg_cmd,
-                capture_output=True,
-                text=True,
-                timeout=300  # 5 minute timeout
-            )
-            
-            if result.returncode != 0:
-                return jsonify({'error': f'FFmpeg error: {result.stderr}'}), 500
-            
-            # Read compressed file
-            with open(output_path, 'rb') as f:
-                compressed_data = bytearray(f.read())
-            
-            # Clean up temp files
-            os.unlink(input_path)
-            os.unlink(output_path)
-            
-            # Modify duration if provided
-            if duration_ms:
-                try:
-                    duration_value = float(duration_ms)
-                    if duration_value < 0:
-                        return jsonify({'error': 'Duration must be non-negative'}), 400
-                    
-                    # Search for EBML Duration tag (0x4489)
-                    tag_found = False
-                    tag_position = -1
-                    
-                    for i in range(len(compressed_data) - 1):
-                        if compressed_data[i] == 0x44 and compressed_data[i + 1] == 0x89:
-                            tag_position = i
-                            tag_found = True
-                            break
-                    
-                    if tag_found and tag_position + 2 < len(compressed_data):
-                        size_byte = compressed_data[tag_position + 2]
-                        
-                        # Determine float size based on EBML size byte
-                        if size_byte == 0x88:
-                            float_size = 8
-                            pack_format = '>d'
-                        elif size_byte == 0x84:
-                            float_size = 4
-                            pack_format = '>f'
-                        else:
-                            float_size = 0  # Skip duration modification if unknown format
-                        
-                        if float_size > 0:
-                            duration_offset = tag_position + 3
-                            
-                            if duration_offset + float_size <= len(compressed_data):
-                                duration_seconds = duration_value / 1000.0
-                                duration_bytes = struct.pack(pack_format, duration_seconds)
-                                
-                                for i in range(float_size):
-                                    compressed_data[duration_offset + i] = duration_bytes[i]
-                
-                except ValueError:
-                    return jsonify({'error': 'Invalid duration value'}), 400
-            
-            # Create response
-            compressed_file = io.BytesIO(bytes(compressed_data))
-            compressed_file.seek(0)
+            keyframe_interval = int(keyframe_interval)
+            if keyframe_interval < 1:
+                return jsonify({'error': 'Keyframe interval must be at least 1 frame'}), 400
+        except ValueError:
+            return jsonify({'error': 'Invalid keyframe interval value'}), 400
+        
+        if alt_ref not in ('off', 'auto'):
+            return jsonify({'error': f'Unknown alt-ref mode: {alt_ref}'}), 400
+        
+        try:
+            autocrop_align = int(autocrop_align)
+            if autocrop_align not in (2, 4, 8, 16, 32, 64):
+                return jsonify({'error': 'Crop alignment must be one of 2, 4, 8, 16, 32, 64'}), 400
+        except ValueError:
+            return jsonify({'error': 'Invalid crop alignment value'}), 400
+        
+        real_duration_seconds = None
+        if real_duration:
+            try:
+                real_duration_seconds = float(real_duration)
+                if real_duration_seconds <= 0:
+                    return jsonify({'error': 'Real duration must be positive'}), 400
+            except ValueError:
+                return jsonify({'error': 'Invalid real duration value'}), 400
+        
+        target_size_bytes = None
+        if auto_optimize:
+            try:
+                target_size_bytes = max(1, int(float(target_size_kb) * 1024))
+            except ValueError:
+                return jsonify({'error': 'Invalid target size value'}), 400
+        
+        if duration_ms:
+            try:
+                duration_ms = float(duration_ms)
+            except ValueError:
+                return jsonify({'error': 'Invalid duration value'}), 400
+            if duration_ms < 0:
+                return jsonify({'error': 'Duration must be non-negative'}), 400
+        else:
+            duration_ms = None
+        
+        # ffmpeg reads a spooled upload where it is; small ones are saved first
+        input_path = upload_path(file)
+        temp_paths = []
+        if input_path is None:
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.webm') as temp_input:
+                file.save(temp_input.name)
+                input_path = temp_input.name
+            temp_paths.append(input_path)
+        
+        try:
+            options = {
+                'decimate': decimate,
+                'autocrop': autocrop,
+                'autocrop_align': autocrop_align,
+                'alpha_cleanup': alpha_cleanup,
+                'denoise': denoise,
+                'keyframe_policy': keyframe_policy,
+                'keyframe_interval': keyframe_interval,
+                'alt_ref': alt_ref,
+                'target_size_bytes': target_size_bytes,
+                'crf': crf_value,
+                'bitrate': bitrate,
+                'real_duration': real_duration_seconds,
+                'denoise_report': denoise_report,
+                'slim': slim,
+                'duration_ms': duration_ms
+            }
+            compressed_data, report = webm_core.compress_webm(input_path, options)
             
             original_filename = secure_filename(file.filename or 'video')
             name_without_ext = os.path.splitext(original_filename)[0]
             download_filename = f"{name_without_ext}_compressed.webm"
             
-            return send_file(
-                compressed_file,
-                mimetype='video/webm',
-                as_attachment=True,
-                download_name=download_filename
-            )
+            response = buffer_response(compressed_data, download_filename)
+            response.headers['X-Compress-Report'] = json.dumps(report)
+            return response
+        
+        except webm_core.EncodeError as e:
+            return jsonify({'error': str(e)}), 500
         
         except subprocess.TimeoutExpired:
-            if os.path.exists(input_path):
-                os.unlink(input_path)
-            if os.path.exists(output_path):
-                os.unlink(output_path)
             return jsonify({'error': 'Compression timeout (max 5 minutes)'}), 500
         
-        except Exception as e:
-            if os.path.exists(input_path):
-                os.unlink(input_path)
-            if os.path.exists(output_path):
-                os.unlink(output_path)
-            raise e
+        finally:
+            # Clean up temp files
+            for path in temp_paths:
+                if os.path.exists(path):
+                    os.unlink(path)
     
     except Exception as e:
         return jsonify({'error': f'Compression failed: {str(e)}'}), 500
 
+# Run planned stickers on a process pool and yield the output zip as each
+# one completes. Header-only edits are submitted first, then encodes from
+# the most to the least expensive, so the long ones start early and the
+# pool drains evenly. pack_report.json goes last.
+def stream_pack(stickers, limits):
+    started = time.monotonic()
+    order = sorted(stickers, key=lambda sticker: (sticker[2]['mode'] != 'edit', -sticker[2]['cost']))
+    stream = ZipStream()
+    reports = {}
+    pool = get_pack_pool()
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_STORED) as archive:
+        futures = {}  # future: (name, plan)
+        for name, data, plan in order:
+            try:
+                future = pool.submit(webm_core.build_sticker, name, data, plan, limits)
+            except concurrent.futures.BrokenExecutor as e:
+                future = concurrent.futures.Future()
+                future.set_exception(e)
+            futures[future] = (name, plan)
+        # A job that could not be sent to or returned from a worker (a
+        # pickling error, a killed process, no memory) fails alone
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                name, data, report = future.result()
+            except Exception as e:
+                if isinstance(e, concurrent.futures.BrokenExecutor):
+                    discard_pack_pool(pool)
+                name, plan = futures[future]
+                data, report = None, dict(plan, error=f'Encode failed: {e}', seconds=0)
+            reports[name] = report
+            if data is not None:
+                archive.writestr(name, bytes(data))
+                yield stream.drain()
+        wall_seconds = time.monotonic() - started
+        busy_seconds = sum(report['seconds'] for report in reports.values())
+        archive.writestr('pack_report.json', json.dumps({
+            'limits': limits,
+            'workers': PACK_WORKERS,
+            'wall_seconds': round(wall_seconds, 3),
+            'busy_seconds': round(busy_seconds, 3),
+            'pool_utilization': round(busy_seconds / (wall_seconds * PACK_WORKERS), 3) if wall_seconds else None,
+            'stickers': reports,
+        }, indent=2))
+    yield stream.drain()
+
+@app.route('/pack', methods=['POST'])
+def pack_stickers():
+    try:
+        inputs, archive_name, error = batch_inputs()
+        if error:
+            return jsonify({'error': error}), 400
+        
+        try:
+            limits = {
+                'max_kb': float(request.form.get('max_kb', webm_core.PACK_MAX_KB)),  # Size limit per sticker
+                'max_px': int(request.form.get('max_px', webm_core.PACK_MAX_PX)),  # Longer side limit
+                'max_ms': float(request.form.get('max_duration_ms', webm_core.PACK_MAX_MS)),  # Length limit
+            }
+        except ValueError:
+            return jsonify({'error': 'Invalid pack limit value'}), 400
+        if min(limits.values()) <= 0:
+            return jsonify({'error': 'Pack limits must be positive'}), 400
+        
+        # Planning only reads container headers, so bad files are reported
+        # before any encode starts
+        stickers = []
+        for name, source, read in inputs:
+            try:
+                data = read()
+                stickers.append((name, data, webm_core.plan_sticker(data, limits)))
+            except (zipfile.BadZipFile, zlib.error, ebml.EBMLError) as e:
+                return jsonify({'error': f'{source}: {e}'}), 400
+        
+        response = Response(stream_with_context(stream_pack(stickers, limits)), mimetype='application/zip')
+        response.headers['Content-Disposition'] = f'attachment; filename="{archive_name}_pack.zip"'
+        return response
+    
+    except Exception as e:
+        return jsonify({'error': f'Pack failed: {str(e)}'}), 500
+
 @app.after_request
 def add_header(response):
     # Disable caching for development
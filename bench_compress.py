@@ -0,0 +1,98 @@
+import os
+import sys
+import json
+import glob
+import argparse
+import tempfile
+
+from webm_core import plan_filters, build_encode_cmd, run_encode
+
+# Named option sets benchmarked against the plain encode.
+# Each entry is passed to plan_filters() exactly like the /compress form options.
+VARIANTS = {
+    'baseline': {},
+    'alpha-zero': {'alpha_cleanup': 'zero'},
+    'alpha-edge': {'alpha_cleanup': 'edge'},
+    'kf-single': {'keyframe_policy': 'single'},
+    'kf-scene': {'keyframe_policy': 'scene'},
+    'kf-interval-30': {'keyframe_policy': 'interval', 'keyframe_interval': 30},
+    'kf-scene-altref': {'keyframe_policy': 'scene', 'alt_ref': 'auto'},
+}
+
+def encode_variant(input_path, options, rate_args):
+    report = {}
+    output_path = tempfile.mktemp(suffix='_bench.webm')
+    try:
+        try:
+            video_filters, extra_args = plan_filters(input_path, options, report)
+        except RuntimeError as e:
+            return {'error': str(e).splitlines()[:1]}
+        cmd = build_encode_cmd(input_path, output_path, video_filters, rate_args, extra_args)
+        result, encode_time = run_encode(cmd)
+        if result.returncode != 0:
+            return {'error': result.stderr.strip().splitlines()[-1:]}
+        report['bytes'] = os.path.getsize(output_path)
+        report['encode_seconds'] = round(encode_time, 3)
+        return report
+    finally:
+        if os.path.exists(output_path):
+            os.unlink(output_path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark /compress prefilter variants over a sticker corpus')
+    parser.add_argument('corpus', help='Directory (searched recursively) or glob of .webm files')
+    parser.add_argument('--variants', default=','.join(VARIANTS), help='Comma-separated variant names')
+    parser.add_argument('--crf', default='30')
+    parser.add_argument('--bitrate', default='500k')
+    parser.add_argument('--json', help='Write the full per-file results to this path')
+    args = parser.parse_args()
+
+    if os.path.isdir(args.corpus):
+        files = sorted(glob.glob(os.path.join(args.corpus, '**', '*.webm'), recursive=True))
+    else:
+        files = sorted(glob.glob(args.corpus))
+    variants = [name.strip() for name in args.variants.split(',') if name.strip()]
+    unknown = [name for name in variants if name not in VARIANTS]
+    if unknown:
+        parser.error(f'Unknown variants: {", ".join(unknown)} (known: {", ".join(VARIANTS)})')
+    if 'baseline' not in variants:
+        variants.insert(0, 'baseline')
+    if not files:
+        parser.error('No .webm files found')
+
+    rate_args = ['-crf', args.crf, '-b:v', args.bitrate]
+    results = {}
+    totals = {name: 0 for name in variants}
+    times = {name: 0.0 for name in variants}
+
+    for path in files:
+        results[path] = {}
+        for name in variants:
+            report = encode_variant(path, VARIANTS[name], rate_args)
+            results[path][name] = report
+        baseline = results[path]['baseline'].get('bytes')
+        cells = []
+        for name in variants:
+            report = results[path][name]
+            if 'bytes' not in report:
+                cells.append(f'{name}=error')
+                continue
+            if baseline and all('bytes' in results[path][v] for v in variants):
+                totals[name] += report['bytes']
+                times[name] += report['encode_seconds']
+            change = (report['bytes'] / baseline - 1) * 100 if baseline else 0.0
+            cells.append(f'{name}={report["bytes"]}B ({change:+.1f}%)' if name != 'baseline' else f'{name}={report["bytes"]}B')
+        print(f'{os.path.basename(path)}: ' + '  '.join(cells))
+
+    print()
+    print(f'{"variant":<18}{"total bytes":>14}{"vs baseline":>14}{"encode s":>12}')
+    for name in variants:
+        change = (totals[name] / totals['baseline'] - 1) * 100 if totals['baseline'] else 0.0
+        print(f'{name:<18}{totals[name]:>14}{change:>+13.2f}%{times[name]:>12.2f}')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'files': results, 'totals': totals, 'encode_seconds': times}, f, indent=2)
+
+if __name__ == '__main__':
+    sys.exit(main())
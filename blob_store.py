@@ -0,0 +1,115 @@
+# Content-addressed scratch store: files are kept under their SHA-256, so a
+# file uploaded once can be processed many times by that hash (its handle).
+# Using an entry refreshes it. Entries unused for longer than the TTL are
+# dropped, then the least recently used go first while the store is over its
+# size cap.
+import os
+import re
+import time
+import uuid
+import hashlib
+import threading
+
+import local_patch
+
+READ_SIZE = 64 * 1024
+HASH_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+class BlobError(ValueError):
+    pass
+
+class BlobStore:
+    def __init__(self, directory, max_bytes, ttl_seconds=6 * 3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, digest):
+        if not HASH_PATTERN.match(digest or ''):
+            raise BlobError('Invalid file handle')
+        return os.path.join(self.directory, digest)
+
+    # Size of the stored file, or None; a hit counts as a use
+    def lookup(self, digest):
+        path = self._path(digest)
+        try:
+            os.utime(path)
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            return None
+
+    # Path of the stored file for reading
+    def path(self, digest):
+        if self.lookup(digest) is None:
+            raise BlobError('Unknown file handle (expired or never uploaded)')
+        return self._path(digest)
+
+    # Store everything read from `stream`. Returns (digest, size, existed).
+    def put_stream(self, stream):
+        temp_path = os.path.join(self.directory, f'.tmp-{uuid.uuid4().hex}')
+        hasher = hashlib.sha256()
+        size = 0
+        try:
+            with open(temp_path, 'wb') as f:
+                while True:
+                    block = stream.read(READ_SIZE)
+                    if not block:
+                        break
+                    hasher.update(block)
+                    f.write(block)
+                    size += len(block)
+            return self._commit(temp_path, hasher.hexdigest(), size)
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+
+    # Store a copy of the file at `path` whose SHA-256 is already known,
+    # cloned where the filesystem allows. Never a hard link: an entry's
+    # modification time is its last use and must not be shared with `path`.
+    def put_file(self, path, digest):
+        temp_path = os.path.join(self.directory, f'.tmp-{uuid.uuid4().hex}')
+        try:
+            with open(path, 'rb') as source, open(temp_path, 'wb') as target:
+                local_patch.clone_into(source.fileno(), target.fileno())
+            return self._commit(temp_path, digest, os.path.getsize(temp_path))
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+
+    def _commit(self, temp_path, digest, size):
+        path = self._path(digest)
+        existed = self.lookup(digest) is not None
+        if not existed:
+            os.replace(temp_path, path)
+        self.evict(keep=digest)
+        return digest, size, existed
+
+    # Apply the TTL, then the size cap, never removing `keep`
+    def evict(self, keep=None):
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.directory):
+                if not HASH_PATTERN.match(name):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+            entries.sort()
+            if not entries:
+                return
+            cutoff = time.time() - self.ttl_seconds
+            total = sum(size for _, size, _ in entries)
+            for mtime, size, name in entries:
+                if name == keep:
+                    continue
+                if mtime >= cutoff and total <= self.max_bytes:
+                    break
+                try:
+                    os.unlink(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+                total -= size
@@ -0,0 +1,1092 @@
+# Minimal EBML/Matroska reader and container edits for WebM. Encoding and
+# serialization live in ebml_writer.
+#
+# Offsets are absolute byte offsets into the file. Positions stored inside the
+# file (SeekHead, Cues) are relative to the start of the Segment payload.
+import struct
+import zlib
+
+from ebml_writer import (
+    EBMLError, Master, Raw, Leaf, vint_width, encode_vint, encode_id, encode_uint, encode_element,
+    uint_element, float_element, void_element, pack_into,
+)
+
+# Element IDs, including their length-marker bits as they appear in the file
+EBML_HEADER = 0x1A45DFA3
+DOC_TYPE = 0x4282
+SEGMENT = 0x18538067
+SEEK_HEAD = 0x114D9B74
+SEEK = 0x4DBB
+SEEK_ID = 0x53AB
+SEEK_POSITION = 0x53AC
+INFO = 0x1549A966
+TIMESTAMP_SCALE = 0x2AD7B1
+DURATION = 0x4489
+MUXING_APP = 0x4D80
+WRITING_APP = 0x5741
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_NUMBER = 0xD7
+TRACK_TYPE = 0x83
+CODEC_ID = 0x86
+CODEC_PRIVATE = 0x63A2
+LANGUAGE = 0x22B59C
+DEFAULT_DURATION = 0x23E383
+VIDEO = 0xE0
+PIXEL_WIDTH = 0xB0
+PIXEL_HEIGHT = 0xBA
+DISPLAY_WIDTH = 0x54B0
+DISPLAY_HEIGHT = 0x54BA
+ALPHA_MODE = 0x53C0
+CLUSTER = 0x1F43B675
+TIMESTAMP = 0xE7
+POSITION = 0xA7
+PREV_SIZE = 0xAB
+SIMPLE_BLOCK = 0xA3
+BLOCK_GROUP = 0xA0
+BLOCK = 0xA1
+BLOCK_DURATION = 0x9B
+REFERENCE_BLOCK = 0xFB
+CUES = 0x1C53BB6B
+CUE_POINT = 0xBB
+CUE_TIME = 0xB3
+CUE_TRACK_POSITIONS = 0xB7
+CUE_TRACK = 0xF7
+CUE_CLUSTER_POSITION = 0xF1
+CUE_RELATIVE_POSITION = 0xF0
+CUE_DURATION = 0xB2
+TAGS = 0x1254C367
+CHAPTERS = 0x1043A770
+ATTACHMENTS = 0x1941A469
+VOID = 0xEC
+CRC32 = 0xBF
+
+# Children of the Segment. An unknown-size element ends where one of these
+# (or a new EBML stream) starts.
+LEVEL1_IDS = {SEEK_HEAD, INFO, TRACKS, CLUSTER, CUES, TAGS, CHAPTERS, ATTACHMENTS}
+
+DEFAULT_TIMESTAMP_SCALE = 1000000  # nanoseconds per tick when Info has none
+
+# TrackEntry flags and values with their Matroska defaults: FlagEnabled,
+# FlagDefault, FlagForced, FlagLacing, MinCache, CodecDecodeAll, CodecDelay,
+# SeekPreRoll
+TRACK_DEFAULTS = {0xB9: 1, 0x88: 1, 0x55AA: 0, 0x9C: 1, 0x6DE7: 0, 0xAA: 1, 0x56AA: 0, 0x56BB: 0}
+
+class Element:
+    __slots__ = ('id', 'offset', 'header_size', 'size', 'size_width', 'unknown_size')
+
+    def __init__(self, element_id, offset, header_size, size, size_width, unknown_size=False):
+        self.id = element_id
+        self.offset = offset
+        self.header_size = header_size
+        self.size = size
+        self.size_width = size_width
+        self.unknown_size = unknown_size
+
+    @property
+    def data_offset(self):
+        return self.offset + self.header_size
+
+    @property
+    def end(self):
+        return self.data_offset + self.size
+
+    def __repr__(self):
+        return f'Element(0x{self.id:X}, offset={self.offset}, size={self.size})'
+
+# Reading
+
+# Returns (value, length) of the variable-size integer at pos, marker bit removed
+def read_vint(data, pos):
+    if pos >= len(data):
+        raise EBMLError(f'Truncated element header at offset {pos}')
+    first = data[pos]
+    if first == 0:
+        raise EBMLError(f'Invalid variable-size integer at offset {pos}')
+    length = 9 - first.bit_length()
+    if pos + length > len(data):
+        raise EBMLError(f'Truncated element header at offset {pos}')
+    value = first & (0xFF >> length)
+    for byte in data[pos + 1:pos + length]:
+        value = (value << 8) | byte
+    return value, length
+
+# Returns (id, length); IDs keep their marker bits
+def read_id(data, pos):
+    if pos >= len(data):
+        raise EBMLError(f'Truncated element header at offset {pos}')
+    first = data[pos]
+    length = 9 - first.bit_length()
+    if first == 0 or length > 4:
+        raise EBMLError(f'Invalid element ID at offset {pos}')
+    if pos + length > len(data):
+        raise EBMLError(f'Truncated element header at offset {pos}')
+    return int.from_bytes(data[pos:pos + length], 'big'), length
+
+# Element header at pos; size is None when the element has unknown size
+def read_element(data, pos):
+    element_id, id_length = read_id(data, pos)
+    size, size_width = read_vint(data, pos + id_length)
+    if size == (1 << (7 * size_width)) - 1:
+        return Element(element_id, pos, id_length + size_width, None, size_width, unknown_size=True)
+    return Element(element_id, pos, id_length + size_width, size, size_width)
+
+# End offset of an unknown-size element: the first Level 1 (or higher) ID
+# after its children, or `limit`
+def _unknown_size_end(data, element, limit):
+    pos = element.data_offset
+    while pos < limit:
+        child_id, _ = read_id(data, pos)
+        if child_id in LEVEL1_IDS or child_id in (EBML_HEADER, SEGMENT):
+            return pos
+        child = read_element(data, pos)
+        if child.size is None:
+            raise EBMLError(f'Nested unknown-size element at offset {pos}')
+        pos = child.end
+    return limit
+
+# Child elements in [start, end). Unknown sizes are resolved by scanning.
+def iter_elements(data, start, end):
+    pos = start
+    while pos < end:
+        element = read_element(data, pos)
+        if element.size is None:
+            element.size = _unknown_size_end(data, element, end) - element.data_offset
+        elif element.end > end:
+            raise EBMLError(f'Element 0x{element.id:X} at offset {pos} overruns its parent')
+        yield element
+        pos = element.end
+
+def children(data, parent):
+    return iter_elements(data, parent.data_offset, parent.end)
+
+def find_child(data, parent, element_id):
+    for child in children(data, parent):
+        if child.id == element_id:
+            return child
+    return None
+
+def read_uint(data, element):
+    return int.from_bytes(data[element.data_offset:element.end], 'big')
+
+def read_float(data, element):
+    if element.size == 8:
+        return struct.unpack('>d', data[element.data_offset:element.end])[0]
+    if element.size == 4:
+        return struct.unpack('>f', data[element.data_offset:element.end])[0]
+    if element.size == 0:
+        return 0.0
+    raise EBMLError(f'Invalid float size {element.size} at offset {element.offset}')
+
+def read_string(data, element):
+    return bytes(data[element.data_offset:element.end]).rstrip(b'\0').decode('utf-8', 'replace')
+
+# The Segment and its Level 1 children
+def parse_segment(data):
+    if bytes(data[:4]) != encode_id(EBML_HEADER):
+        raise EBMLError('Not an EBML file (missing EBML header)')
+    pos = 0
+    while pos < len(data):
+        element = read_element(data, pos)
+        if element.id == SEGMENT:
+            if element.size is None or element.end > len(data):
+                element.size = len(data) - element.data_offset
+            return element, list(children(data, element))
+        if element.size is None:
+            break
+        pos = element.end
+    raise EBMLError('Segment element not found')
+
+# (track_number, relative_timecode, flags, header_length) of a SimpleBlock or Block
+def read_block_header(data, element):
+    track, track_length = read_vint(data, element.data_offset)
+    pos = element.data_offset + track_length
+    if pos + 3 > element.end:
+        raise EBMLError(f'Truncated block header at offset {element.offset}')
+    timecode = int.from_bytes(data[pos:pos + 2], 'big', signed=True)
+    return track, timecode, data[pos + 2], track_length + 3
+
+# TrackEntry children by track number: {number: {element_id: element}}
+def track_entries(data, level1):
+    tracks = first_child(level1, TRACKS)
+    entries = {}
+    if tracks is None:
+        return entries
+    for entry in children(data, tracks):
+        if entry.id != TRACK_ENTRY:
+            continue
+        fields = {child.id: child for child in children(data, entry)}
+        if TRACK_NUMBER in fields:
+            entries[read_uint(data, fields[TRACK_NUMBER])] = fields
+    return entries
+
+# Track number of the first video track, or None when Tracks is missing
+def video_track_number(data, level1):
+    for number, fields in track_entries(data, level1).items():
+        if TRACK_TYPE in fields and read_uint(data, fields[TRACK_TYPE]) == 1:
+            return number
+    return None
+
+def timestamp_scale(data, level1):
+    info = first_child(level1, INFO)
+    scale = find_child(data, info, TIMESTAMP_SCALE) if info is not None else None
+    return read_uint(data, scale) if scale is not None else DEFAULT_TIMESTAMP_SCALE
+
+# Every frame as (timestamp, track, keyframe, cluster, element, block), where
+# element is the SimpleBlock or BlockGroup and block the (Simple)Block itself.
+# BlockGroups count as keyframes when they carry no ReferenceBlock.
+def iter_blocks(data, level1):
+    for cluster in level1:
+        if cluster.id != CLUSTER:
+            continue
+        cluster_time = 0
+        for child in children(data, cluster):
+            if child.id == TIMESTAMP:
+                cluster_time = read_uint(data, child)
+                continue
+            if child.id == SIMPLE_BLOCK:
+                block = child
+                track, timecode, flags, _ = read_block_header(data, child)
+                keyframe = bool(flags & 0x80)
+            elif child.id == BLOCK_GROUP:
+                block = None
+                keyframe = True
+                for field in children(data, child):
+                    if field.id == BLOCK:
+                        block = field
+                    elif field.id == REFERENCE_BLOCK:
+                        keyframe = False
+                if block is None:
+                    continue
+                track, timecode, _, _ = read_block_header(data, block)
+            else:
+                continue
+            yield cluster_time + timecode, track, keyframe, cluster, child, block
+
+# Keyframes as (timestamp, track, cluster_element, block_element)
+def iter_keyframes(data, level1, track=None):
+    for timestamp, block_track, keyframe, cluster, element, _ in iter_blocks(data, level1):
+        if keyframe and (track is None or block_track == track):
+            yield timestamp, block_track, cluster, element
+
+# iter_blocks() with each frame's length in ticks appended: its
+# BlockDuration, else its track's DefaultDuration, else the gap to the
+# track's frame before it
+def iter_timed_blocks(data, level1):
+    scale = timestamp_scale(data, level1)
+    default_durations = {
+        number: read_uint(data, fields[DEFAULT_DURATION]) / scale
+        for number, fields in track_entries(data, level1).items()
+        if DEFAULT_DURATION in fields
+    }
+    previous = {}
+    for frame in iter_blocks(data, level1):
+        timestamp, track, _, _, element, _ = frame
+        length = None
+        if element.id == BLOCK_GROUP:
+            block_duration = find_child(data, element, BLOCK_DURATION)
+            if block_duration is not None:
+                length = read_uint(data, block_duration)
+        if length is None:
+            length = default_durations.get(track, timestamp - previous.get(track, timestamp))
+        previous[track] = timestamp
+        yield frame + (length,)
+
+# Playback length in TimestampScale ticks: the end of the last frame
+def content_duration(data, level1):
+    return max((frame[0] + frame[-1] for frame in iter_timed_blocks(data, level1)), default=0)
+
+def first_child(elements, element_id):
+    for element in elements:
+        if element.id == element_id:
+            return element
+    return None
+
+# Checksums
+
+# Recompute a CRC-32 child (it must come first) over the rest of the parent's payload
+def refresh_crc(buffer, parent_data_offset, parent_end):
+    crc = read_element(buffer, parent_data_offset)
+    if crc.id != CRC32 or crc.size != 4:
+        return
+    value = zlib.crc32(bytes(buffer[crc.end:parent_end])) & 0xFFFFFFFF
+    buffer[crc.data_offset:crc.end] = value.to_bytes(4, 'little')
+
+# Position fix-ups
+
+def _seek_entries(data, seek_head):
+    entries = []
+    for seek in children(data, seek_head):
+        if seek.id != SEEK:
+            continue
+        seek_id = position = None
+        for child in children(data, seek):
+            if child.id == SEEK_ID:
+                seek_id = bytes(data[child.data_offset:child.end])
+            elif child.id == SEEK_POSITION:
+                position = read_uint(data, child)
+        if seek_id is not None and position is not None:
+            entries.append((seek_id, position))
+    return entries
+
+def encode_seek_head(entries):
+    payload = b''.join(
+        encode_element(SEEK, encode_element(SEEK_ID, seek_id) + uint_element(SEEK_POSITION, position))
+        for seek_id, position in entries
+    )
+    return encode_element(SEEK_HEAD, payload)
+
+# SeekHead with every position mapped through `offsets` (old -> new relative
+# offset). Entries whose target is gone are dropped.
+def relocate_seek_head(data, seek_head, offsets):
+    entries = [
+        (seek_id, offsets[position])
+        for seek_id, position in _seek_entries(data, seek_head)
+        if position in offsets
+    ]
+    return encode_seek_head(entries)
+
+# Cues with every CueClusterPosition mapped through `offsets`. Cue points
+# into clusters that are gone are dropped.
+def relocate_cues(data, cues, offsets):
+    points = []
+    for point in children(data, cues):
+        if point.id != CUE_POINT:
+            continue
+        kept = []
+        has_positions = False
+        for child in children(data, point):
+            if child.id != CUE_TRACK_POSITIONS:
+                kept.append(bytes(data[child.offset:child.end]))
+                continue
+            fields = []
+            position = None
+            for field in children(data, child):
+                if field.id == CUE_CLUSTER_POSITION:
+                    position = offsets.get(read_uint(data, field))
+                    fields.append(None)
+                else:
+                    fields.append(bytes(data[field.offset:field.end]))
+            if position is None:
+                continue
+            kept.append(encode_element(CUE_TRACK_POSITIONS, b''.join(
+                uint_element(CUE_CLUSTER_POSITION, position) if field is None else field
+                for field in fields
+            )))
+            has_positions = True
+        if has_positions:
+            points.append(encode_element(CUE_POINT, b''.join(kept)))
+    return encode_element(CUES, b''.join(points))
+
+# Rebuild the Segment from `parts`, a list of (key, blob) pairs in output
+# order. key is the Level 1 element the part stands for, or a string tag for
+# new elements. blob is the new bytes, a callable taking the offsets map and
+# returning bytes, or None to reuse the original element (SeekHead and Cues
+# are relocated, anything else copied). The offsets map goes from original
+# relative offsets (and tags) to new relative offsets; the layout is iterated
+# until sizes settle. An unknown Segment size is kept unless `finalize` is set.
+# Returns the whole new file.
+def rebuild_segment(data, segment, parts, finalize=False):
+    base = segment.data_offset
+    view = memoryview(data)
+    keys = [key if isinstance(key, str) else key.offset - base for key, _ in parts]
+    root = Master(SEGMENT, size_width=segment.size_width, unknown=segment.unknown_size and not finalize)
+    dynamic = []
+    for key, blob in parts:
+        if blob is None and key.id == SEEK_HEAD:
+            blob = lambda offsets, key=key: relocate_seek_head(data, key, offsets)
+        elif blob is None and key.id == CUES:
+            blob = lambda offsets, key=key: relocate_cues(data, key, offsets)
+        if callable(blob):
+            node = Raw(b'')
+            dynamic.append((node, blob))
+        elif blob is None:
+            node = Raw(view, key.offset, key.end)
+        else:
+            node = Raw(blob)
+        root.append(node)
+
+    def update(offsets):
+        mapped = dict(zip(keys, offsets))
+        for node, blob in dynamic:
+            node.set(blob(mapped))
+
+    # Start from the original layout so positions usually settle in one pass
+    update([0 if isinstance(key, str) else key.offset - base for key, _ in parts])
+    root.settle(update)
+    return bytearray(b''.join([view[:segment.offset], *root.chunks(), view[segment.end:]]))
+
+# Write new SeekHead positions in place, keeping each field's width.
+# `moves` maps old -> new relative offsets. Returns False if one doesn't fit.
+def patch_seek_positions(data, segment_children, moves):
+    fields = []
+    for seek_head in segment_children:
+        if seek_head.id != SEEK_HEAD:
+            continue
+        for seek in children(data, seek_head):
+            if seek.id != SEEK:
+                continue
+            for child in children(data, seek):
+                if child.id == SEEK_POSITION and read_uint(data, child) in moves:
+                    new_position = moves[read_uint(data, child)]
+                    if new_position >= 1 << (8 * child.size):
+                        return False
+                    fields.append((child, new_position))
+    for child, new_position in fields:
+        data[child.data_offset:child.end] = new_position.to_bytes(child.size, 'big')
+    for seek_head in segment_children:
+        if seek_head.id == SEEK_HEAD:
+            refresh_crc(data, seek_head.data_offset, seek_head.end)
+    return True
+
+# Duration
+
+# Overwrite an existing Duration, or put a new one into a Void inside or next
+# to Info. Returns 'in-place', 'void', or None when Info has to grow.
+def _set_duration_in_place(data, segment, level1, value):
+    info = first_child(level1, INFO)
+    if info is None:
+        raise EBMLError('Segment Info element not found')
+
+    duration = find_child(data, info, DURATION)
+    if duration is not None:
+        if duration.size == 8:
+            data[duration.data_offset:duration.end] = struct.pack('>d', value)
+        elif duration.size == 4:
+            data[duration.data_offset:duration.end] = struct.pack('>f', value)
+        else:
+            raise EBMLError(f'Unexpected Duration size: {duration.size} bytes (expected 4 or 8)')
+        refresh_crc(data, info.data_offset, info.end)
+        return 'in-place'
+
+    element = float_element(DURATION, value)
+
+    # A Void inside Info can simply be swapped for the Duration
+    for void in children(data, info):
+        if void.id == VOID:
+            blob = pack_into(void.end - void.offset, DURATION, element[3:])
+            if blob is not None:
+                data[void.offset:void.end] = blob
+                refresh_crc(data, info.data_offset, info.end)
+                return 'void'
+
+    # A Void right before or after Info can absorb the growth. Info moves to
+    # the start of the combined span and the Void shrinks behind it.
+    info_payload = bytes(data[info.data_offset:info.end]) + element
+    index = level1.index(info)
+    for neighbour in (level1[index - 1] if index > 0 else None, level1[index + 1] if index + 1 < len(level1) else None):
+        if neighbour is None or neighbour.id != VOID:
+            continue
+        start = min(neighbour.offset, info.offset)
+        end = max(neighbour.end, info.end)
+        blob = pack_into(end - start, INFO, info_payload)
+        if blob is None:
+            continue
+        blob = bytearray(blob)
+        new_info = read_element(blob, 0)
+        refresh_crc(blob, new_info.data_offset, new_info.end)
+        moves = {info.offset - segment.data_offset: start - segment.data_offset}
+        if start != info.offset and not patch_seek_positions(data, level1, moves):
+            continue
+        data[start:end] = blob
+        return 'void'
+    return None
+
+# A master element for the rewrite path: the children at the offsets in
+# `fields` (nested ones included) swapped for new bytes, `extra` appended
+# and a leading CRC-32 recomputed
+def _with_fields(data, element, fields, extra=b''):
+    parts = []
+    for child in children(data, element):
+        if child.offset in fields:
+            parts.append(fields[child.offset])
+        elif any(child.data_offset <= offset < child.end for offset in fields):
+            parts.append(_with_fields(data, child, fields))
+        else:
+            parts.append(bytes(data[child.offset:child.end]))
+    payload = b''.join(parts) + extra
+    blob = bytearray(encode_element(element.id, payload))
+    refresh_crc(blob, len(blob) - len(payload), len(blob))
+    return blob
+
+# Level 1 elements lying wholly inside `data`, which may be only the head of
+# a file, up to the first Cluster. Returns (segment, level1, reached) where
+# reached tells whether the first Cluster (or the Segment end) was seen.
+def parse_head(data):
+    if bytes(data[:4]) != encode_id(EBML_HEADER):
+        raise EBMLError('Not an EBML file (missing EBML header)')
+    pos = 0
+    while True:
+        segment = read_element(data, pos)
+        if segment.id == SEGMENT:
+            break
+        if segment.size is None:
+            raise EBMLError('Segment element not found')
+        pos = segment.end
+    level1 = []
+    pos = segment.data_offset
+    while segment.size is None or pos < segment.end:
+        try:
+            element = read_element(data, pos)
+        except EBMLError:
+            if len(data) - pos >= 12:
+                raise
+            return segment, level1, False  # header cut off by the end of the head
+        if element.id == CLUSTER:
+            return segment, level1, True
+        if element.size is None or element.end > len(data):
+            return segment, level1, False
+        level1.append(element)
+        pos = element.end
+    return segment, level1, True
+
+# Byte ranges where `new` differs from `old` (same length) as (offset, bytes),
+# merging runs less than `gap` bytes apart
+def byte_patches(old, new, gap=8):
+    patches = []
+    pos = 0
+    while pos < len(new):
+        if old[pos] == new[pos]:
+            pos += 1
+            continue
+        start = end = pos
+        while pos < len(new) and pos - end < gap:
+            if old[pos] != new[pos]:
+                end = pos + 1
+            pos += 1
+        patches.append((start, bytes(new[start:end])))
+    return patches
+
+# Duration patch worked out from the head of a file alone (everything up to
+# the first Cluster is enough). Returns (patches, method) with patches as
+# (offset, bytes) to write over the original file. Raises EBMLError when the
+# edit needs more than the head: Info has to grow, or Info moves while a
+# SeekHead that points at it may lie outside the head.
+def duration_patch(head, value):
+    data = bytearray(head)
+    segment, level1, reached = parse_head(data)
+    info = first_child(level1, INFO)
+    if info is None:
+        raise EBMLError('Segment Info element not found in the file head')
+    method = _set_duration_in_place(data, segment, level1, value)
+    if method is None:
+        raise EBMLError('No room for the Duration in the file head')
+    if read_id(data, info.offset)[0] != INFO:
+        other_seek_heads = any(
+            seek_id == encode_id(SEEK_HEAD)
+            for element in level1 if element.id == SEEK_HEAD
+            for seek_id, _ in _seek_entries(data, element)
+        )
+        if not reached or other_seek_heads:
+            raise EBMLError('Info moved but a SeekHead may lie outside the file head')
+    return byte_patches(head, data), method
+
+# Unknown sizes
+
+# Write the real sizes of the unknown-size Segment and Clusters over their
+# all-ones markers. Returns False (touching nothing) if any marker is too
+# narrow to hold its real size.
+def _finalize_in_place(data, segment, level1):
+    targets = [element for element in [segment] + level1 if element.unknown_size]
+    if any(element.size >= (1 << (7 * element.size_width)) - 1 for element in targets):
+        return False
+    for element in targets:
+        data[element.data_offset - element.size_width:element.data_offset] = encode_vint(element.size, element.size_width)
+        element.unknown_size = False
+    return True
+
+# Header with a real size, at least as wide as the original marker
+def _finalized_header(data, element):
+    width = max(element.size_width, vint_width(element.size))
+    return bytes(data[element.offset:element.data_offset - element.size_width]) + encode_vint(element.size, width)
+
+# Cues
+
+def _cue_point(time, track, cluster_position, relative_position):
+    return encode_element(CUE_POINT, uint_element(CUE_TIME, time) + encode_element(
+        CUE_TRACK_POSITIONS,
+        uint_element(CUE_TRACK, track)
+        + uint_element(CUE_CLUSTER_POSITION, cluster_position)
+        + uint_element(CUE_RELATIVE_POSITION, relative_position)
+    ))
+
+# A Cues element with one CuePoint per video keyframe, in the original
+# layout's positions (rebuild_segment relocates them). None if there are no
+# keyframes to index.
+def build_cues(data, segment, level1):
+    track = video_track_number(data, level1)
+    points = [
+        _cue_point(max(timestamp, 0), block_track, cluster.offset - segment.data_offset, block.offset - cluster.data_offset)
+        for timestamp, block_track, cluster, block in iter_keyframes(data, level1, track)
+    ]
+    if not points:
+        return None
+    return encode_element(CUES, b''.join(points))
+
+def _payload(blob):
+    element = read_element(blob, 0)
+    return blob[element.data_offset:element.end]
+
+# Put new Cues into a Void ahead of the first Cluster, pointing the SeekHead
+# at them in place, and blank out the old Cues. Returns False, touching
+# nothing, when there is no room.
+def _cues_in_place(data, segment, level1, cues):
+    seek_head = first_child(level1, SEEK_HEAD)
+    first_cluster = first_child(level1, CLUSTER)
+    if seek_head is None or first_cluster is None:
+        return False
+    base = segment.data_offset
+    cues_id = encode_id(CUES)
+    old_positions = [position for seek_id, position in _seek_entries(data, seek_head) if seek_id == cues_id]
+    index = level1.index(seek_head)
+    seek_void = level1[index + 1] if index + 1 < len(level1) and level1[index + 1].id == VOID else None
+
+    for void in reversed([element for element in level1 if element.id == VOID and element.offset < first_cluster.offset]):
+        blob = pack_into(void.end - void.offset, CUES, _payload(cues))
+        if blob is None:
+            continue
+        new_position = void.offset - base
+        if old_positions:
+            if not patch_seek_positions(data, level1, {position: new_position for position in old_positions}):
+                return False
+        else:
+            # Grow the SeekHead into the Void right behind it
+            if seek_void is None or seek_void is void:
+                continue
+            entries = _seek_entries(data, seek_head) + [(cues_id, new_position)]
+            seek_blob = pack_into(seek_void.end - seek_head.offset, SEEK_HEAD, _payload(encode_seek_head(entries)))
+            if seek_blob is None:
+                return False
+            data[seek_head.offset:seek_void.end] = seek_blob
+        data[void.offset:void.end] = blob
+        for old in level1:
+            if old.id == CUES:
+                data[old.offset:old.end] = void_element(old.end - old.offset)
+        return True
+    return False
+
+# Parts for a rebuild with the new Cues right before the first Cluster, old
+# Cues dropped and the SeekHead (created if missing) pointing at them
+def _parts_with_cues(data, segment, level1, parts, cues):
+    cues_id = encode_id(CUES)
+    seek_head = first_child(level1, SEEK_HEAD)
+
+    def new_cues(offsets):
+        return relocate_cues(cues, read_element(cues, 0), offsets)
+
+    def new_seek_head(offsets):
+        if seek_head is not None:
+            entries = [
+                (seek_id, offsets[position])
+                for seek_id, position in _seek_entries(data, seek_head)
+                if seek_id != cues_id and position in offsets
+            ]
+        else:
+            entries = [
+                (encode_id(key.id), offsets[key.offset - segment.data_offset])
+                for key, _ in parts
+                if not isinstance(key, str) and key.id in LEVEL1_IDS and key.id not in (CLUSTER, CUES)
+            ]
+        return encode_seek_head(entries + [(cues_id, offsets['cues'])])
+
+    result = [] if seek_head is not None else [('seek_head', new_seek_head)]
+    placed = False
+    for key, blob in parts:
+        if key.id == CUES:
+            continue
+        if key.id == CLUSTER and not placed:
+            result.append(('cues', new_cues))
+            placed = True
+        result.append((key, new_seek_head if key is seek_head else blob))
+    if not placed:
+        result.append(('cues', new_cues))
+    return result
+
+# Retiming
+
+# Scale every timestamp by `factor` in place, leaving the frames untouched.
+#   'timestamps' rewrites Cluster Timestamps, block timecodes, BlockDurations
+#                and CueTimes, keeping TimestampScale (and so the usual 1 ms
+#                ticks players expect)
+#   'scale'      changes TimestampScale alone, which moves every timestamp
+# Both scale the tracks' DefaultDuration. Returns False, touching nothing,
+# when a new value does not fit the existing field.
+def _retime_in_place(data, level1, factor, method):
+    writes = []
+
+    def put_uint(element, value):
+        if value < 0 or value >= 1 << (8 * element.size):
+            return False
+        writes.append((element.data_offset, value.to_bytes(element.size, 'big')))
+        return True
+
+    for fields in track_entries(data, level1).values():
+        if DEFAULT_DURATION in fields and not put_uint(fields[DEFAULT_DURATION], round(read_uint(data, fields[DEFAULT_DURATION]) * factor)):
+            return False
+
+    if method == 'scale':
+        info = first_child(level1, INFO)
+        scale = find_child(data, info, TIMESTAMP_SCALE) if info is not None else None
+        if scale is None or not put_uint(scale, max(round(read_uint(data, scale) * factor), 1)):
+            return False
+    else:
+        cluster_times = {}
+        for cluster in level1:
+            if cluster.id == CLUSTER:
+                timestamp = find_child(data, cluster, TIMESTAMP)
+                cluster_times[cluster.offset] = read_uint(data, timestamp) if timestamp is not None else 0
+                if timestamp is not None and not put_uint(timestamp, round(cluster_times[cluster.offset] * factor)):
+                    return False
+            elif cluster.id == CUES:
+                for point in children(data, cluster):
+                    for field in children(data, point):
+                        if field.id == CUE_TIME and not put_uint(field, round(read_uint(data, field) * factor)):
+                            return False
+                        if field.id != CUE_TRACK_POSITIONS:
+                            continue
+                        cue_duration = find_child(data, field, CUE_DURATION)
+                        if cue_duration is not None and not put_uint(cue_duration, round(read_uint(data, cue_duration) * factor)):
+                            return False
+        for timestamp, _, _, cluster, element, block in iter_blocks(data, level1):
+            timecode = round(timestamp * factor) - round(cluster_times[cluster.offset] * factor)
+            if not -0x8000 <= timecode <= 0x7FFF:
+                return False
+            track_length = read_vint(data, block.data_offset)[1]
+            writes.append((block.data_offset + track_length, timecode.to_bytes(2, 'big', signed=True)))
+            if element.id == BLOCK_GROUP:
+                block_duration = find_child(data, element, BLOCK_DURATION)
+                if block_duration is not None and not put_uint(block_duration, round(read_uint(data, block_duration) * factor)):
+                    return False
+
+    for offset, value in writes:
+        data[offset:offset + len(value)] = value
+    for element in level1:
+        if element.id in (INFO, TRACKS, CLUSTER, CUES):
+            refresh_crc(data, element.data_offset, element.end)
+    return True
+
+# New TimestampScale and DefaultDuration elements for a retime that does not
+# fit in place, as {offset: element} for _with_fields(). Cluster and block
+# timestamps keep their values, so no Cluster has to move.
+def _retimed_fields(data, level1, factor):
+    info = first_child(level1, INFO)
+    scale = find_child(data, info, TIMESTAMP_SCALE) if info is not None else None
+    if scale is None:
+        raise EBMLError('Retimed timestamps do not fit the existing fields')
+    values = [(scale, max(round(read_uint(data, scale) * factor), 1))]
+    for entry in track_entries(data, level1).values():
+        if DEFAULT_DURATION in entry:
+            values.append((entry[DEFAULT_DURATION], round(read_uint(data, entry[DEFAULT_DURATION]) * factor)))
+    if any(value >= 1 << 64 for _, value in values):
+        raise EBMLError('Retimed timestamps do not fit the existing fields')
+    return {field.offset: uint_element(field.id, value) for field, value in values}
+
+# Change real playback speed so the content lasts `seconds`, trying the
+# timestamp rewrite first and TimestampScale second, in place. When neither
+# fits, the TimestampScale is widened in a rewrite. Returns (method, fields)
+# where fields holds the rewrite's new elements (empty when done in place).
+def _retime(data, level1, seconds):
+    entries = track_entries(data, level1)
+    if any(TRACK_TYPE in fields and read_uint(data, fields[TRACK_TYPE]) == 2 for fields in entries.values()):
+        raise EBMLError('Audio tracks cannot be retimed without re-encoding')
+    current = content_duration(data, level1) * timestamp_scale(data, level1) / 1e9
+    if current <= 0:
+        raise EBMLError('No frames to retime')
+    if seconds <= 0:
+        raise EBMLError('Retime target must be positive')
+    for method in ('timestamps', 'scale'):
+        if _retime_in_place(data, level1, seconds / current, method):
+            return method, {}
+    return 'rewrite', _retimed_fields(data, level1, seconds / current)
+
+# Edits
+
+# Apply container edits in one pass: in-place patches first, then at most one
+# Segment rebuild for whatever did not fit.
+#   duration - new Duration value (see set_duration), or None to leave it
+#   finalize - replace unknown Segment/Cluster sizes with real ones
+#   cues     - index every video keyframe in a Cues element near the front
+#   retime   - real playback length in seconds; the timestamps are rescaled
+#              and the Duration is set to match (instead of `duration`)
+# `data` must be a bytearray. Returns (data, report) where report maps each
+# requested edit to 'in-place', 'void', 'rewrite' or 'unchanged' ('timestamps',
+# 'scale' or 'rewrite' for retime).
+def edit_segment(data, duration=None, finalize=False, cues=False, retime=None):
+    report = {}
+    segment, level1 = parse_segment(data)
+
+    # A retimed file gets the Duration that matches its content, in the
+    # TimestampScale ticks its timestamps use
+    retimed = {}
+    if retime is not None:
+        report['retime'], retimed = _retime(data, level1, retime)
+        duration = content_duration(data, level1)
+
+    if finalize:
+        if not segment.unknown_size and not any(element.unknown_size for element in level1):
+            report['finalize'] = 'unchanged'
+        elif _finalize_in_place(data, segment, level1):
+            report['finalize'] = 'in-place'
+
+    # A retime rewrite rebuilds Info anyway, so the Duration goes in there
+    if duration is not None and not retimed:
+        method = _set_duration_in_place(data, segment, level1, duration)
+        if method:
+            report['duration'] = method
+            if method == 'void':
+                segment, level1 = parse_segment(data)
+
+    new_cues = None
+    if cues:
+        new_cues = build_cues(data, segment, level1)
+        rebuild_pending = (finalize and 'finalize' not in report) or (duration is not None and 'duration' not in report)
+        if new_cues is None:
+            report['cues'] = 'unchanged'
+        elif not rebuild_pending and _cues_in_place(data, segment, level1, new_cues):
+            report['cues'] = 'void'
+            new_cues = None
+
+    replacements = {}
+    finalize_segment = False
+    if finalize and 'finalize' not in report:
+        report['finalize'] = 'rewrite'
+        finalize_segment = segment.unknown_size
+        for element in level1:
+            if element.unknown_size:
+                replacements[element.offset] = _finalized_header(data, element) + memoryview(data)[element.data_offset:element.end]
+    if duration is not None and 'duration' not in report:
+        report['duration'] = 'rewrite'
+        info = first_child(level1, INFO)
+        if info is None:
+            raise EBMLError('Segment Info element not found')
+        old = find_child(data, info, DURATION)
+        if old is not None:
+            retimed[old.offset] = float_element(DURATION, duration)
+        replacements[info.offset] = _with_fields(data, info, retimed, b'' if old is not None else float_element(DURATION, duration))
+        tracks = first_child(level1, TRACKS)
+        if tracks is not None and any(tracks.data_offset <= offset < tracks.end for offset in retimed):
+            replacements[tracks.offset] = _with_fields(data, tracks, retimed)
+
+    if replacements or finalize_segment or new_cues is not None:
+        parts = [(element, replacements.get(element.offset)) for element in level1]
+        if new_cues is not None:
+            report['cues'] = 'rewrite'
+            parts = _parts_with_cues(data, segment, level1, parts, new_cues)
+        data = rebuild_segment(data, segment, parts, finalize=finalize_segment)
+    return data, report
+
+# Set Segment Info Duration to `value` (a float in the file's Duration units,
+# the caller decides the scale). Returns (data, method):
+#   'in-place' - an existing Duration was overwritten
+#   'void'     - a Void inside or next to Info was reused, file size unchanged
+#   'rewrite'  - Info grew; Segment size, SeekHead and Cues were fixed up
+# `data` must be a bytearray; it is modified in place unless method is 'rewrite'.
+def set_duration(data, value):
+    data, report = edit_segment(data, duration=value)
+    return data, report['duration']
+
+# Replace unknown Segment/Cluster sizes with real ones. Returns (data, method)
+# with method 'in-place', 'rewrite' or 'unchanged'.
+def finalize_sizes(data):
+    data, report = edit_segment(data, finalize=True)
+    return data, report['finalize']
+
+# Segment rewriting
+
+# Build a new file from planned pieces without copying frame data up front.
+#   head       - nodes for the Level 1 elements before the Clusters, as
+#                (element_id, node)
+#   clusters   - Cluster Master nodes
+#   cue_points - (time, track, Cluster index, block index in the Cluster)
+# The SeekHead (when `seek_head`) and the Cues (when there are cue points)
+# go ahead of the Clusters. Returns (chunks, size) where chunks yields the
+# file piece by piece.
+def _write_segment(data, segment, head, clusters, cue_points, seek_head=True):
+    root = Master(SEGMENT, size_width=8)
+    seek_node = Raw(b'')
+    cues_node = Raw(b'')
+    if seek_head:
+        root.append(seek_node)
+    for _, node in head:
+        root.append(node)
+    if cue_points:
+        root.append(cues_node)
+    for cluster in clusters:
+        root.append(cluster)
+    first_cluster = len(root.children) - len(clusters)
+
+    def update(offsets):
+        positions = {id(node): offset for node, offset in zip(root.children, offsets)}
+        if seek_head:
+            entries = [(encode_id(element_id), positions[id(node)]) for element_id, node in head]
+            if cue_points:
+                entries.append((encode_id(CUES), positions[id(cues_node)]))
+            seek_node.set(encode_seek_head(entries))
+        if cue_points:
+            cues_node.set(encode_element(CUES, b''.join(
+                _cue_point(time, track, offsets[first_cluster + index],
+                           clusters[index].offsets()[block])
+                for time, track, index, block in cue_points
+            )))
+
+    root.settle(update)
+    view = memoryview(data)
+
+    def chunks():
+        yield view[:segment.offset]
+        yield from root.chunks()
+
+    return chunks(), segment.offset + len(root)
+
+# Cluster node with a Timestamp and the given block nodes
+def _cluster_node(cluster_time, blocks=()):
+    return Master(CLUSTER, [Leaf(TIMESTAMP, encode_uint(cluster_time)), *blocks])
+
+# Master element rebuilt without the children whose IDs are in `drop`,
+# with `extra` appended to its payload
+def _without_children(data, element, drop, extra=b''):
+    return encode_element(element.id, b''.join(
+        bytes(data[child.offset:child.end]) for child in children(data, element) if child.id not in drop
+    ) + extra)
+
+# Trimming
+
+# Cut to [start, end) seconds without decoding. The in point snaps back to
+# the nearest video keyframe at or before it; frames from the out point on
+# are dropped, which never breaks decoding. Timestamps are rebased to zero,
+# Duration, SeekHead and front Cues are written fresh and every size is final.
+# Planning only reads element headers and frames are written straight from
+# the source; the only blocks copied are those in the cut Cluster whose
+# timecodes change. Returns (chunks, report) where chunks iterates
+# bytes-like pieces of the new file; errors are raised before the first one.
+def trim(data, start=0.0, end=None):
+    if start < 0 or (end is not None and end <= start):
+        raise EBMLError('Trim range must satisfy 0 <= start < end')
+    segment, level1 = parse_segment(data)
+    info = first_child(level1, INFO)
+    if info is None:
+        raise EBMLError('Segment Info element not found')
+    scale = timestamp_scale(data, level1)
+    start_tick = start * 1e9 / scale
+    end_tick = end * 1e9 / scale if end is not None else None
+
+    video = video_track_number(data, level1)
+    keyframes = [timestamp for timestamp, _, _, _ in iter_keyframes(data, level1, video)]
+    if not keyframes:
+        raise EBMLError('No keyframes to cut at')
+    cut = max((timestamp for timestamp in keyframes if timestamp <= start_tick), default=min(keyframes))
+
+    view = memoryview(data)
+    clusters = []
+    cue_points = []
+    sources = []
+    duration = 0
+    kept = dropped = 0
+    for timestamp, track, keyframe, cluster, element, block, length in iter_timed_blocks(data, level1):
+        if timestamp < cut or (end_tick is not None and timestamp >= end_tick):
+            dropped += 1
+            continue
+        timecode = read_block_header(data, block)[1]
+        if not sources or sources[-1] is not cluster:
+            sources.append(cluster)
+            cluster_time = max(timestamp - timecode - cut, 0)
+            clusters.append(_cluster_node(cluster_time))
+        current = clusters[-1]
+        new_timecode = timestamp - cut - cluster_time
+        if new_timecode != timecode:
+            patched = bytearray(data[element.offset:element.end])
+            pos = block.data_offset + read_vint(data, block.data_offset)[1] - element.offset
+            patched[pos:pos + 2] = new_timecode.to_bytes(2, 'big', signed=True)
+            node = Raw(patched)
+        else:
+            node = Raw(view, element.offset, element.end)
+        if keyframe and (video is None or track == video):
+            cue_points.append((timestamp - cut, track, len(clusters) - 1, len(current.children)))
+        current.append(node)
+        duration = max(duration, timestamp - cut + length)
+        kept += 1
+    if not clusters:
+        raise EBMLError('No frames in the trim range')
+
+    head = [(INFO, Raw(_without_children(data, info, (DURATION, VOID, CRC32), float_element(DURATION, duration))))]
+    head += [(element.id, Raw(view, element.offset, element.end)) for element in level1 if element.id in (TRACKS, TAGS, CHAPTERS, ATTACHMENTS)]
+    chunks, size = _write_segment(data, segment, head, clusters, cue_points)
+    report = {
+        'start': cut * scale / 1e9,
+        'duration': duration * scale / 1e9,
+        'frames': kept,
+        'dropped_frames': dropped,
+        'bytes': size,
+    }
+    return chunks, report
+
+# Slimming
+
+# Drop everything a sticker player does not need while leaving the video
+# frames byte-identical: non-video tracks and their blocks, Tags, Chapters,
+# Attachments, Void padding, CRC-32, Cluster Position/PrevSize, TrackEntry
+# values equal to their defaults and the VP8/VP9 CodecPrivate, which those
+# decoders ignore. Every size is written at minimal width. The SeekHead and
+# Cues (rebuilt for the video keyframes, ahead of the Clusters) are kept
+# only when the source had them. Returns (chunks, report) like trim().
+def slim(data):
+    segment, level1 = parse_segment(data)
+    info = first_child(level1, INFO)
+    tracks = first_child(level1, TRACKS)
+    if info is None or tracks is None:
+        raise EBMLError('Segment Info or Tracks element not found')
+    video = video_track_number(data, level1)
+    if video is None:
+        raise EBMLError('No video track found')
+
+    entries = []
+    removed_tracks = 0
+    for entry in children(data, tracks):
+        if entry.id != TRACK_ENTRY:
+            continue
+        fields = {child.id: child for child in children(data, entry)}
+        if TRACK_NUMBER not in fields or read_uint(data, fields[TRACK_NUMBER]) != video:
+            removed_tracks += 1
+            continue
+        drop = {VOID, CRC32}
+        drop.update(field_id for field_id, default in TRACK_DEFAULTS.items()
+                    if field_id in fields and read_uint(data, fields[field_id]) == default)
+        if CODEC_ID in fields and read_string(data, fields[CODEC_ID]) in ('V_VP8', 'V_VP9'):
+            drop.add(CODEC_PRIVATE)
+        if LANGUAGE in fields and read_string(data, fields[LANGUAGE]) == 'eng':
+            drop.add(LANGUAGE)
+        entries.append(_without_children(data, entry, drop))
+    head = [
+        (INFO, Raw(_without_children(data, info, (VOID, CRC32)))),
+        (TRACKS, Raw(encode_element(TRACKS, b''.join(entries)))),
+    ]
+
+    view = memoryview(data)
+    clusters = []
+    cue_points = []
+    sources = []
+    removed_blocks = 0
+    for timestamp, track, keyframe, cluster, element, block in iter_blocks(data, level1):
+        if track != video:
+            removed_blocks += 1
+            continue
+        if not sources or sources[-1] is not cluster:
+            sources.append(cluster)
+            clusters.append(_cluster_node(timestamp - read_block_header(data, block)[1]))
+        current = clusters[-1]
+        if keyframe:
+            cue_points.append((timestamp, track, len(clusters) - 1, len(current.children)))
+        current.append(Raw(view, element.offset, element.end))
+
+    if first_child(level1, CUES) is None:
+        cue_points = []
+    chunks, size = _write_segment(data, segment, head, clusters, cue_points,
+                                  seek_head=first_child(level1, SEEK_HEAD) is not None)
+    report = {
+        'bytes_in': len(data),
+        'bytes': size,
+        'saved_bytes': len(data) - size,
+        'removed_tracks': removed_tracks,
+        'removed_blocks': removed_blocks,
+    }
+    return chunks, report
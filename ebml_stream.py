@@ -0,0 +1,176 @@
+# Incremental (push) EBML parser for data that arrives in pieces: upload
+# stream reads, ffmpeg stdout, sockets.
+#
+# feed() takes chunks of any size and returns the element events completed
+# so far; nothing but a partial element header (at most 12 bytes) and the
+# payloads of `capture` elements is ever buffered. Offsets in events are
+# absolute stream offsets, as in ebml.
+from ebml import (
+    EBMLError, read_element, LEVEL1_IDS, EBML_HEADER, DOC_TYPE, SEGMENT, SEEK_HEAD, SEEK, SEEK_ID,
+    SEEK_POSITION, INFO, TIMESTAMP_SCALE, DURATION, MUXING_APP, WRITING_APP, TRACKS, TRACK_ENTRY, TRACK_NUMBER,
+    TRACK_TYPE, CODEC_ID, DEFAULT_DURATION, VIDEO, PIXEL_WIDTH, PIXEL_HEIGHT, DISPLAY_WIDTH, DISPLAY_HEIGHT,
+    ALPHA_MODE, CLUSTER, TIMESTAMP, BLOCK_GROUP, CUES, CUE_POINT, CUE_TRACK_POSITIONS, TAGS, CHAPTERS,
+    ATTACHMENTS,
+)
+
+# Elements whose children are parsed; every other element is a leaf whose
+# payload is skipped (or captured)
+MASTER_IDS = {
+    EBML_HEADER, SEGMENT, SEEK_HEAD, SEEK, INFO, TRACKS, TRACK_ENTRY, VIDEO, CLUSTER, BLOCK_GROUP,
+    CUES, CUE_POINT, CUE_TRACK_POSITIONS, TAGS, CHAPTERS, ATTACHMENTS,
+}
+
+# Small header values worth keeping by default
+CAPTURE_IDS = {
+    DOC_TYPE, SEEK_ID, SEEK_POSITION, TIMESTAMP_SCALE, DURATION, MUXING_APP, WRITING_APP, TRACK_NUMBER,
+    TRACK_TYPE, CODEC_ID, DEFAULT_DURATION, PIXEL_WIDTH, PIXEL_HEIGHT, DISPLAY_WIDTH, DISPLAY_HEIGHT,
+    ALPHA_MODE, TIMESTAMP,
+}
+
+# Bytes needed for the element header at the start of buf, or None while
+# that is not known yet
+def _header_length(buf):
+    if not buf:
+        return None
+    if buf[0] == 0 or buf[0] < 0x10:
+        raise EBMLError('Invalid element ID in stream')
+    id_length = 9 - buf[0].bit_length()
+    if len(buf) <= id_length:
+        return None
+    if buf[id_length] == 0:
+        raise EBMLError('Invalid variable-size integer in stream')
+    length = id_length + 9 - buf[id_length].bit_length()
+    return length if len(buf) >= length else None
+
+# An unknown-size element ends where an element that cannot be its child starts
+def _ends_unknown(parent, element_id):
+    if element_id in (EBML_HEADER, SEGMENT):
+        return True
+    return parent.id != SEGMENT and element_id in LEVEL1_IDS
+
+# Events are tuples:
+#   ('start', element, None) once an element's header has been read
+#   ('end', element, payload) once its last byte has passed; payload is the
+#                             bytes of `capture` leaves, the first n bytes of
+#                             `peek` leaves ({id: n}), otherwise None
+# Unknown sizes are filled in on the element when it ends.
+class PushParser:
+    def __init__(self, masters=MASTER_IDS, capture=CAPTURE_IDS, peek=None, offset=0):
+        self.masters = masters
+        self.capture = capture
+        self.peek = peek or {}
+        self.offset = offset  # absolute offset of the next byte to be fed
+        self.stack = []  # open master elements, outermost first
+        self.truncated = False
+        self._header = bytearray()
+        self._leaf = None
+        self._remaining = 0
+        self._payload = None
+        self._keep = 0
+
+    @property
+    def depth(self):
+        return len(self.stack)
+
+    def feed(self, chunk):
+        events = []
+        view = memoryview(chunk)
+        i = 0
+        while True:
+            self._close_finished(events)
+            if self._leaf is not None:
+                take = min(self._remaining, len(view) - i)
+                if self._payload is not None and len(self._payload) < self._keep:
+                    self._payload += view[i:i + min(take, self._keep - len(self._payload))]
+                i += take
+                self.offset += take
+                self._remaining -= take
+                if self._remaining:
+                    break
+                payload = bytes(self._payload) if self._payload is not None else None
+                events.append(('end', self._leaf, payload))
+                self._leaf = self._payload = None
+                continue
+            if i >= len(view):
+                break
+
+            # Header bytes: whatever is left over from the last chunk plus
+            # just enough of this one
+            start = self.offset - len(self._header)
+            self._header += view[i:i + 12 - len(self._header)]
+            length = _header_length(self._header)
+            if length is None:
+                i = len(view)
+                self.offset = start + len(self._header)
+                break
+            element = read_element(self._header, 0)
+            element.offset = start
+            i += length - (self.offset - start)
+            self.offset = start + length
+            self._header.clear()
+            self._open(element, events)
+        return events
+
+    # End of input: unknown-size elements end here. Known-size elements cut
+    # short get no end event and leave `truncated` set.
+    def close(self):
+        events = []
+        self._close_finished(events)
+        if self._header or self._leaf is not None:
+            self.truncated = True
+        self._header.clear()
+        self._leaf = self._payload = None
+        while self.stack:
+            element = self.stack.pop()
+            if element.size is None:
+                element.size = self.offset - element.data_offset
+                events.append(('end', element, None))
+            else:
+                self.truncated = True
+        return events
+
+    def _open(self, element, events):
+        while self.stack and self.stack[-1].size is None and _ends_unknown(self.stack[-1], element.id):
+            parent = self.stack.pop()
+            parent.size = element.offset - parent.data_offset
+            events.append(('end', parent, None))
+        events.append(('start', element, None))
+        if element.id in self.masters:
+            self.stack.append(element)
+        elif element.size is None:
+            raise EBMLError(f'Unknown-size leaf element at offset {element.offset}')
+        else:
+            self._leaf = element
+            self._remaining = element.size
+            self._payload = None
+            if element.id in self.capture or element.id in self.peek:
+                self._payload = bytearray()
+                self._keep = element.size if element.id in self.capture else self.peek[element.id]
+
+    # Pop every element whose known end has been reached, along with the
+    # unknown-size elements nested in it
+    def _close_finished(self, events):
+        while self.stack and self._leaf is None:
+            limit = None
+            for index, element in enumerate(self.stack):
+                if element.size is not None and self.offset >= element.end:
+                    limit = index
+                    break
+            if limit is None:
+                return
+            while len(self.stack) > limit:
+                element = self.stack.pop()
+                if element.size is None:
+                    element.size = self.offset - element.data_offset
+                events.append(('end', element, None))
+
+# Feed a binary file object through a parser in `chunk_size` reads,
+# yielding events as they complete
+def iter_events(fp, chunk_size=65536, parser=None):
+    parser = parser or PushParser()
+    while True:
+        chunk = fp.read(chunk_size)
+        if not chunk:
+            break
+        yield from parser.feed(chunk)
+    yield from parser.close()
@@ -0,0 +1,210 @@
+# EBML writer: element encoding and a tree of elements to serialize.
+#
+# A tree mixes new elements with unchanged byte ranges of an existing file.
+# Unchanged ranges stay memoryview slices and are never copied before they
+# are written. Sizes are computed when first asked for and cached until a
+# child changes, so editing a deep element only re-sums its ancestors.
+import struct
+
+VOID = 0xEC
+
+class EBMLError(ValueError):
+    pass
+
+# Encoding
+
+# Smallest VINT width that can hold value (the all-ones pattern is reserved)
+def vint_width(value):
+    width = 1
+    while value >= (1 << (7 * width)) - 1:
+        width += 1
+    if width > 8:
+        raise EBMLError(f'Value {value} is too large for an EBML size')
+    return width
+
+def encode_vint(value, width=None):
+    if width is None:
+        width = vint_width(value)
+    elif value >= (1 << (7 * width)) - 1:
+        raise EBMLError(f'Value {value} does not fit in a {width}-byte EBML size')
+    return ((1 << (7 * width)) | value).to_bytes(width, 'big')
+
+# The reserved all-ones size meaning "unknown", `width` bytes long
+def unknown_size(width=8):
+    return ((2 << (7 * width)) - 1).to_bytes(width, 'big')
+
+def encode_id(element_id):
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, 'big')
+
+def encode_uint(value):
+    return value.to_bytes(max(1, (value.bit_length() + 7) // 8), 'big')
+
+def encode_element(element_id, payload, size_width=None):
+    return encode_id(element_id) + encode_vint(len(payload), size_width) + bytes(payload)
+
+def uint_element(element_id, value):
+    return encode_element(element_id, encode_uint(value))
+
+def float_element(element_id, value):
+    return encode_element(element_id, struct.pack('>d', value))
+
+# A Void element exactly `total` bytes long (total >= 2)
+def void_element(total):
+    for width in range(1, 9):
+        payload = total - 1 - width
+        if 0 <= payload < (1 << (7 * width)) - 1:
+            return encode_element(VOID, bytes(payload), width)
+    raise EBMLError(f'Cannot build a {total}-byte Void element')
+
+# The element followed by Void padding so the result is exactly `space` bytes.
+# A 1-byte gap is absorbed by widening the element's size field instead.
+# Returns None when it does not fit.
+def pack_into(space, element_id, payload):
+    blob = encode_element(element_id, payload)
+    gap = space - len(blob)
+    if gap == 1:
+        blob = encode_element(element_id, payload, vint_width(len(payload)) + 1)
+        gap = 0
+    if gap < 0 or gap == 1:
+        return None
+    return blob + (void_element(gap) if gap else b'')
+
+# Tree
+
+class Node:
+    __slots__ = ('parent',)
+
+    def __init__(self):
+        self.parent = None
+
+    # Drop the cached sizes of every ancestor
+    def changed(self):
+        node = self.parent
+        while node is not None:
+            node._length = node._offsets = None
+            node = node.parent
+
+# Bytes written as they are: an unchanged element sliced out of the source
+# buffer (zero-copy) or a complete element encoded elsewhere
+class Raw(Node):
+    __slots__ = ('view',)
+
+    def __init__(self, data, start=0, end=None):
+        super().__init__()
+        self.view = memoryview(data)[start:end]
+
+    def set(self, data):
+        self.view = memoryview(data)
+        self.changed()
+
+    def __len__(self):
+        return len(self.view)
+
+    def chunks(self):
+        yield self.view
+
+# An element with a payload of bytes (or a memoryview of the source)
+class Leaf(Node):
+    __slots__ = ('id', 'payload')
+
+    def __init__(self, element_id, payload=b''):
+        super().__init__()
+        self.id = element_id
+        self.payload = payload
+
+    def set(self, payload):
+        self.payload = payload
+        self.changed()
+
+    def __len__(self):
+        return len(encode_id(self.id)) + vint_width(len(self.payload)) + len(self.payload)
+
+    def chunks(self):
+        yield encode_id(self.id) + encode_vint(len(self.payload))
+        yield self.payload
+
+# An element whose payload is its children. The size field is `size_width`
+# bytes when the size fits (minimal otherwise), or the unknown-size marker
+# of that width when `unknown` is set.
+class Master(Node):
+    __slots__ = ('id', 'children', 'size_width', 'unknown', '_length', '_offsets')
+
+    def __init__(self, element_id, children=(), size_width=None, unknown=False):
+        super().__init__()
+        self.id = element_id
+        self.children = []
+        self.size_width = size_width
+        self.unknown = unknown
+        self._length = self._offsets = None
+        for child in children:
+            self.append(child)
+
+    def append(self, child):
+        self.insert(len(self.children), child)
+
+    def insert(self, index, child):
+        child.parent = self
+        self.children.insert(index, child)
+        self._length = self._offsets = None
+        self.changed()
+
+    def remove(self, child):
+        self.children.remove(child)
+        child.parent = None
+        self._length = self._offsets = None
+        self.changed()
+
+    # Start of each child relative to the start of the payload
+    def offsets(self):
+        if self._offsets is None:
+            offsets = []
+            pos = 0
+            for child in self.children:
+                offsets.append(pos)
+                pos += len(child)
+            self._offsets = offsets
+            self._length = pos
+        return self._offsets
+
+    def payload_length(self):
+        self.offsets()
+        return self._length
+
+    def header(self):
+        if self.unknown:
+            return encode_id(self.id) + unknown_size(self.size_width or 8)
+        size = self.payload_length()
+        width = self.size_width if self.size_width and size < (1 << (7 * self.size_width)) - 1 else None
+        return encode_id(self.id) + encode_vint(size, width)
+
+    def __len__(self):
+        return len(self.header()) + self.payload_length()
+
+    def chunks(self):
+        yield self.header()
+        for child in self.children:
+            yield from child.chunks()
+
+    # Call update(offsets) until the children's offsets stop moving. For
+    # elements such as SeekHead and Cues whose content depends on the
+    # positions of their siblings.
+    def settle(self, update, limit=8):
+        offsets = self.offsets()
+        for _ in range(limit):
+            update(offsets)
+            new_offsets = self.offsets()
+            if new_offsets == offsets:
+                return offsets
+            offsets = new_offsets
+        raise EBMLError('Element layout did not converge')
+
+def to_bytes(node):
+    return b''.join(node.chunks())
+
+# Stream the node into a binary file object; returns the bytes written
+def write(node, fp):
+    written = 0
+    for chunk in node.chunks():
+        fp.write(chunk)
+        written += len(chunk)
+    return written
@@ -0,0 +1,217 @@
+# Per-frame statistics from block headers alone: nothing is decoded and the
+# frame payloads stream past the push parser without being kept.
+import sys
+import json
+import math
+import array
+import struct
+import argparse
+
+from ebml import (
+    EBMLError, read_vint, DEFAULT_TIMESTAMP_SCALE, TIMESTAMP_SCALE, TRACK_ENTRY, TRACK_NUMBER, TRACK_TYPE,
+    CODEC_ID, CLUSTER, TIMESTAMP, EBML_HEADER, SIMPLE_BLOCK, BLOCK_GROUP, BLOCK, REFERENCE_BLOCK,
+)
+from ebml_stream import PushParser
+
+# Track VINT (up to 8 bytes), timecode, flags and the lace count
+BLOCK_HEADER_PEEK = 12
+LACING = ('none', 'xiph', 'fixed', 'ebml')
+TRACK_TYPES = {1: 'video', 2: 'audio', 17: 'subtitle'}
+
+BINARY_MAGIC = b'WFS2'
+
+# Most bitrate samples returned; longer spans get a coarser step
+MAX_BITRATE_POINTS = 10000
+
+# (track, timecode, flags, lacing, frames in the block, header length) from
+# the first bytes of a SimpleBlock or Block payload
+def parse_block_head(head):
+    track, length = read_vint(head, 0)
+    if len(head) < length + 3:
+        raise EBMLError('Truncated block header')
+    timecode = int.from_bytes(head[length:length + 2], 'big', signed=True)
+    flags = head[length + 2]
+    lacing = (flags >> 1) & 3
+    if lacing and len(head) > length + 3:
+        return track, timecode, flags, lacing, head[length + 3] + 1, length + 4
+    return track, timecode, flags, lacing, 1, length + 3
+
+# Walk the stream and collect every block. Returns (tracks, blocks,
+# timestamp_scale, clusters, truncated) with blocks as (track, ticks,
+# payload bytes, keyframe, lacing, frames).
+def scan_blocks(chunks):
+    parser = PushParser(peek={SIMPLE_BLOCK: BLOCK_HEADER_PEEK, BLOCK: BLOCK_HEADER_PEEK})
+    scale = DEFAULT_TIMESTAMP_SCALE
+    tracks = {}
+    entry = {}
+    blocks = []
+    clusters = 0
+    cluster_time = 0
+    pending = None
+    ebml_header = False
+
+    def handle(events):
+        nonlocal scale, entry, clusters, cluster_time, pending, ebml_header
+        for kind, element, payload in events:
+            if kind == 'start':
+                if element.offset == 0:
+                    ebml_header = element.id == EBML_HEADER
+                if not ebml_header:
+                    raise EBMLError('Not an EBML file (missing EBML header)')
+                if element.id == TRACK_ENTRY:
+                    entry = {}
+                elif element.id == CLUSTER:
+                    clusters += 1
+                    cluster_time = 0
+                elif element.id == REFERENCE_BLOCK and pending is not None:
+                    pending[3] = False
+                continue
+            if element.id == TIMESTAMP_SCALE:
+                scale = int.from_bytes(payload, 'big')
+            elif element.id == TRACK_NUMBER:
+                entry['number'] = int.from_bytes(payload, 'big')
+            elif element.id == TRACK_TYPE:
+                entry['type'] = int.from_bytes(payload, 'big')
+            elif element.id == CODEC_ID:
+                entry['codec'] = payload.rstrip(b'\0').decode('ascii', 'replace')
+            elif element.id == TRACK_ENTRY and 'number' in entry:
+                tracks[entry['number']] = entry
+            elif element.id == TIMESTAMP:
+                cluster_time = int.from_bytes(payload, 'big')
+            elif element.id in (SIMPLE_BLOCK, BLOCK):
+                track, timecode, flags, lacing, frames, header = parse_block_head(payload)
+                keyframe = bool(flags & 0x80) if element.id == SIMPLE_BLOCK else True
+                block = [track, cluster_time + timecode, element.size - header, keyframe, lacing, frames]
+                if element.id == SIMPLE_BLOCK:
+                    blocks.append(tuple(block))
+                else:
+                    pending = block
+            elif element.id == BLOCK_GROUP and pending is not None:
+                blocks.append(tuple(pending))
+                pending = None
+
+    for chunk in chunks:
+        handle(parser.feed(chunk))
+    handle(parser.close())
+    if not ebml_header:
+        raise EBMLError('Not an EBML file (missing EBML header)')
+    return tracks, blocks, scale, clusters, parser.truncated
+
+# Statistics for the first video track (or the first track with blocks):
+# per-frame arrays, the GOP layout and a rolling bitrate over `window_ms`
+# sampled every `step_ms` from the first frame on. The step is raised to keep
+# at most MAX_BITRATE_POINTS samples, however far apart the timestamps are.
+def frame_stats(chunks, window_ms=1000, step_ms=100):
+    tracks, blocks, scale, clusters, truncated = scan_blocks(chunks)
+    video = next((number for number, entry in tracks.items() if entry.get('type') == 1), None)
+    if video is None and blocks:
+        video = blocks[0][0]
+
+    per_track = {}
+    for track, _, size, _, lacing, frames in blocks:
+        summary = per_track.setdefault(track, {'blocks': 0, 'frames': 0, 'bytes': 0, 'lacing': {}})
+        summary['blocks'] += 1
+        summary['frames'] += frames
+        summary['bytes'] += size
+        summary['lacing'][LACING[lacing]] = summary['lacing'].get(LACING[lacing], 0) + 1
+    for number, summary in per_track.items():
+        entry = tracks.get(number, {})
+        summary['type'] = TRACK_TYPES.get(entry.get('type'), entry.get('type'))
+        summary['codec'] = entry.get('codec')
+
+    frames = sorted((ticks, size, keyframe) for track, ticks, size, keyframe, _, _ in blocks if track == video)
+    timestamps = [round(ticks * scale / 1e6, 3) for ticks, _, _ in frames]
+    sizes = [size for _, size, _ in frames]
+    keyframes = [int(keyframe) for _, _, keyframe in frames]
+
+    gops = []
+    for index, (timestamp, size, keyframe) in enumerate(zip(timestamps, sizes, keyframes)):
+        if keyframe or not gops:
+            gops.append({'start_frame': index, 'start_ms': timestamp, 'frames': 0, 'bytes': 0, 'keyframe_bytes': size})
+        gops[-1]['frames'] += 1
+        gops[-1]['bytes'] += size
+
+    # Bytes in (t - window, t] at every step, in kbit/s (bits per millisecond)
+    points = []
+    start_ms = timestamps[0] if frames else 0
+    if frames:
+        span = timestamps[-1] - start_ms
+        if span / step_ms >= MAX_BITRATE_POINTS:
+            step_ms = math.ceil(span / (MAX_BITRATE_POINTS - 1))
+        low = 0
+        in_window = 0
+        high = 0
+        t = start_ms
+        while True:
+            while high < len(frames) and timestamps[high] <= t:
+                in_window += sizes[high]
+                high += 1
+            while low < high and timestamps[low] <= t - window_ms:
+                in_window -= sizes[low]
+                low += 1
+            points.append([t, round(in_window * 8 / window_ms, 2)])
+            if high == len(frames):
+                break
+            t = start_ms + len(points) * step_ms
+
+    frame_length = timestamps[-1] - timestamps[-2] if len(timestamps) > 1 else 0
+    duration_ms = round(timestamps[-1] + frame_length, 3) if timestamps else 0
+    return {
+        'timestamp_scale': scale,
+        'clusters': clusters,
+        'truncated': truncated,
+        'video_track': video,
+        'tracks': per_track,
+        'duration_ms': duration_ms,
+        'average_kbps': round(sum(sizes) * 8 / duration_ms, 2) if duration_ms else 0,
+        'frames': {'timestamp_ms': timestamps, 'size': sizes, 'keyframe': keyframes},
+        'gops': gops,
+        'bitrate': {'window_ms': window_ms, 'step_ms': step_ms, 'start_ms': start_ms, 'kbps': [kbps for _, kbps in points]},
+    }
+
+# Little-endian binary form of the per-frame arrays and the bitrate curve:
+#   magic 'WFS2', uint32 frame count n, uint32 point count m,
+#   uint32 window_ms, uint32 step_ms, uint32 start in microseconds,
+#   uint32[n] timestamps in microseconds, uint32[n] sizes, uint8[n] flags
+#   (bit 0 = keyframe), float32[m] kbps at start, start + step_ms, ...
+def to_binary(stats):
+    frames = stats['frames']
+    kbps = stats['bitrate']['kbps']
+    arrays = [
+        array.array('I', (round(t * 1000) for t in frames['timestamp_ms'])),
+        array.array('I', frames['size']),
+        array.array('B', frames['keyframe']),
+        array.array('f', kbps),
+    ]
+    if sys.byteorder == 'big':
+        for values in arrays:
+            values.byteswap()
+    header = BINARY_MAGIC + struct.pack('<IIIII', len(frames['size']), len(kbps), stats['bitrate']['window_ms'],
+                                        stats['bitrate']['step_ms'], round(stats['bitrate']['start_ms'] * 1000))
+    return header + b''.join(values.tobytes() for values in arrays)
+
+def iter_file(fp, chunk_size=65536):
+    while True:
+        chunk = fp.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-frame sizes, GOPs and bitrate from WebM block headers')
+    parser.add_argument('path')
+    parser.add_argument('--window', type=int, default=1000, help='Rolling bitrate window in ms')
+    parser.add_argument('--step', type=int, default=100, help='Bitrate sample step in ms')
+    parser.add_argument('--binary', help='Also write the compact binary arrays to this path')
+    args = parser.parse_args()
+
+    with open(args.path, 'rb') as f:
+        stats = frame_stats(iter_file(f), args.window, args.step)
+    if args.binary:
+        with open(args.binary, 'wb') as f:
+            f.write(to_binary(stats))
+    json.dump(stats, sys.stdout, indent=2)
+    print()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,292 @@
+# Container metadata from the head of a file plus an optional tail slice,
+# so the cost does not depend on the file size. The head is pushed through
+# the stream parser up to the first Cluster; the tail is searched for the
+# last Cluster (real duration) and Cues (cluster count).
+import struct
+
+from ebml import (
+    EBMLError, read_element, read_uint, children, iter_elements, read_block_header, encode_id,
+    DEFAULT_TIMESTAMP_SCALE, EBML_HEADER, DOC_TYPE, SEGMENT, SEEK_ID, SEEK_POSITION, INFO, TAGS,
+    TIMESTAMP_SCALE, DURATION, MUXING_APP, WRITING_APP, TRACKS, TRACK_ENTRY, TRACK_NUMBER, TRACK_TYPE,
+    CODEC_ID, DEFAULT_DURATION, PIXEL_WIDTH, PIXEL_HEIGHT, DISPLAY_WIDTH, DISPLAY_HEIGHT, ALPHA_MODE,
+    CLUSTER, TIMESTAMP, SIMPLE_BLOCK, BLOCK_GROUP, BLOCK, CUES, CUE_POINT, CUE_TIME, CUE_TRACK_POSITIONS,
+    CUE_CLUSTER_POSITION,
+)
+from ebml_stream import PushParser, CAPTURE_IDS
+
+HEAD_LIMIT = 1024 * 1024  # stop looking for Tracks after this many bytes
+TAIL_BYTES = 64 * 1024
+
+TRACK_FIELDS = {
+    TRACK_NUMBER: 'number', TRACK_TYPE: 'type', CODEC_ID: 'codec', DEFAULT_DURATION: 'default_duration_ns',
+    PIXEL_WIDTH: 'pixel_width', PIXEL_HEIGHT: 'pixel_height', DISPLAY_WIDTH: 'display_width',
+    DISPLAY_HEIGHT: 'display_height', ALPHA_MODE: 'alpha_mode',
+}
+TRACK_TYPES = {1: 'video', 2: 'audio', 17: 'subtitle'}
+STRING_IDS = {DOC_TYPE, MUXING_APP, WRITING_APP, CODEC_ID}
+
+def _value(element, payload):
+    if element.id in STRING_IDS:
+        return payload.rstrip(b'\0').decode('utf-8', 'replace')
+    if element.id == DURATION:
+        return struct.unpack('>d' if len(payload) == 8 else '>f', payload)[0] if len(payload) in (4, 8) else None
+    return int.from_bytes(payload, 'big')
+
+# Parse the head from `chunks` until the first Cluster starts. Front Cues
+# (written ahead of the Clusters) are read too. Returns the report so far,
+# including how many bytes were consumed.
+def inspect_head(chunks, limit=HEAD_LIMIT):
+    parser = PushParser(capture=CAPTURE_IDS | {CUE_TIME, CUE_CLUSTER_POSITION})
+    report = {'doc_type': None, 'info': {}, 'tracks': [], 'seek': {}, 'cues': None}
+    info = report['info']
+    track = None
+    seek_id = None
+    segment = None
+    cue_clusters = set()
+    cue_points = 0
+    last_cue_time = None
+    done = False
+    for chunk in chunks:
+        for kind, element, payload in parser.feed(chunk):
+            if kind == 'start':
+                if element.offset == 0 and element.id != EBML_HEADER:
+                    raise EBMLError('Not an EBML file (missing EBML header)')
+                if element.id == SEGMENT:
+                    segment = element
+                    report['segment_offset'] = element.data_offset
+                    report['unknown_size'] = element.unknown_size
+                elif element.id == TRACK_ENTRY:
+                    track = {}
+                elif element.id == CUE_POINT:
+                    cue_points += 1
+                elif element.id == CLUSTER:
+                    report['first_cluster_offset'] = element.offset
+                    done = True
+                    break
+                continue
+            if element.id == DOC_TYPE:
+                report['doc_type'] = _value(element, payload)
+            elif element.id == TIMESTAMP_SCALE:
+                info['timestamp_scale'] = _value(element, payload)
+            elif element.id == DURATION:
+                info['duration'] = _value(element, payload)
+            elif element.id == MUXING_APP:
+                info['muxing_app'] = _value(element, payload)
+            elif element.id == WRITING_APP:
+                info['writing_app'] = _value(element, payload)
+            elif element.id == SEEK_ID:
+                seek_id = int.from_bytes(payload, 'big')
+            elif element.id == SEEK_POSITION and seek_id is not None:
+                report['seek'][seek_id] = int.from_bytes(payload, 'big')
+            elif element.id in TRACK_FIELDS and track is not None:
+                track[TRACK_FIELDS[element.id]] = _value(element, payload)
+            elif element.id == TRACK_ENTRY and track is not None:
+                report['tracks'].append(track)
+                track = None
+            elif element.id == CUE_TIME:
+                last_cue_time = int.from_bytes(payload, 'big')
+            elif element.id == CUE_CLUSTER_POSITION:
+                cue_clusters.add(int.from_bytes(payload, 'big'))
+            elif element.id == CUES:
+                report['cues'] = {'location': 'front', 'points': cue_points, 'clusters': len(cue_clusters),
+                                  'last_time': last_cue_time}
+        if done or parser.offset >= limit:
+            break
+    if segment is None:
+        raise EBMLError('Segment element not found in the first bytes')
+    report['head_bytes_read'] = parser.offset
+    return report
+
+# Cues and the last Clusters inside `tail`, which starts at absolute offset
+# `tail_offset`. Returns (cues or None, clusters) with up to two Cluster
+# summaries, the last one first.
+def inspect_tail(tail, tail_offset, video_track):
+    cues = None
+    found = tail.rfind(encode_id(CUES))
+    while found != -1 and cues is None:
+        try:
+            element = read_element(tail, found)
+            if element.size is not None and element.end <= len(tail):
+                points = [point for point in children(tail, element) if point.id == CUE_POINT]
+                clusters = set()
+                last_time = None
+                for point in points:
+                    for field in children(tail, point):
+                        if field.id == CUE_TIME:
+                            last_time = read_uint(tail, field)
+                        elif field.id == CUE_TRACK_POSITIONS:
+                            for position in children(tail, field):
+                                if position.id == CUE_CLUSTER_POSITION:
+                                    clusters.add(read_uint(tail, position))
+                cues = {'location': 'tail', 'points': len(points), 'clusters': len(clusters), 'last_time': last_time}
+        except EBMLError:
+            pass
+        found = tail.rfind(encode_id(CUES), 0, found)
+
+    # Walk back over Cluster ID matches until one parses as a Cluster whose
+    # first child is its Timestamp
+    clusters = []
+    found = tail.rfind(encode_id(CLUSTER))
+    while found != -1:
+        cluster = _tail_cluster(tail, found, video_track)
+        if cluster is not None:
+            cluster['offset'] = tail_offset + found
+            clusters.append(cluster)
+            if len(clusters) == 2:
+                break
+        found = tail.rfind(encode_id(CLUSTER), 0, found)
+    return cues, clusters
+
+def _tail_cluster(tail, pos, video_track):
+    try:
+        cluster = read_element(tail, pos)
+        end = cluster.end if cluster.size is not None and cluster.end <= len(tail) else len(tail)
+        first = read_element(tail, cluster.data_offset)
+        if first.id != TIMESTAMP:
+            return None
+        cluster_time = read_uint(tail, first)
+        frames = []
+        for child in iter_elements(tail, cluster.data_offset, end):
+            block = child
+            if child.id == BLOCK_GROUP:
+                block = next((field for field in children(tail, child) if field.id == BLOCK), None)
+            elif child.id != SIMPLE_BLOCK:
+                continue
+            if block is None:
+                continue
+            track, timecode, _, _ = read_block_header(tail, block)
+            if video_track is None or track == video_track:
+                frames.append(cluster_time + timecode)
+    except EBMLError:
+        return None
+    if not frames:
+        return None
+    return {'timestamp': cluster_time, 'frames': len(frames), 'last_frame': max(frames), 'bytes': end - pos}
+
+# Full report from the head chunks and an optional tail slice. `size` is
+# the total file size when known (needed to place the tail and estimate).
+def inspect(head_chunks, tail=None, size=None):
+    report = inspect_head(head_chunks)
+    info = report['info']
+    scale = info.get('timestamp_scale', DEFAULT_TIMESTAMP_SCALE)
+    # `duration` is the value as stored; duration_ms reads it as ticks
+    if 'duration' in info:
+        info['duration_ms'] = round(info['duration'] * scale / 1e6, 3)
+    for track in report['tracks']:
+        track['type'] = TRACK_TYPES.get(track.get('type'), track.get('type'))
+        if track.get('default_duration_ns'):
+            track['frame_rate'] = round(1e9 / track['default_duration_ns'], 3)
+    video = next((track for track in report['tracks'] if track['type'] == 'video'), None)
+    report['seek'] = {_seek_name(element_id): position for element_id, position in report['seek'].items()}
+    report['bytes'] = size
+
+    last_clusters = []
+    if tail is not None and size is not None:
+        tail_offset = size - len(tail)
+        cues, last_clusters = inspect_tail(tail, tail_offset, video and video.get('number'))
+        report['cues'] = report['cues'] or cues
+        report['tail_bytes_read'] = len(tail)
+
+    frame_ticks = video['default_duration_ns'] / scale if video and video.get('default_duration_ns') else None
+    if last_clusters:
+        last = last_clusters[0]
+        length = frame_ticks
+        if length is None and last['frames'] > 1:
+            length = (last['last_frame'] - last['timestamp']) / (last['frames'] - 1)
+        report['real_duration_ms'] = round((last['last_frame'] + (length or 0)) * scale / 1e6, 3)
+        if 'duration_ms' in info:
+            report['duration_mismatch'] = abs(info['duration_ms'] - report['real_duration_ms']) > 1
+
+    if report['cues']:
+        report['clusters'] = report['cues']['clusters']
+        report['clusters_estimated'] = False
+    elif len(last_clusters) == 2 and 'first_cluster_offset' in report:
+        # Average size of the last two Clusters over the whole cluster area
+        average = (last_clusters[0]['bytes'] + last_clusters[0]['offset'] - last_clusters[1]['offset']) / 2
+        report['clusters'] = max(round((size - report['first_cluster_offset']) / average), 1)
+        report['clusters_estimated'] = True
+    elif len(last_clusters) == 1 and last_clusters[0]['offset'] == report.get('first_cluster_offset'):
+        report['clusters'] = 1
+        report['clusters_estimated'] = False
+
+    if 'real_duration_ms' in report:
+        if frame_ticks:
+            report['frames_estimated'] = round(report['real_duration_ms'] * 1e6 / scale / frame_ticks)
+        elif last_clusters and last_clusters[0]['last_frame'] > last_clusters[0]['timestamp']:
+            last = last_clusters[0]
+            per_tick = (last['frames'] - 1) / (last['last_frame'] - last['timestamp'])
+            report['frames_estimated'] = round(report['real_duration_ms'] * 1e6 / scale * per_tick)
+    return report
+
+# Leading bytes of formats that end up renamed to .webm, as (offset, magic, name)
+FORMAT_MAGIC = [
+    (4, b'ftyp', 'an MP4/MOV file'),
+    (0, b'RIFF', 'a RIFF (AVI/WAV/WebP) file'),
+    (0, b'OggS', 'an Ogg file'),
+    (0, b'GIF8', 'a GIF image'),
+    (0, b'\x89PNG', 'a PNG image'),
+    (0, b'\xff\xd8\xff', 'a JPEG image'),
+]
+DOC_TYPES = ('webm', 'matroska')
+
+# Incremental check of a file's first bytes as they arrive: EBML magic, a
+# WebM or Matroska DocType, then Tracks with a video track whose codec is in
+# `codecs` (any when None). feed() raises EBMLError as soon as something is
+# wrong; `done` is set once Tracks has passed the check, or after `limit`
+# bytes without a verdict.
+class HeadCheck:
+    def __init__(self, codecs=None, limit=HEAD_LIMIT):
+        self.codecs = codecs
+        self.limit = limit
+        self.done = False
+        self.parser = PushParser()
+        self._start = b''
+        self._tracks = []
+        self._track = None
+
+    def feed(self, data):
+        if self.done:
+            return
+        if self._start is not None:
+            # The first bytes are held back until the magic can be checked,
+            # however finely the upload is split
+            self._start += bytes(data)
+            if len(self._start) < 8:
+                return
+            data, self._start = self._start, None
+            if not data.startswith(encode_id(EBML_HEADER)):
+                for offset, magic, name in FORMAT_MAGIC:
+                    if data[offset:offset + len(magic)] == magic:
+                        raise EBMLError(f'Not a WebM file: this looks like {name}')
+                raise EBMLError('Not a WebM file (missing EBML header)')
+        for kind, element, payload in self.parser.feed(data):
+            if kind == 'start':
+                if element.id == TRACK_ENTRY:
+                    self._track = {}
+                elif element.id == CLUSTER:
+                    raise EBMLError('No Tracks element before the first Cluster')
+            elif element.id == DOC_TYPE:
+                doc_type = _value(element, payload)
+                if doc_type not in DOC_TYPES:
+                    raise EBMLError(f'Unsupported DocType {doc_type!r} (expected webm)')
+            elif element.id in (TRACK_TYPE, CODEC_ID) and self._track is not None:
+                self._track[element.id] = _value(element, payload)
+            elif element.id == TRACK_ENTRY and self._track is not None:
+                self._tracks.append(self._track)
+                self._track = None
+            elif element.id == TRACKS:
+                video = next((track for track in self._tracks if track.get(TRACK_TYPE) == 1), None)
+                if video is None:
+                    raise EBMLError('No video track')
+                codec = video.get(CODEC_ID)
+                if self.codecs is not None and codec not in self.codecs:
+                    raise EBMLError(f'Unsupported video codec {codec} (supported: {", ".join(sorted(self.codecs))})')
+                self.done = True
+                return
+        if self.parser.offset >= self.limit:
+            self.done = True
+
+SEEK_NAMES = {INFO: 'Info', TRACKS: 'Tracks', CUES: 'Cues', CLUSTER: 'Cluster', TAGS: 'Tags'}
+
+def _seek_name(element_id):
+    return SEEK_NAMES.get(element_id, f'0x{element_id:X}')
@@ -0,0 +1,128 @@
+# Duration fixes for files already on disk. The source is cloned (a reflink
+# where the filesystem shares extents, otherwise copy_file_range in the
+# kernel, otherwise a plain copy), the clone is memory-mapped and only the
+# bytes that change in the file head are written, so on copy-on-write
+# filesystems the cost per file does not grow with its size. Files whose Info
+# has to grow are rewritten in full instead.
+import os
+import sys
+import json
+import mmap
+import time
+import uuid
+import shutil
+import argparse
+
+try:
+    import fcntl
+except ImportError:  # not on Windows
+    fcntl = None
+
+import ebml
+
+FICLONE = 0x40049409  # _IOW(0x94, 9, int), Linux
+COPY_CHUNK = 1 << 30
+# Room past the Level 1 elements of the head for the first Cluster's header,
+# so the head parser sees where the Clusters begin
+CLUSTER_HEADER_BYTES = 12
+
+# Clone `src` into the open file `dst_fd`. Returns 'reflink',
+# 'copy_file_range' or 'copy'.
+def clone_into(src_fd, dst_fd):
+    if fcntl is not None:
+        try:
+            fcntl.ioctl(dst_fd, FICLONE, src_fd)
+            return 'reflink'
+        except OSError:
+            pass
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while os.copy_file_range(src_fd, dst_fd, COPY_CHUNK):
+                pass
+            return 'copy_file_range'
+        except OSError:
+            # Not across these filesystems; start over with a plain copy
+            os.ftruncate(dst_fd, 0)
+    os.lseek(src_fd, 0, os.SEEK_SET)
+    os.lseek(dst_fd, 0, os.SEEK_SET)
+    with open(src_fd, 'rb', closefd=False) as source, open(dst_fd, 'wb', closefd=False) as target:
+        shutil.copyfileobj(source, target, 1024 * 1024)
+    return 'copy'
+
+# Duration patches for the file behind `data` (an mmap), worked out from its
+# head alone. Raises EBMLError when the edit needs more than the head.
+def head_patches(data, value):
+    segment, level1, reached = ebml.parse_head(data)
+    end = level1[-1].end if level1 else segment.data_offset
+    return ebml.duration_patch(data[:min(len(data), end + CLUSTER_HEADER_BYTES)], value)
+
+# Write `src` with its Duration set to `duration_ms` to `dst` (which may be
+# `src` itself to patch it in place). The output appears atomically. Returns
+# a report with the clone and Duration methods, bytes written and timings.
+def patch_file(src, dst, duration_ms):
+    started = time.perf_counter()
+    value = duration_ms / 1000.0
+    report = {'source': src, 'output': dst, 'bytes': os.path.getsize(src)}
+    if report['bytes'] == 0:
+        raise ebml.EBMLError('Not an EBML file (missing EBML header)')
+
+    # Plan the edit from the source first so a file that cannot be patched
+    # is never cloned
+    with open(src, 'rb') as source:
+        with mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            try:
+                patches, method = head_patches(view, value)
+            except ebml.EBMLError:
+                patches = None
+        if patches is None:
+            # Info has to grow, which moves every byte after it anyway
+            output, method = ebml.set_duration(bytearray(source.read()), value)
+
+    temp_path = os.path.join(os.path.dirname(os.path.abspath(dst)), f'.{os.path.basename(dst)}.{uuid.uuid4().hex}.tmp')
+    try:
+        if patches is None:
+            with open(temp_path, 'wb') as f:
+                f.write(output)
+            report.update(clone=None, bytes_written=len(output))
+        else:
+            with open(src, 'rb') as source, open(temp_path, 'w+b') as target:
+                report['clone'] = clone_into(source.fileno(), target.fileno())
+                if patches:
+                    with mmap.mmap(target.fileno(), 0) as data:
+                        for offset, blob in patches:
+                            data[offset:offset + len(blob)] = blob
+                        data.flush()
+            report['bytes_written'] = sum(len(blob) for _, blob in patches)
+        shutil.copymode(src, temp_path)
+        os.replace(temp_path, dst)
+    finally:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+    report['duration'] = method
+    report['seconds'] = round(time.perf_counter() - started, 6)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description='Set the WebM Duration of local files without copying their data')
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--duration', type=float, required=True, help='Duration in milliseconds')
+    parser.add_argument('--suffix', default='_fixed', help='Output name suffix (ignored with --in-place)')
+    parser.add_argument('--in-place', action='store_true', help='Replace the source files')
+    args = parser.parse_args()
+    if args.duration < 0:
+        parser.error('Duration must be non-negative')
+
+    failed = 0
+    for path in args.paths:
+        root, ext = os.path.splitext(path)
+        dst = path if args.in_place else f'{root}{args.suffix}{ext or ".webm"}'
+        try:
+            report = patch_file(path, dst, args.duration)
+        except (OSError, ebml.EBMLError) as e:
+            report = {'source': path, 'error': str(e)}
+            failed += 1
+        print(json.dumps(report))
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
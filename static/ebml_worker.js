@@ -0,0 +1,346 @@
+// Duration patching in the browser, off the main thread. Follows ebml.py:
+// an existing Duration is overwritten, a Void inside or next to Info is
+// reused, and otherwise Info grows in place with the Segment size, SeekHead
+// and Cues positions shifted inside their existing fields. Whatever does not
+// fit is left to the server.
+//
+// Messages in:  {id, file, duration}  (duration in the file's Duration units)
+// Messages out: {id, splices, method} or {id, error}
+// A splice replaces `length` bytes at `offset` of the original file with `data`.
+
+const EBML_HEADER = 0x1A45DFA3;
+const SEGMENT = 0x18538067;
+const SEEK_HEAD = 0x114D9B74;
+const SEEK = 0x4DBB;
+const SEEK_POSITION = 0x53AC;
+const INFO = 0x1549A966;
+const DURATION = 0x4489;
+const TRACKS = 0x1654AE6B;
+const CLUSTER = 0x1F43B675;
+const CUES = 0x1C53BB6B;
+const CUE_POINT = 0xBB;
+const CUE_TRACK_POSITIONS = 0xB7;
+const CUE_CLUSTER_POSITION = 0xF1;
+const TAGS = 0x1254C367;
+const CHAPTERS = 0x1043A770;
+const ATTACHMENTS = 0x1941A469;
+const VOID = 0xEC;
+const CRC32 = 0xBF;
+
+const LEVEL1_IDS = new Set([SEEK_HEAD, INFO, TRACKS, CLUSTER, CUES, TAGS, CHAPTERS, ATTACHMENTS]);
+
+class EBMLError extends Error {}
+
+// Reading
+
+// {value, length, unknown} of the variable-size integer at pos
+function readVint(data, pos) {
+    if (pos >= data.length) throw new EBMLError(`Truncated element header at offset ${pos}`);
+    const first = data[pos];
+    if (first === 0) throw new EBMLError(`Invalid variable-size integer at offset ${pos}`);
+    const length = Math.clz32(first) - 23;
+    if (pos + length > data.length) throw new EBMLError(`Truncated element header at offset ${pos}`);
+    let value = first & (0xFF >> length);
+    let unknown = value === (0xFF >> length);
+    for (let i = 1; i < length; i++) {
+        value = value * 256 + data[pos + i];
+        unknown = unknown && data[pos + i] === 0xFF;
+    }
+    return { value, length, unknown };
+}
+
+function readId(data, pos) {
+    if (pos >= data.length) throw new EBMLError(`Truncated element header at offset ${pos}`);
+    const length = Math.clz32(data[pos]) - 23;
+    if (data[pos] === 0 || length > 4) throw new EBMLError(`Invalid element ID at offset ${pos}`);
+    if (pos + length > data.length) throw new EBMLError(`Truncated element header at offset ${pos}`);
+    let id = 0;
+    for (let i = 0; i < length; i++) id = id * 256 + data[pos + i];
+    return { id, length };
+}
+
+// Element header at pos; size is null when the element has unknown size
+function readElement(data, pos) {
+    const id = readId(data, pos);
+    const size = readVint(data, pos + id.length);
+    const element = {
+        id: id.id,
+        offset: pos,
+        headerSize: id.length + size.length,
+        sizeWidth: size.length,
+        size: size.unknown ? null : size.value,
+    };
+    element.dataOffset = pos + element.headerSize;
+    element.end = element.size === null ? null : element.dataOffset + element.size;
+    return element;
+}
+
+// Child elements in [start, end). Unknown sizes end at the next Level 1 ID.
+function children(data, start, end) {
+    const elements = [];
+    let pos = start;
+    while (pos < end) {
+        const element = readElement(data, pos);
+        if (element.size === null) {
+            let child = element.dataOffset;
+            while (child < end) {
+                const childId = readId(data, child).id;
+                if (LEVEL1_IDS.has(childId) || childId === EBML_HEADER || childId === SEGMENT) break;
+                const inner = readElement(data, child);
+                if (inner.size === null) throw new EBMLError(`Nested unknown-size element at offset ${child}`);
+                child = inner.end;
+            }
+            element.size = Math.min(child, end) - element.dataOffset;
+            element.end = element.dataOffset + element.size;
+        } else if (element.end > end) {
+            throw new EBMLError(`Element 0x${element.id.toString(16).toUpperCase()} at offset ${pos} overruns its parent`);
+        }
+        elements.push(element);
+        pos = element.end;
+    }
+    return elements;
+}
+
+function childrenOf(data, parent) {
+    return children(data, parent.dataOffset, parent.end);
+}
+
+function parseSegment(data) {
+    if (readId(data, 0).id !== EBML_HEADER) throw new EBMLError('Not an EBML file (missing EBML header)');
+    let pos = 0;
+    while (pos < data.length) {
+        const element = readElement(data, pos);
+        if (element.id === SEGMENT) {
+            const known = element.size !== null && element.end <= data.length;
+            const level1 = children(data, element.dataOffset, known ? element.end : data.length);
+            return { segment: element, level1 };
+        }
+        if (element.size === null) break;
+        pos = element.end;
+    }
+    throw new EBMLError('Segment element not found');
+}
+
+function readUint(data, element) {
+    let value = 0;
+    for (let i = element.dataOffset; i < element.end; i++) value = value * 256 + data[i];
+    return value;
+}
+
+// Writing
+
+function encodeId(id) {
+    const bytes = [];
+    for (let value = id; value > 0; value = Math.floor(value / 256)) bytes.unshift(value % 256);
+    return bytes;
+}
+
+function vintWidth(value) {
+    let width = 1;
+    while (value >= 2 ** (7 * width) - 1) width++;
+    if (width > 8) throw new EBMLError(`Value ${value} is too large for an EBML size`);
+    return width;
+}
+
+function encodeVint(value, width = vintWidth(value)) {
+    if (value >= 2 ** (7 * width) - 1) throw new EBMLError(`Value ${value} does not fit in a ${width}-byte EBML size`);
+    const bytes = new Array(width);
+    for (let i = width - 1; i >= 0; i--) {
+        bytes[i] = value % 256;
+        value = Math.floor(value / 256);
+    }
+    bytes[0] |= 0x80 >> (width - 1);
+    return bytes;
+}
+
+function encodeElement(id, payload, sizeWidth) {
+    return Uint8Array.from([...encodeId(id), ...encodeVint(payload.length, sizeWidth), ...payload]);
+}
+
+function floatElement(id, value) {
+    const payload = new Uint8Array(8);
+    new DataView(payload.buffer).setFloat64(0, value);
+    return encodeElement(id, payload);
+}
+
+function voidElement(total) {
+    for (let width = 1; width <= 8; width++) {
+        const payload = total - 1 - width;
+        if (payload >= 0 && payload < 2 ** (7 * width) - 1) return encodeElement(VOID, new Uint8Array(payload), width);
+    }
+    throw new EBMLError(`Cannot build a ${total}-byte Void element`);
+}
+
+// The element followed by Void padding so the result is exactly `space`
+// bytes, or null when it does not fit (see ebml_writer.pack_into)
+function packInto(space, id, payload) {
+    let blob = encodeElement(id, payload);
+    let gap = space - blob.length;
+    if (gap === 1) {
+        blob = encodeElement(id, payload, vintWidth(payload.length) + 1);
+        gap = 0;
+    }
+    if (gap < 0 || gap === 1) return null;
+    return gap ? concat([blob, voidElement(gap)]) : blob;
+}
+
+function concat(arrays) {
+    const out = new Uint8Array(arrays.reduce((total, array) => total + array.length, 0));
+    let pos = 0;
+    for (const array of arrays) {
+        out.set(array, pos);
+        pos += array.length;
+    }
+    return out;
+}
+
+const CRC_TABLE = new Uint32Array(256).map((_, n) => {
+    let c = n;
+    for (let k = 0; k < 8; k++) c = c & 1 ? 0xEDB88320 ^ (c >>> 1) : c >>> 1;
+    return c;
+});
+
+// Recompute a leading CRC-32 child over the rest of a standalone element
+function refreshCrc(blob) {
+    const element = readElement(blob, 0);
+    if (element.dataOffset >= blob.length) return;
+    const crc = readElement(blob, element.dataOffset);
+    if (crc.id !== CRC32 || crc.size !== 4) return;
+    let c = 0xFFFFFFFF;
+    for (let i = crc.end; i < blob.length; i++) c = CRC_TABLE[(c ^ blob[i]) & 0xFF] ^ (c >>> 8);
+    new DataView(blob.buffer, blob.byteOffset).setUint32(crc.dataOffset, (c ^ 0xFFFFFFFF) >>> 0, true);
+}
+
+// Copy of `element` with every `field_id` value mapped through move(), each
+// kept at its original width, or null when nothing changed. Throws when a
+// new value does not fit.
+function withPositions(data, element, path, fieldId, move) {
+    const blob = data.slice(element.offset, element.end);
+    let changed = false;
+    const visit = (parent, depth) => {
+        for (const child of childrenOf(data, parent)) {
+            if (depth < path.length && child.id === path[depth]) {
+                visit(child, depth + 1);
+            } else if (depth === path.length && child.id === fieldId) {
+                const value = readUint(data, child);
+                const moved = move(value);
+                if (moved === value) continue;
+                if (moved >= 2 ** (8 * child.size)) throw new EBMLError('Shifted position does not fit its field');
+                let rest = moved;
+                for (let i = child.end - 1; i >= child.dataOffset; i--) {
+                    blob[i - element.offset] = rest % 256;
+                    rest = Math.floor(rest / 256);
+                }
+                changed = true;
+            }
+        }
+    };
+    visit(element, 0);
+    if (!changed) return null;
+    refreshCrc(blob);
+    return { offset: element.offset, length: blob.length, data: blob };
+}
+
+// Splices that move SeekHead entries (and Cues positions) through move()
+function positionSplices(data, level1, move, cues) {
+    const splices = [];
+    for (const element of level1) {
+        let splice = null;
+        if (element.id === SEEK_HEAD) {
+            splice = withPositions(data, element, [SEEK], SEEK_POSITION, move);
+        } else if (element.id === CUES && cues) {
+            splice = withPositions(data, element, [CUE_POINT, CUE_TRACK_POSITIONS], CUE_CLUSTER_POSITION, move);
+        }
+        if (splice) splices.push(splice);
+    }
+    return splices;
+}
+
+// Duration
+
+// {splices, method} setting the Segment Info Duration to `value`
+function durationSplices(data, value) {
+    const { segment, level1 } = parseSegment(data);
+    const info = level1.find(element => element.id === INFO);
+    if (!info) throw new EBMLError('Segment Info element not found');
+    const infoChildren = childrenOf(data, info);
+    const base = segment.dataOffset;
+    const duration = floatElement(DURATION, value);
+    const infoPayload = (extra) => concat([data.subarray(info.dataOffset, info.end), extra]);
+    const finishInfo = (blob) => {
+        refreshCrc(blob);
+        return blob;
+    };
+
+    // Existing Duration: overwrite it at its own width
+    const existing = infoChildren.find(element => element.id === DURATION);
+    if (existing) {
+        if (existing.size !== 8 && existing.size !== 4) {
+            throw new EBMLError(`Unexpected Duration size: ${existing.size} bytes (expected 4 or 8)`);
+        }
+        const blob = data.slice(info.offset, info.end);
+        const view = new DataView(blob.buffer);
+        const at = existing.dataOffset - info.offset;
+        if (existing.size === 8) view.setFloat64(at, value);
+        else view.setFloat32(at, value);
+        return { splices: [{ offset: info.offset, length: blob.length, data: finishInfo(blob) }], method: 'in-place' };
+    }
+
+    // A Void inside Info is swapped for the Duration
+    for (const element of infoChildren) {
+        if (element.id !== VOID) continue;
+        const packed = packInto(element.end - element.offset, DURATION, duration.subarray(3));
+        if (!packed) continue;
+        const blob = data.slice(info.offset, info.end);
+        blob.set(packed, element.offset - info.offset);
+        return { splices: [{ offset: info.offset, length: blob.length, data: finishInfo(blob) }], method: 'void' };
+    }
+
+    // A Void right before or after Info absorbs the growth
+    const index = level1.indexOf(info);
+    for (const neighbour of [level1[index - 1], level1[index + 1]]) {
+        if (!neighbour || neighbour.id !== VOID) continue;
+        const start = Math.min(neighbour.offset, info.offset);
+        const end = Math.max(neighbour.end, info.end);
+        const packed = packInto(end - start, INFO, infoPayload(duration));
+        if (!packed) continue;
+        const blob = new Uint8Array(packed);
+        const infoLength = readElement(blob, 0).end;
+        refreshCrc(blob.subarray(0, infoLength));
+        let splices = [];
+        if (start !== info.offset) {
+            const from = info.offset - base;
+            try {
+                splices = positionSplices(data, level1, position => position === from ? start - base : position, false);
+            } catch (error) {
+                continue;
+            }
+        }
+        splices.push({ offset: start, length: end - start, data: blob });
+        return { splices, method: 'void' };
+    }
+
+    // Info grows in place: everything after it shifts by the growth
+    const grown = finishInfo(encodeElement(INFO, infoPayload(duration)));
+    const delta = grown.length - (info.end - info.offset);
+    const infoEnd = info.end - base;
+    const splices = positionSplices(data, level1, position => position >= infoEnd ? position + delta : position, true);
+    if (segment.size !== null) {
+        const sizeField = encodeVint(segment.size + delta, segment.sizeWidth);
+        splices.push({ offset: segment.dataOffset - segment.sizeWidth, length: segment.sizeWidth, data: Uint8Array.from(sizeField) });
+    }
+    splices.push({ offset: info.offset, length: info.end - info.offset, data: grown });
+    return { splices, method: 'grow' };
+}
+
+self.onmessage = async (event) => {
+    const { id, file, duration } = event.data;
+    try {
+        const data = new Uint8Array(await file.arrayBuffer());
+        const { splices, method } = durationSplices(data, duration);
+        splices.sort((a, b) => a.offset - b.offset);
+        self.postMessage({ id, splices, method });
+    } catch (error) {
+        self.postMessage({ id, error: error.message });
+    }
+};
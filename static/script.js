@@ -3,7 +3,16 @@ const fileInput = document.getElementById('fileInput');
 const fileInfo = document.getElementById('fileInfo');
 const fileName = document.getElementById('fileName');
 const fileSize = document.getElementById('fileSize');
+const fileMeta = document.getElementById('fileMeta');
 const durationInput = document.getElementById('durationInput');
+const finalizeCheckbox = document.getElementById('finalizeCheckbox');
+const cuesCheckbox = document.getElementById('cuesCheckbox');
+const retimeCheckbox = document.getElementById('retimeCheckbox');
+const slimCheckbox = document.getElementById('slimCheckbox');
+const trimCheckbox = document.getElementById('trimCheckbox');
+const trimOptions = document.getElementById('trimOptions');
+const trimStartInput = document.getElementById('trimStartInput');
+const trimEndInput = document.getElementById('trimEndInput');
 const compressCheckbox = document.getElementById('compressCheckbox');
 const compressionOptions = document.getElementById('compressionOptions');
 const autoOptimizeCheckbox = document.getElementById('autoOptimizeCheckbox');
@@ -14,6 +23,16 @@ const crfInput = document.getElementById('crfInput');
 const bitrateInput = document.getElementById('bitrateInput');
 const targetSizeInput = document.getElementById('targetSizeInput');
 const realDurationInput = document.getElementById('realDurationInput');
+const decimateInput = document.getElementById('decimateInput');
+const autocropCheckbox = document.getElementById('autocropCheckbox');
+const autocropAlignInput = document.getElementById('autocropAlignInput');
+const alphaCleanupInput = document.getElementById('alphaCleanupInput');
+const keyframePolicyInput = document.getElementById('keyframePolicyInput');
+const keyframeIntervalGroup = document.getElementById('keyframeIntervalGroup');
+const keyframeIntervalInput = document.getElementById('keyframeIntervalInput');
+const altRefCheckbox = document.getElementById('altRefCheckbox');
+const denoiseInput = document.getElementById('denoiseInput');
+const denoiseReportCheckbox = document.getElementById('denoiseReportCheckbox');
 const processBtn = document.getElementById('processBtn');
 const statusMessage = document.getElementById('statusMessage');
 const loadingIndicator = document.getElementById('loadingIndicator');
@@ -28,6 +47,14 @@ compressCheckbox.addEventListener('change', () => {
     }
 });
 
+trimCheckbox.addEventListener('change', () => {
+    if (trimCheckbox.checked) {
+        trimOptions.classList.remove('hidden');
+    } else {
+        trimOptions.classList.add('hidden');
+    }
+});
+
 autoOptimizeCheckbox.addEventListener('change', () => {
     if (autoOptimizeCheckbox.checked) {
         crfGroup.classList.add('hidden');
@@ -40,6 +67,14 @@ autoOptimizeCheckbox.addEventListener('change', () => {
     }
 });
 
+keyframePolicyInput.addEventListener('change', () => {
+    if (keyframePolicyInput.value === 'interval') {
+        keyframeIntervalGroup.classList.remove('hidden');
+    } else {
+        keyframeIntervalGroup.classList.add('hidden');
+    }
+});
+
 dropZone.addEventListener('click', () => {
     fileInput.click();
 });
@@ -69,6 +104,14 @@ fileInput.addEventListener('change', (e) => {
     }
 });
 
+// Files up to DIRECT_UPLOAD_BYTES go in the processing request itself
+// (the server takes 10MB per request); larger ones are sent in chunks to
+// /uploads first and referred to by upload ID
+const MAX_UPLOAD_BYTES = 200 * 1024 * 1024;
+const DIRECT_UPLOAD_BYTES = 9 * 1024 * 1024;
+const UPLOAD_CHUNK_BYTES = 4 * 1024 * 1024;
+const UPLOAD_RETRIES = 5;
+
 function handleFileSelection(file) {
     hideStatusMessage();
     
@@ -77,9 +120,8 @@ function handleFileSelection(file) {
         return;
     }
     
-    const maxSize = 10 * 1024 * 1024;
-    if (file.size > maxSize) {
-        showStatusMessage('File size must be less than 10MB', 'error');
+    if (file.size > MAX_UPLOAD_BYTES) {
+        showStatusMessage('File size must be less than 200MB', 'error');
         return;
     }
     
@@ -88,6 +130,49 @@ function handleFileSelection(file) {
     fileSize.textContent = formatFileSize(file.size);
     fileInfo.classList.remove('hidden');
     processBtn.disabled = false;
+    inspectSelectedFile(file);
+}
+
+// Only the head and the tail of the file are sent, so this stays quick
+// whatever the file size
+const INSPECT_HEAD_BYTES = 256 * 1024;
+const INSPECT_TAIL_BYTES = 64 * 1024;
+
+async function inspectSelectedFile(file) {
+    fileMeta.textContent = '';
+    const formData = new FormData();
+    formData.append('file', file.slice(0, INSPECT_HEAD_BYTES), file.name);
+    formData.append('tail', file.slice(Math.max(file.size - INSPECT_TAIL_BYTES, 0)), 'tail');
+    formData.append('size', file.size.toString());
+    try {
+        const response = await fetch('/inspect', { method: 'POST', body: formData });
+        if (!response.ok || file !== selectedFile) return;
+        fileMeta.textContent = formatInspectReport(await response.json());
+    } catch (error) {
+        // Inspection is informational only
+    }
+}
+
+function formatInspectReport(report) {
+    const parts = [];
+    const video = report.tracks.find(track => track.type === 'video');
+    if (video) {
+        let line = `${video.codec} ${video.pixel_width}x${video.pixel_height}`;
+        if (video.frame_rate) line += `, ${video.frame_rate} fps`;
+        if (video.alpha_mode) line += ', alpha';
+        parts.push(line);
+    }
+    if (report.real_duration_ms !== undefined) {
+        let line = `real length ${(report.real_duration_ms / 1000).toFixed(2)}s`;
+        if (report.duration_mismatch) {
+            line += ` (header says ${(report.info.duration_ms / 1000).toFixed(2)}s)`;
+        }
+        parts.push(line);
+    }
+    if (report.frames_estimated !== undefined) parts.push(`~${report.frames_estimated} frames`);
+    if (report.clusters !== undefined) parts.push(`${report.clusters} clusters`);
+    if (report.tracks.length > 1) parts.push(`${report.tracks.length} tracks`);
+    return parts.join(' · ');
 }
 
 function formatFileSize(bytes) {
@@ -112,8 +197,8 @@ processBtn.addEventListener('click', async () => {
     loadingIndicator.classList.remove('hidden');
     
     const formData = new FormData();
-    formData.append('file', selectedFile);
     formData.append('duration', duration.toString());
+    formData.append('slim', slimCheckbox.checked ? 'true' : 'false');
     
     const useCompression = compressCheckbox.checked;
     let endpoint = '/upload';
@@ -132,12 +217,64 @@ processBtn.addEventListener('click', async () => {
             formData.append('bitrate', bitrateInput.value);
         }
         
+        formData.append('decimate', decimateInput.value);
+        formData.append('autocrop', autocropCheckbox.checked ? 'true' : 'false');
+        formData.append('autocrop_align', autocropAlignInput.value);
+        formData.append('alpha_cleanup', alphaCleanupInput.value);
+        formData.append('denoise', denoiseInput.value);
+        formData.append('keyframe_policy', keyframePolicyInput.value);
+        formData.append('keyframe_interval', keyframeIntervalInput.value);
+        formData.append('alt_ref', altRefCheckbox.checked ? 'auto' : 'off');
+        formData.append('denoise_report', denoiseReportCheckbox.checked ? 'true' : 'false');
+        
         loadingIndicator.querySelector('p').textContent = 'Compressing video (this may take a few minutes)...';
+    } else if (trimCheckbox.checked) {
+        endpoint = '/trim';
+        downloadSuffix = '_trimmed';
+        formData.append('start', trimStartInput.value || '0');
+        formData.append('end', trimEndInput.value);
+        loadingIndicator.querySelector('p').textContent = 'Trimming your file...';
     } else {
+        formData.append('finalize', finalizeCheckbox.checked ? 'true' : 'false');
+        formData.append('cues', cuesCheckbox.checked ? 'true' : 'false');
+        formData.append('retime', retimeCheckbox.checked ? 'true' : 'false');
         loadingIndicator.querySelector('p').textContent = 'Processing your file...';
     }
     
+    // A plain duration fix is done in the browser when the file parses there;
+    // otherwise only the file head goes to the server, which answers with
+    // byte patches. Either way the download is built from the local file.
+    const durationOnly = endpoint === '/upload' && !slimCheckbox.checked && !finalizeCheckbox.checked &&
+        !cuesCheckbox.checked && !retimeCheckbox.checked;
+    
     try {
+        if (durationOnly) {
+            const patched = await patchInBrowser(selectedFile, duration) || await patchFromHead(selectedFile, duration);
+            if (patched) {
+                downloadBlob(patched, downloadSuffix);
+                showStatusMessage('File processed successfully! Download started.', 'success');
+                return;
+            }
+        }
+        
+        // The file goes up at most once; later runs with other settings
+        // refer to it by handle
+        const message = loadingIndicator.querySelector('p');
+        const processingText = message.textContent;
+        const onProgress = (sent) => {
+            message.textContent = `Uploading... ${Math.floor(sent / selectedFile.size * 100)}%`;
+        };
+        const handle = await uploadOnce(selectedFile, onProgress);
+        if (handle) {
+            formData.append('handle', handle);
+            formData.append('filename', selectedFile.name);
+        } else if (selectedFile.size > DIRECT_UPLOAD_BYTES) {
+            formData.append('upload_id', (await uploadResumable(selectedFile, onProgress)).upload_id);
+        } else {
+            formData.append('file', selectedFile);
+        }
+        message.textContent = processingText;
+        
         const response = await fetch(endpoint, {
             method: 'POST',
             body: formData
@@ -148,20 +285,21 @@ processBtn.addEventListener('click', async () => {
             throw new Error(errorData.error || 'Processing failed');
         }
         
-        const blob = await response.blob();
-        const url = window.URL.createObjectURL(blob);
-        const a = document.createElement('a');
-        a.href = url;
-        
-        const originalName = selectedFile.name.replace('.webm', '');
-        a.download = `${originalName}${downloadSuffix}.webm`;
+        downloadBlob(await response.blob(), downloadSuffix);
         
-        document.body.appendChild(a);
-        a.click();
-        document.body.removeChild(a);
-        window.URL.revokeObjectURL(url);
-        
-        showStatusMessage('File processed successfully! Download started.', 'success');
+        const report = response.headers.get('X-Compress-Report');
+        const trimReport = response.headers.get('X-Trim-Report');
+        const editReport = response.headers.get('X-Edit-Report');
+        let summary = report ? formatCompressReport(JSON.parse(report)) : '';
+        if (editReport && JSON.parse(editReport).slim) {
+            summary = formatSlimReport(JSON.parse(editReport).slim);
+        }
+        if (trimReport) {
+            const trim = JSON.parse(trimReport);
+            summary = `\nTrimmed: ${trim.duration.toFixed(3)}s from ${trim.start.toFixed(3)}s ` +
+                `(${trim.frames} frames kept, ${trim.dropped_frames} dropped)`;
+        }
+        showStatusMessage('File processed successfully! Download started.' + summary, 'success');
     } catch (error) {
         showStatusMessage(error.message, 'error');
     } finally {
@@ -170,6 +308,220 @@ processBtn.addEventListener('click', async () => {
     }
 });
 
+// Send `file` to /uploads in chunks. After a failed chunk the committed
+// offset is asked for and the upload resumes from there. Returns the
+// finalized upload's status (upload ID, SHA-256 and handle).
+async function uploadResumable(file, onProgress) {
+    const createData = new FormData();
+    createData.append('filename', file.name);
+    createData.append('size', file.size.toString());
+    let response = await fetch('/uploads', { method: 'POST', body: createData });
+    let status = await response.json();
+    if (!response.ok) throw new Error(status.error || 'Upload failed');
+    
+    const uploadId = status.upload_id;
+    let offset = 0;
+    let failures = 0;
+    while (offset < file.size) {
+        try {
+            response = await fetch(`/uploads/${uploadId}?offset=${offset}`, {
+                method: 'PUT',
+                body: file.slice(offset, offset + UPLOAD_CHUNK_BYTES)
+            });
+            status = await response.json();
+            if (!response.ok && status.offset === undefined) throw new Error(status.error || 'Upload failed');
+            offset = status.offset;
+            failures = response.ok ? 0 : failures + 1;
+        } catch (error) {
+            if (!(error instanceof TypeError) || ++failures > UPLOAD_RETRIES) throw error;
+            // Network error: wait, then ask how much of the file arrived
+            await new Promise(resolve => setTimeout(resolve, 1000 * failures));
+            try {
+                const committed = (await (await fetch(`/uploads/${uploadId}`)).json()).offset;
+                if (committed !== undefined) offset = committed;
+            } catch (statusError) {
+                // Still offline; the next attempt retries from the same offset
+            }
+            continue;
+        }
+        if (failures > UPLOAD_RETRIES) throw new Error(status.error || 'Upload failed');
+        onProgress(offset);
+    }
+    
+    response = await fetch(`/uploads/${uploadId}/finalize`, { method: 'POST' });
+    status = await response.json();
+    if (!response.ok) throw new Error(status.error || 'Upload failed');
+    return status;
+}
+
+const fileHandles = new WeakMap();
+
+// Handle (SHA-256) of `file` on the server, uploading it only when the
+// server does not have it already. Returns null when the browser cannot
+// hash (crypto.subtle needs a secure context); the file then goes with the
+// request itself.
+async function uploadOnce(file, onProgress) {
+    if (!window.crypto || !window.crypto.subtle) return null;
+    let handle = fileHandles.get(file);
+    if (!handle) {
+        const digest = await window.crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+        handle = Array.from(new Uint8Array(digest), byte => byte.toString(16).padStart(2, '0')).join('');
+        fileHandles.set(file, handle);
+    }
+    
+    const check = await fetch(`/blobs/${handle}`, { method: 'HEAD' });
+    if (check.ok) return handle;
+    
+    if (file.size > DIRECT_UPLOAD_BYTES) {
+        return (await uploadResumable(file, onProgress)).handle;
+    }
+    const formData = new FormData();
+    formData.append('file', file);
+    const response = await fetch('/blobs', { method: 'POST', body: formData });
+    const result = await response.json();
+    if (!response.ok) throw new Error(result.error || 'Upload failed');
+    return result.handle;
+}
+
+function downloadBlob(blob, suffix) {
+    const url = window.URL.createObjectURL(blob);
+    const a = document.createElement('a');
+    a.href = url;
+    
+    const originalName = selectedFile.name.replace('.webm', '');
+    a.download = `${originalName}${suffix}.webm`;
+    
+    document.body.appendChild(a);
+    a.click();
+    document.body.removeChild(a);
+    window.URL.revokeObjectURL(url);
+}
+
+// Enough for everything ahead of the first Cluster in practice
+const PATCH_HEAD_BYTES = 256 * 1024;
+
+// Ask /upload/head for the Duration patch and apply it to the local file.
+// Returns the patched Blob, or null when the whole file has to be uploaded.
+async function patchFromHead(file, duration) {
+    const formData = new FormData();
+    formData.append('file', file.slice(0, PATCH_HEAD_BYTES), file.name);
+    formData.append('duration', duration.toString());
+    let manifest;
+    try {
+        const response = await fetch('/upload/head', { method: 'POST', body: formData });
+        if (!response.ok) return null;
+        manifest = await response.json();
+    } catch (error) {
+        return null;
+    }
+    
+    return applySplices(file, manifest.patches.map(patch => {
+        const data = Uint8Array.from(atob(patch.data), c => c.charCodeAt(0));
+        return { offset: patch.offset, length: data.length, data };
+    }));
+}
+
+// The file with each splice's `length` bytes at `offset` replaced by its
+// `data`; splices are sorted and do not overlap
+function applySplices(file, splices) {
+    const parts = [];
+    let pos = 0;
+    for (const splice of splices) {
+        parts.push(file.slice(pos, splice.offset), splice.data);
+        pos = splice.offset + splice.length;
+    }
+    parts.push(file.slice(pos));
+    return new Blob(parts, { type: 'video/webm' });
+}
+
+const EBML_WORKER_URL = new URL('ebml_worker.js', document.currentScript.src);
+let ebmlWorker = null;
+let workerRequestId = 0;
+const workerRequests = new Map();
+
+function getEbmlWorker() {
+    if (ebmlWorker || !window.Worker) return ebmlWorker;
+    ebmlWorker = new Worker(EBML_WORKER_URL);
+    ebmlWorker.onmessage = (event) => {
+        const resolve = workerRequests.get(event.data.id);
+        workerRequests.delete(event.data.id);
+        if (resolve) resolve(event.data);
+    };
+    ebmlWorker.onerror = () => {
+        for (const resolve of workerRequests.values()) resolve({ error: 'Worker failed' });
+        workerRequests.clear();
+    };
+    return ebmlWorker;
+}
+
+// Duration patch worked out by ebml_worker.js from the local file. Returns
+// the patched Blob, or null when the browser cannot do it.
+async function patchInBrowser(file, duration) {
+    const worker = getEbmlWorker();
+    if (!worker) return null;
+    const id = ++workerRequestId;
+    const result = await new Promise(resolve => {
+        workerRequests.set(id, resolve);
+        // Same units as /upload: the Duration is written as seconds
+        worker.postMessage({ id, file, duration: duration / 1000 });
+    });
+    if (result.error) return null;
+    return applySplices(file, result.splices);
+}
+
+function formatSlimReport(slim) {
+    return `\nSlimmed: ${formatFileSize(slim.bytes_in)} → ${formatFileSize(slim.bytes)} ` +
+        `(${slim.removed_tracks} tracks, ${slim.removed_blocks} blocks removed)`;
+}
+
+function formatCompressReport(report) {
+    const parts = [];
+    if (report.bytes) {
+        parts.push(`Output: ${formatFileSize(report.bytes)} in ${report.encode_seconds}s`);
+    }
+    if (report.slim) {
+        parts.push(formatSlimReport(report.slim).trim());
+    }
+    if (report.decimate) {
+        const decimate = report.decimate;
+        parts.push(`Frames: ${decimate.frames_removed} of ${decimate.frames_in} removed as repeats`);
+    }
+    if (report.autocrop) {
+        const crop = report.autocrop.crop;
+        parts.push(crop
+            ? `Auto-crop: ${report.autocrop.source.join('x')} → ${crop[0]}x${crop[1]} (${report.autocrop.pixel_savings_percent}% fewer pixels)`
+            : 'Auto-crop: no transparent border found');
+    }
+    if (report.denoise) {
+        const denoise = report.denoise;
+        let line = `Denoise: ${denoise.level || 'none'}`;
+        if (denoise.noise_psnr !== undefined) {
+            line += ` (noise PSNR ${denoise.noise_psnr === null ? 'inf' : denoise.noise_psnr.toFixed(1)} dB)`;
+        }
+        if (denoise.baseline_bytes) {
+            line += `, ${denoise.savings_percent}% smaller than unfiltered ` +
+                `(${formatFileSize(denoise.baseline_bytes)}, ${denoise.baseline_encode_seconds}s)`;
+        }
+        parts.push(line);
+    }
+    if (report.keyframes) {
+        const keyframes = report.keyframes;
+        let line = `Keyframes: ${keyframes.policy}`;
+        if (keyframes.scene_cuts) {
+            line += ` (${keyframes.scene_cuts.length} scene cuts)`;
+        } else if (keyframes.interval) {
+            line += ` every ${keyframes.interval} frames`;
+        }
+        parts.push(line);
+    }
+    if (report.alt_ref) {
+        parts.push(report.alt_ref.enabled
+            ? 'Alt-ref: enabled (no transparency, alpha plane dropped)'
+            : 'Alt-ref: disabled (video uses transparency)');
+    }
+    return parts.length ? '\n' + parts.join('\n') : '';
+}
+
 function showStatusMessage(message, type) {
     statusMessage.textContent = message;
     statusMessage.className = `status-message ${type}`;
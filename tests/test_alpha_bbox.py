@@ -0,0 +1,78 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+import webm_core
+from tests.webm_files import make_webm
+
+WIDTH, HEIGHT = 64, 48
+
+# A gray plane with the given {(x, y): value} pixels set
+def plane(pixels=()):
+    data = bytearray(WIDTH * HEIGHT)
+    for (x, y), value in dict(pixels).items():
+        data[y * WIDTH + x] = value
+    return bytes(data)
+
+@pytest.mark.parametrize('frames, box', [
+    ([plane()], None),
+    ([plane(), plane()], None),
+    ([plane({(0, 0): 1})], (0, 0, 0, 0)),
+    ([plane({(WIDTH - 1, HEIGHT - 1): 1})], (WIDTH - 1, HEIGHT - 1, WIDTH - 1, HEIGHT - 1)),
+    # A faint 1-px edge at the far right in one frame widens the opaque box
+    ([plane({(20, 10): 255, (30, 30): 255}), plane({(WIDTH - 1, 20): 1})], (20, 10, WIDTH - 1, 30)),
+    ([plane({(5, 40): 1}), plane({(50, 2): 1}), plane()], (5, 2, 50, 40)),
+])
+def test_alpha_bbox(frames, box):
+    assert webm_core.alpha_bbox(frames, WIDTH, HEIGHT) == box
+
+def test_alpha_bbox_rejects_wrong_frame_size():
+    with pytest.raises(ValueError):
+        webm_core.alpha_bbox([plane(), plane()[:-1]], WIDTH, HEIGHT)
+
+# An executable that ignores its arguments and writes `raw` to stdout
+def fake_ffmpeg(tmp_path, raw, code=0):
+    frames = tmp_path / 'frames.raw'
+    frames.write_bytes(raw)
+    script = tmp_path / 'ffmpeg'
+    script.write_text(f'#!{sys.executable}\nimport sys\nsys.stdout.buffer.write(open({str(frames)!r}, "rb").read())\n'
+                      f'sys.stderr.write("decoder said no")\nsys.exit({code})\n')
+    script.chmod(0o755)
+    return str(script)
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'in.webm'
+    path.write_bytes(make_webm(width=WIDTH, height=HEIGHT))
+    return str(path)
+
+posix_only = pytest.mark.skipif(os.name != 'posix', reason='fake ffmpeg is a script')
+
+@posix_only
+def test_detect_alpha_bbox_streams_frames(tmp_path, source, monkeypatch):
+    raw = plane({(8, 8): 255}) * 10 + plane({(0, HEIGHT - 1): 1})
+    monkeypatch.setattr(webm_core, 'FFMPEG_PATH', fake_ffmpeg(tmp_path, raw))
+    assert webm_core.detect_alpha_bbox(source) == (WIDTH, HEIGHT, (0, 8, 8, HEIGHT - 1))
+
+@posix_only
+def test_detect_alpha_bbox_size_mismatch(tmp_path, source, monkeypatch):
+    monkeypatch.setattr(webm_core, 'FFMPEG_PATH', fake_ffmpeg(tmp_path, plane() + b'\0' * 10))
+    with pytest.raises(RuntimeError, match='expected 64x48'):
+        webm_core.detect_alpha_bbox(source)
+
+@posix_only
+def test_detect_alpha_bbox_ffmpeg_error(tmp_path, source, monkeypatch):
+    monkeypatch.setattr(webm_core, 'FFMPEG_PATH', fake_ffmpeg(tmp_path, b'', code=1))
+    with pytest.raises(RuntimeError, match='decoder said no'):
+        webm_core.detect_alpha_bbox(source)
+
+@posix_only
+def test_detect_alpha_bbox_timeout(tmp_path, source, monkeypatch):
+    script = tmp_path / 'ffmpeg'
+    script.write_text(f'#!{sys.executable}\nimport time\ntime.sleep(30)\n')
+    script.chmod(0o755)
+    monkeypatch.setattr(webm_core, 'FFMPEG_PATH', str(script))
+    with pytest.raises(subprocess.TimeoutExpired):
+        webm_core.detect_alpha_bbox(source, timeout=0.5)
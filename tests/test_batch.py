@@ -0,0 +1,89 @@
+import io
+import json
+import zipfile
+
+import pytest
+
+import webm_core
+from tests.webm_files import make_webm
+
+pytest.importorskip('flask')
+import app
+
+def zip_of(entries):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, data in entries:
+            archive.writestr(name, bytes(data))
+    buffer.seek(0)
+    return buffer
+
+def post_batch(data):
+    response = app.app.test_client().post('/upload/batch', data=data)
+    assert response.status_code == 200, response.data
+    archive = zipfile.ZipFile(io.BytesIO(response.data))
+    return archive, json.loads(archive.read('batch_report.json'))
+
+def test_unique_names():
+    names = ['../../etc/x.webm', 'a/x.webm', 'X.WEBM', '..\\..\\win.webm', 'batch_report.json', 'x-2.webm']
+    assert list(app.unique_names(names)) == ['x.webm', 'x-2.webm', 'X-3.webm', 'win.webm', 'batch_report-2.json', 'x-2-2.webm']
+
+def test_zip_names_are_safe_and_unique():
+    source = zip_of([('../evil.webm', make_webm()), ('a/x.webm', make_webm()), ('b/x.webm', make_webm()),
+                     ('/abs/x.webm', make_webm())])
+    archive, report = post_batch({'file': (source, 'in.zip'), 'duration': '1000',
+                                  'durations': json.dumps({'b/x.webm': 2000, 'evil.webm': 500})})
+    names = sorted(info.filename for info in archive.infolist())
+    assert names == ['batch_report.json', 'evil.webm', 'x-2.webm', 'x-3.webm', 'x.webm']
+    assert set(report) == {'evil.webm', 'x.webm', 'x-2.webm', 'x-3.webm'}
+    by_source = {entry['source']: entry for entry in report.values()}
+    assert by_source['b/x.webm']['duration_ms'] == 2000
+    assert by_source['a/x.webm']['duration_ms'] == 1000
+    assert by_source['../evil.webm']['duration_ms'] == 500
+
+def test_duplicate_uploads_keep_every_report():
+    files = [(io.BytesIO(bytes(make_webm())), 'same.webm') for _ in range(3)]
+    archive, report = post_batch({'files': files})
+    assert sorted(report) == ['same-2.webm', 'same-3.webm', 'same.webm']
+    assert len(archive.infolist()) == 4
+
+def test_any_failure_is_reported_per_file(monkeypatch):
+    edit_webm = webm_core.edit_webm
+
+    def flaky(data, duration_ms, **options):
+        if duration_ms == 777:
+            raise OSError('disk full')
+        return edit_webm(data, duration_ms, **options)
+
+    monkeypatch.setattr(webm_core, 'edit_webm', flaky)
+    source = zip_of([('ok.webm', make_webm()), ('os.webm', make_webm()), ('bad.webm', b'not a webm')])
+    archive, report = post_batch({'file': (source, 'in.zip'), 'durations': json.dumps({'os.webm': 777})})
+    assert 'error' not in report['ok.webm']
+    assert report['os.webm']['error'] == 'Processing failed: disk full'
+    assert 'error' in report['bad.webm']
+    assert sorted(info.filename for info in archive.infolist()) == ['batch_report.json', 'ok.webm']
+
+def test_oversized_zip_is_rejected_before_reading(monkeypatch):
+    monkeypatch.setattr(app, 'BATCH_ENTRY_MAX_BYTES', 4096)
+    source = zip_of([('small.webm', b'\0' * 100), ('big.webm', b'\0' * 5000)])
+    response = app.app.test_client().post('/upload/batch', data={'file': (source, 'in.zip')})
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'big.webm is too large when unzipped'
+    monkeypatch.setattr(app, 'BATCH_ENTRY_MAX_BYTES', 8192)
+    monkeypatch.setattr(app, 'BATCH_TOTAL_MAX_BYTES', 4096)
+    source = zip_of([('a.webm', b'\0' * 3000), ('b.webm', b'\0' * 3000)])
+    response = app.app.test_client().post('/upload/batch', data={'file': (source, 'in.zip')})
+    assert response.status_code == 400
+    assert 'too large' in response.get_json()['error']
+
+def test_corrupt_zip_entry_is_reported():
+    data = bytes(make_webm())
+    buffer = zip_of([('ok.webm', make_webm()), ('crc.webm', data)])
+    raw = bytearray(buffer.getvalue())
+    # Flip a byte inside the second entry's stored data so its CRC fails
+    position = raw.rindex(data[-64:]) + 10
+    raw[position] ^= 0xff
+    archive, report = post_batch({'file': (io.BytesIO(bytes(raw)), 'in.zip')})
+    assert report['crc.webm']['error'].startswith('Unreadable zip entry')
+    assert 'error' not in report['ok.webm']
+    assert sorted(info.filename for info in archive.infolist()) == ['batch_report.json', 'ok.webm']
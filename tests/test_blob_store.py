@@ -0,0 +1,68 @@
+import io
+import os
+import time
+import hashlib
+
+import pytest
+
+import blob_store
+
+@pytest.fixture
+def store(tmp_path):
+    return blob_store.BlobStore(str(tmp_path / 'blobs'), 1000, ttl_seconds=3600)
+
+# Make the entry look last used `seconds` ago
+def age(store, digest, seconds):
+    when = time.time() - seconds
+    os.utime(store._path(digest), (when, when))
+
+def put(store, data):
+    return store.put_stream(io.BytesIO(data))[0]
+
+def test_put_and_lookup(store):
+    digest, size, existed = store.put_stream(io.BytesIO(b'abc'))
+    assert digest == hashlib.sha256(b'abc').hexdigest() and size == 3 and not existed
+    assert store.put_stream(io.BytesIO(b'abc')) == (digest, 3, True)
+    assert store.lookup(digest) == 3
+    assert open(store.path(digest), 'rb').read() == b'abc'
+    assert store.lookup('0' * 64) is None
+    with pytest.raises(blob_store.BlobError, match='Unknown'):
+        store.path('0' * 64)
+    with pytest.raises(blob_store.BlobError, match='Invalid'):
+        store.lookup('../x')
+    assert sorted(os.listdir(store.directory)) == [digest]
+
+def test_put_file_does_not_share_the_source(store, tmp_path):
+    source = tmp_path / 'upload.part'
+    source.write_bytes(b'x' * 100)
+    old = time.time() - 7200
+    os.utime(source, (old, old))
+    digest = hashlib.sha256(b'x' * 100).hexdigest()
+    assert store.put_file(str(source), digest) == (digest, 100, False)
+    assert os.stat(store._path(digest)).st_ino != os.stat(source).st_ino
+    # Using the entry leaves the upload's clock alone
+    store.lookup(digest)
+    assert os.path.getmtime(source) == pytest.approx(old)
+    assert open(store.path(digest), 'rb').read() == b'x' * 100
+
+def test_ttl_eviction(store):
+    stale, used, fresh = put(store, b'a'), put(store, b'b'), put(store, b'c')
+    age(store, stale, 7200)
+    age(store, used, 7200)
+    assert store.lookup(used) == 1
+    store.evict()
+    assert store.lookup(stale) is None
+    assert store.lookup(used) == 1 and store.lookup(fresh) == 1
+
+def test_size_cap_evicts_least_recently_used_first(store):
+    digests = [put(store, bytes([n]) * 300) for n in range(3)]
+    for seconds, digest in zip((30, 20, 10), digests):
+        age(store, digest, seconds)
+    # Using the oldest makes the second the least recently used
+    store.lookup(digests[0])
+    newest = put(store, b'z' * 300)
+    assert store.lookup(digests[1]) is None
+    assert all(store.lookup(digest) == 300 for digest in (digests[0], digests[2], newest))
+    # The entry just stored stays even when it alone is over the cap
+    big = put(store, b'y' * 2000)
+    assert sorted(os.listdir(store.directory)) == [big]
@@ -0,0 +1,40 @@
+import pytest
+
+import ebml
+from tests.webm_files import make_webm, check_positions, cue_targets, duration_value
+
+@pytest.mark.parametrize('layout, method', [
+    ({'cues': False, 'void_after_seek': 20, 'void_after_info': 300}, 'void'),
+    ({'void_after_info': 300}, 'void'),
+    ({}, 'rewrite'),
+    ({'cues': False}, 'rewrite'),
+    ({'cues': False, 'seek_head': False}, 'rewrite'),
+    ({'unknown': True, 'tags': True}, 'rewrite'),
+])
+def test_build_cues(layout, method):
+    source = make_webm(gop=10, **layout)
+    data, report = ebml.edit_segment(bytearray(source), cues=True)
+    assert report == {'cues': method}
+    check_positions(data)
+    targets = cue_targets(data)
+    segment, level1 = ebml.parse_segment(data)
+    keyframes = [(timestamp, block.offset) for timestamp, _, _, block in ebml.iter_keyframes(data, level1, 1)]
+    assert targets == keyframes and len(targets) == 12
+    # The new Cues come before the first Cluster and are the only ones
+    cues = [element for element in level1 if element.id == ebml.CUES]
+    assert len(cues) == 1 and cues[0].offset < ebml.first_child(level1, ebml.CLUSTER).offset
+    if method == 'void':
+        assert len(data) == len(source)
+
+def test_cues_with_duration_rewrite():
+    source = make_webm(duration_ms=None)
+    data, report = ebml.edit_segment(bytearray(source), duration=1.0, cues=True)
+    assert report == {'duration': 'rewrite', 'cues': 'rewrite'}
+    check_positions(data)
+    assert duration_value(data) == 1.0
+    assert len(cue_targets(data)) == 4
+
+def test_no_keyframes_leaves_cues_alone():
+    source = make_webm(clusters=0)
+    data, report = ebml.edit_segment(bytearray(source), cues=True)
+    assert report == {'cues': 'unchanged'} and data == source
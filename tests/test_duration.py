@@ -0,0 +1,82 @@
+import struct
+
+import pytest
+
+import ebml
+from tests.webm_files import make_webm, check_positions, duration_value
+
+# Concatenated Cluster bytes, which no Duration edit may change
+def cluster_bytes(data):
+    segment, level1 = ebml.parse_segment(data)
+    return b''.join(bytes(data[element.offset:element.end]) for element in level1 if element.id == ebml.CLUSTER)
+
+@pytest.mark.parametrize('layout, method', [
+    ({}, 'in-place'),
+    ({'duration_ms': None, 'void_in_info': 20}, 'void'),
+    ({'duration_ms': None, 'void_after_info': 20}, 'void'),
+    ({'duration_ms': None, 'void_after_seek': 20}, 'void'),
+    ({'duration_ms': None}, 'rewrite'),
+    ({'duration_ms': None, 'seek_head': False}, 'rewrite'),
+    ({'duration_ms': None, 'unknown': True}, 'rewrite'),
+    ({'duration_ms': None, 'void_in_info': 3}, 'rewrite'),
+])
+def test_set_duration(layout, method):
+    source = make_webm(**layout)
+    data, used = ebml.set_duration(bytearray(source), 2.5)
+    assert used == method
+    check_positions(data)
+    assert duration_value(data) == 2.5
+    assert cluster_bytes(data) == cluster_bytes(source)
+    if method != 'rewrite':
+        assert len(data) == len(source)
+
+def test_rewrite_moves_seek_head_and_cues_positions():
+    source = make_webm(duration_ms=None, tags=True)
+    data, method = ebml.set_duration(bytearray(source), 1.0)
+    segment, level1 = ebml.parse_segment(data)
+    old_segment, old_level1 = ebml.parse_segment(source)
+    growth = len(data) - len(source)
+    assert method == 'rewrite' and growth > 0
+    old_clusters = [element.offset for element in old_level1 if element.id == ebml.CLUSTER]
+    new_clusters = [element.offset for element in level1 if element.id == ebml.CLUSTER]
+    assert new_clusters == [offset + growth for offset in old_clusters]
+    check_positions(data)
+
+@pytest.mark.parametrize('width', [8, 4])
+def test_existing_duration_is_overwritten_at_its_width(width):
+    source = make_webm()
+    if width == 4:
+        # Same Info length: a 4-byte float and a 4-byte Void replace the double
+        double = ebml.float_element(ebml.DURATION, 4000.0)
+        single = ebml.encode_element(ebml.DURATION, struct.pack('>f', 4000.0)) + ebml.void_element(4)
+        assert len(single) == len(double)
+        source = bytearray(bytes(source).replace(double, single, 1))
+    info = ebml.first_child(ebml.parse_segment(source)[1], ebml.INFO)
+    duration = ebml.find_child(source, info, ebml.DURATION)
+    assert duration.size == width
+    data, method = ebml.set_duration(bytearray(source), 0.25)
+    assert method == 'in-place' and len(data) == len(source)
+    assert ebml.read_float(data, duration) == 0.25
+
+# The value is written as given whatever the TimestampScale
+def test_value_is_written_as_given():
+    data, _ = ebml.set_duration(make_webm(timestamp_scale=100000), 1.5)
+    assert duration_value(data) == 1.5
+
+def test_head_patch_matches_full_edit():
+    for layout in ({}, {'duration_ms': None, 'void_in_info': 20}, {'duration_ms': None, 'void_after_info': 20}):
+        source = make_webm(**layout)
+        expected, _ = ebml.set_duration(bytearray(source), 3.0)
+        patched = bytearray(source)
+        patches, _ = ebml.duration_patch(bytes(source[:2048]), 3.0)
+        for offset, blob in patches:
+            patched[offset:offset + len(blob)] = blob
+        assert patched == expected
+
+def test_head_patch_refuses_growth():
+    with pytest.raises(ebml.EBMLError):
+        ebml.duration_patch(bytes(make_webm(duration_ms=None)[:2048]), 3.0)
+
+def test_rejects_non_ebml():
+    with pytest.raises(ebml.EBMLError):
+        ebml.set_duration(bytearray(b'\x00' * 64), 1.0)
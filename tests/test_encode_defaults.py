@@ -0,0 +1,74 @@
+# The prefilter options have no measured size results yet, so none of them
+# may switch on unless asked for
+import io
+import os
+import re
+import sys
+import json
+
+import pytest
+
+import webm_batch
+import webm_core
+from tests.webm_files import make_webm
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def index_html():
+    with open(os.path.join(ROOT, 'templates', 'index.html')) as f:
+        return f.read()
+
+def batch_options(monkeypatch, *args):
+    monkeypatch.setattr(sys, 'argv', ['webm_batch', 'compress', 'in.webm', *args])
+    return webm_batch.job_options(webm_batch.parse_args())
+
+# No option runs an analysis pass, so the input is never opened
+def test_plan_filters_defaults_are_plain():
+    report = {}
+    filters, extra_args = webm_core.plan_filters('missing.webm', {}, report)
+    assert report == {}
+    assert filters == ['format=yuva420p']
+    assert '-g' not in extra_args and '-force_key_frames' not in extra_args
+    assert extra_args[extra_args.index('-auto-alt-ref') + 1] == '0'
+
+def test_alpha_cleanup_is_off_by_default(monkeypatch):
+    assert batch_options(monkeypatch)['alpha_cleanup'] == 'off'
+    assert re.search(r'<option value="off" selected>', index_html().split('id="alphaCleanupInput"')[1])
+
+# Runs /compress with an ffmpeg that logs its arguments and copies the input
+# to the output. Returns (encode command, report).
+def compress_defaults(tmp_path, monkeypatch):
+    pytest.importorskip('flask')
+    import app
+    log = tmp_path / 'args.jsonl'
+    script = tmp_path / 'ffmpeg'
+    script.write_text(f'#!{sys.executable}\nimport sys, json, shutil\n'
+                      f'open({str(log)!r}, "a").write(json.dumps(sys.argv[1:]) + "\\n")\n'
+                      'shutil.copy(sys.argv[sys.argv.index("-i") + 1], sys.argv[-1])\n')
+    script.chmod(0o755)
+    monkeypatch.setattr(webm_core, 'FFMPEG_PATH', str(script))
+    response = app.app.test_client().post('/compress', data={'file': (io.BytesIO(bytes(make_webm())), 'a.webm')})
+    assert response.status_code == 200, response.data
+    commands = [json.loads(line) for line in log.read_text().splitlines()]
+    assert len(commands) == 1
+    return commands[0], json.loads(response.headers['X-Compress-Report'])
+
+@pytest.mark.skipif(os.name != 'posix', reason='fake ffmpeg is a script')
+def test_compress_route_encodes_without_alpha_cleanup(tmp_path, monkeypatch):
+    cmd, report = compress_defaults(tmp_path, monkeypatch)
+    assert 'alpha_cleanup' not in report
+    assert cmd[cmd.index('-vf') + 1] == 'format=yuva420p'
+
+def test_keyframe_policy_and_alt_ref_are_off_by_default(monkeypatch):
+    options = batch_options(monkeypatch)
+    assert (options['keyframe_policy'], options['alt_ref']) == ('default', 'off')
+    page = index_html()
+    assert re.search(r'<option value="default" selected>', page.split('id="keyframePolicyInput"')[1])
+    assert re.search(r'<input type="checkbox" id="altRefCheckbox">', page)
+
+@pytest.mark.skipif(os.name != 'posix', reason='fake ffmpeg is a script')
+def test_compress_route_leaves_keyframes_and_alt_ref_to_libvpx(tmp_path, monkeypatch):
+    cmd, report = compress_defaults(tmp_path, monkeypatch)
+    assert 'keyframes' not in report and 'alt_ref' not in report
+    assert '-g' not in cmd and '-force_key_frames' not in cmd
+    assert cmd[cmd.index('-auto-alt-ref') + 1] == '0' and cmd[cmd.index('-lag-in-frames') + 1] == '0'
@@ -0,0 +1,41 @@
+import pytest
+
+import ebml
+from tests.webm_files import make_webm, check_positions, duration_value
+
+# (id, payload) of every Cluster, which finalizing must keep byte for byte
+def cluster_payloads(data):
+    segment, level1 = ebml.parse_segment(data)
+    return [(element.id, bytes(data[element.data_offset:element.end])) for element in level1 if element.id == ebml.CLUSTER]
+
+@pytest.mark.parametrize('marker, method', [
+    (b'\x01\xff\xff\xff\xff\xff\xff\xff', 'in-place'),
+    (b'\x1f\xff\xff\xff', 'in-place'),
+    (b'\xff', 'rewrite'),
+])
+def test_finalize_sizes(marker, method):
+    source = make_webm(unknown=True, marker=marker)
+    data, used = ebml.finalize_sizes(bytearray(source))
+    assert used == method
+    segment, level1 = ebml.parse_segment(data)
+    assert not segment.unknown_size and not any(element.unknown_size for element in level1)
+    assert segment.end == len(data)
+    assert cluster_payloads(data) == cluster_payloads(source)
+    assert check_positions(data) == 4000
+    if method == 'in-place':
+        assert len(data) == len(source)
+
+def test_known_sizes_are_unchanged():
+    source = make_webm()
+    data, method = ebml.finalize_sizes(bytearray(source))
+    assert method == 'unchanged' and data == source
+
+def test_finalize_with_duration_rewrite_in_one_pass():
+    source = make_webm(unknown=True, marker=b'\xff', duration_ms=None, tags=True)
+    data, report = ebml.edit_segment(bytearray(source), duration=2.0, finalize=True)
+    assert report == {'finalize': 'rewrite', 'duration': 'rewrite'}
+    segment, level1 = ebml.parse_segment(data)
+    assert not any(element.unknown_size for element in [segment] + level1)
+    check_positions(data)
+    assert duration_value(data) == 2.0
+    assert cluster_payloads(data) == cluster_payloads(source)
@@ -0,0 +1,67 @@
+import struct
+import time
+
+import pytest
+
+import ebml
+import frame_stats
+from ebml import encode_element as element, uint_element as uint
+from tests.webm_files import make_webm, ebml_header, tracks_element, simple_block, UNKNOWN_SIZE
+
+# An unknown-size Segment with one two-frame Cluster at each timestamp (ms)
+def clusters_at(times):
+    clusters = b''.join(
+        element(ebml.CLUSTER, uint(ebml.TIMESTAMP, t) + simple_block(1, 0, True, b'k' * 100) + simple_block(1, 33, False, b'd' * 50))
+        for t in times
+    )
+    segment = ebml.encode_id(ebml.SEGMENT) + UNKNOWN_SIZE + element(ebml.INFO, uint(ebml.TIMESTAMP_SCALE, 1000000)) + tracks_element() + clusters
+    return ebml_header() + segment
+
+def stats_for(data, chunk_size=4096, **options):
+    return frame_stats.frame_stats((data[pos:pos + chunk_size] for pos in range(0, len(data), chunk_size)), **options)
+
+def test_frames_and_gops():
+    stats = stats_for(bytes(make_webm(clusters=2, frames=30, gop=10)))
+    assert stats['video_track'] == 1 and stats['clusters'] == 2 and not stats['truncated']
+    assert stats['frames']['timestamp_ms'][:3] == [0, 33, 66]
+    assert stats['frames']['keyframe'] == [1 if n % 10 == 0 else 0 for n in range(60)]
+    assert [gop['start_frame'] for gop in stats['gops']] == [0, 10, 20, 30, 40, 50]
+    assert all(gop['frames'] == 10 for gop in stats['gops'])
+    assert stats['duration_ms'] == 1990
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 100, 1 << 20])
+def test_chunk_size_does_not_change_stats(chunk_size):
+    data = bytes(make_webm(clusters=3, audio=True, unknown=True))
+    assert stats_for(data, chunk_size) == stats_for(data)
+
+def test_bitrate_starts_at_first_frame():
+    stats = stats_for(clusters_at([5000, 5500]), window_ms=1000, step_ms=100)
+    bitrate = stats['bitrate']
+    assert bitrate['start_ms'] == 5000 and bitrate['step_ms'] == 100
+    # Samples at 5000, 5100, ... 5600: the last frame is at 5533
+    assert len(bitrate['kbps']) == 7
+    assert bitrate['kbps'][0] == 100 * 8 / 1000
+    assert bitrate['kbps'][-1] == 300 * 8 / 1000
+
+def test_huge_timestamp_gap_is_capped():
+    started = time.monotonic()
+    stats = stats_for(clusters_at([0, 1 << 40]), step_ms=1)
+    assert time.monotonic() - started < 5
+    bitrate = stats['bitrate']
+    assert len(bitrate['kbps']) <= frame_stats.MAX_BITRATE_POINTS
+    assert bitrate['step_ms'] > 1
+    assert bitrate['start_ms'] + (len(bitrate['kbps']) - 1) * bitrate['step_ms'] >= stats['frames']['timestamp_ms'][-1]
+
+def test_binary_matches_json():
+    stats = stats_for(clusters_at([2000, 3000, 4000]))
+    blob = frame_stats.to_binary(stats)
+    n, m, window_ms, step_ms, start_us = struct.unpack_from('<IIIII', blob, 4)
+    assert blob[:4] == b'WFS2'
+    assert (n, m, window_ms, step_ms, start_us) == (6, len(stats['bitrate']['kbps']), 1000, 100, 2000000)
+    timestamps = struct.unpack_from(f'<{n}I', blob, 24)
+    assert [t / 1000 for t in timestamps] == stats['frames']['timestamp_ms']
+    assert len(blob) == 24 + 9 * n + 4 * m
+
+def test_rejects_non_ebml():
+    with pytest.raises(ebml.EBMLError):
+        stats_for(b'\x00\x00\x00\x18ftypmp42' + bytes(100))
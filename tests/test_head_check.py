@@ -0,0 +1,83 @@
+import io
+import tempfile
+
+import pytest
+
+import ebml
+import inspect_webm
+from tests.webm_files import make_webm
+
+MP4 = b'\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00mp42isom' + bytes(1000)
+
+def feed(data, size, codecs=None):
+    check = inspect_webm.HeadCheck(codecs)
+    for pos in range(0, len(data), size):
+        check.feed(data[pos:pos + size])
+    return check
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 64, 4096])
+def test_accepted_file_split_anywhere(size):
+    assert feed(bytes(make_webm(audio=True, tags=True)), size).done
+
+@pytest.mark.parametrize('data, message', [
+    (MP4, 'looks like an MP4/MOV file'),
+    (b'GIF89a' + bytes(100), 'looks like a GIF image'),
+    (b'\x00' * 100, 'missing EBML header'),
+    (bytes(make_webm()).replace(b'\x42\x82\x84webm', b'\x42\x82\x84qtff', 1), "Unsupported DocType 'qtff'"),
+])
+@pytest.mark.parametrize('size', [1, 4096])
+def test_rejected_files(data, message, size):
+    with pytest.raises(ebml.EBMLError, match=message):
+        feed(data, size)
+
+def test_codec_limit():
+    vp8 = bytes(make_webm()).replace(b'V_VP9', b'V_VP8', 1)
+    assert feed(vp8, 5).done
+    with pytest.raises(ebml.EBMLError, match='Unsupported video codec V_VP8'):
+        feed(vp8, 5, {'V_VP9'})
+
+def test_matroska_doc_type_is_accepted():
+    assert feed(bytes(make_webm()).replace(b'\x42\x82\x84webm', b'\x42\x82\x88matroska', 1), 3).done
+
+def test_checked_stream_writes_through_until_rejected():
+    pytest.importorskip('flask')
+    import app
+    reasons = []
+    target = io.BytesIO()
+    stream = app.CheckedFileStream(target, inspect_webm.HeadCheck(), reasons.append)
+    data = bytes(make_webm())
+    for pos in range(0, len(data), 100):
+        stream.write(data[pos:pos + 100])
+    assert target.getvalue() == data and reasons == []
+    stream = app.CheckedFileStream(io.BytesIO(), inspect_webm.HeadCheck(), reasons.append)
+    with pytest.raises(ebml.EBMLError):
+        stream.write(MP4)
+    assert reasons == ['Not a WebM file: this looks like an MP4/MOV file']
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    pytest.importorskip('flask')
+    import app
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    return app.app.test_client()
+
+@pytest.mark.parametrize('route', ['/upload', '/compress', '/stats', '/blobs', '/upload/head'])
+@pytest.mark.parametrize('padding', [0, 600 * 1024])
+def test_renamed_mp4_is_refused(client, tmp_path, route, padding):
+    response = client.post(route, data={'file': (io.BytesIO(MP4 + bytes(padding)), 'clip.webm'), 'duration': '1000'})
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Not a WebM file: this looks like an MP4/MOV file'
+    response.close()
+    # A spooled part is removed with the response
+    assert list(tmp_path.glob('*.upload')) == []
+
+def test_compress_refuses_other_codecs(client):
+    vp8 = bytes(make_webm()).replace(b'V_VP9', b'V_VP8', 1)
+    response = client.post('/compress', data={'file': (io.BytesIO(vp8), 'a.webm')})
+    assert response.status_code == 400 and 'V_VP8' in response.get_json()['error']
+
+def test_spooled_webm_passes(client):
+    data = bytes(make_webm(clusters=400))
+    assert len(data) > 512 * 1024
+    response = client.post('/stats', data={'file': (io.BytesIO(data), 'a.webm')})
+    assert response.status_code == 200, response.data
@@ -0,0 +1,80 @@
+import io
+
+import pytest
+
+import ebml
+import inspect_webm
+import webm_core
+from tests.webm_files import make_webm
+
+def inspect_whole(data):
+    data = bytes(data)
+    return inspect_webm.inspect([data], data[-inspect_webm.TAIL_BYTES:], len(data))
+
+# What /inspect gets from the page: the head in small reads, then the tail
+def inspect_sliced(data, head_bytes, read_size=777):
+    data = bytes(data)
+    head = data[:head_bytes]
+    chunks = [head[pos:pos + read_size] for pos in range(0, len(head), read_size)]
+    return inspect_webm.inspect(chunks, data[-inspect_webm.TAIL_BYTES:], len(data))
+
+@pytest.mark.parametrize('layout', [
+    {},
+    {'duration_ms': None},
+    {'duration_ms': None, 'void_in_info': 20},
+    {'duration_ms': None, 'void_after_info': 20},
+    {'unknown': True},
+    {'seek_head': False, 'cues': False},
+])
+@pytest.mark.parametrize('retime', [False, True])
+def test_upload_output_reports_requested_length(layout, retime):
+    data, report = webm_core.edit_webm(make_webm(**layout), 900, retime=retime)
+    info = inspect_whole(data)
+    if retime:
+        # Retiming writes ticks that match the rescaled timestamps
+        assert info['info']['duration_ms'] == pytest.approx(900, abs=1)
+        assert not info['duration_mismatch']
+    else:
+        assert info['info']['duration'] == 0.9
+
+@pytest.mark.parametrize('timestamp_scale', [1000000, 100000])
+def test_head_patch_reports_requested_length(timestamp_scale):
+    data = make_webm(timestamp_scale=timestamp_scale)
+    patches, method = ebml.duration_patch(bytes(data[:4096]), 2.5)
+    for offset, blob in patches:
+        data[offset:offset + len(blob)] = blob
+    assert method == 'in-place'
+    assert inspect_whole(data)['info']['duration'] == 2.5
+
+def test_matching_duration_is_not_a_mismatch():
+    info = inspect_whole(make_webm(clusters=3, frames=30, duration_ms=2990))
+    assert info['real_duration_ms'] == pytest.approx(2990, abs=1)
+    assert not info['duration_mismatch']
+
+@pytest.mark.parametrize('layout', [{}, {'audio': True, 'tags': True}, {'unknown': True}, {'duration_ms': None}])
+def test_head_and_tail_agree_with_whole_file(layout):
+    data = make_webm(clusters=40, **layout)
+    whole = inspect_whole(data)
+    first_cluster = ebml.parse_head(data)[1][-1].end
+    for head_bytes in (first_cluster + 12, first_cluster + 5000):
+        sliced = inspect_sliced(data, head_bytes)
+        for key in ('doc_type', 'segment_offset', 'unknown_size', 'seek', 'first_cluster_offset', 'info', 'tracks', 'real_duration_ms', 'duration_mismatch'):
+            assert sliced.get(key) == whole.get(key), key
+
+def test_real_duration_from_tail_matches_content():
+    data = make_webm(clusters=5, frames=30)
+    segment, level1 = ebml.parse_segment(data)
+    ticks = ebml.content_duration(data, level1)
+    assert inspect_whole(data)['real_duration_ms'] == pytest.approx(ticks, abs=0.01)
+
+def test_rejects_non_ebml():
+    with pytest.raises(ebml.EBMLError):
+        inspect_webm.inspect([b'\x00\x00\x00\x18ftypmp42' + bytes(100)])
+
+def test_upload_route_output_reports_requested_length():
+    pytest.importorskip('flask')
+    import app
+    client = app.app.test_client()
+    response = client.post('/upload', data={'file': (io.BytesIO(bytes(make_webm(duration_ms=None))), 'a.webm'), 'duration': '1234'})
+    assert response.status_code == 200
+    assert inspect_whole(response.data)['info']['duration'] == 1.234
@@ -0,0 +1,90 @@
+import os
+
+import pytest
+
+import ebml
+import local_patch
+from tests.webm_files import make_webm, check_positions, duration_value
+
+def no_reflink(*args):
+    raise OSError('Operation not supported')
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'a.webm'
+    path.write_bytes(bytes(make_webm()))
+    return path
+
+def patched(report, source_bytes, source):
+    data = open(report['output'], 'rb').read()
+    check_positions(data)
+    assert duration_value(data) == 2.5
+    assert open(source, 'rb').read() == source_bytes
+    return data
+
+def test_patch_copy(source, tmp_path):
+    before = source.read_bytes()
+    report = local_patch.patch_file(str(source), str(tmp_path / 'b.webm'), 2500)
+    assert report['duration'] == 'in-place' and report['clone'] in ('reflink', 'copy_file_range', 'copy')
+    # Only changed bytes of the 8-byte float are written over the clone
+    assert 0 < report['bytes_written'] <= 8
+    data = patched(report, before, source)
+    assert len(data) == len(before)
+    assert sorted(os.listdir(tmp_path)) == ['a.webm', 'b.webm']
+
+def test_patch_in_place(source):
+    report = local_patch.patch_file(str(source), str(source), 2500)
+    data = source.read_bytes()
+    check_positions(data)
+    assert report['duration'] == 'in-place' and duration_value(data) == 2.5
+
+def test_growing_info_is_rewritten(tmp_path):
+    source = tmp_path / 'a.webm'
+    source.write_bytes(bytes(make_webm(duration_ms=None)))
+    before = source.read_bytes()
+    report = local_patch.patch_file(str(source), str(tmp_path / 'b.webm'), 2500)
+    assert report['duration'] == 'rewrite' and report['clone'] is None
+    assert len(patched(report, before, source)) > len(before)
+
+def test_failures_leave_nothing_behind(tmp_path):
+    empty = tmp_path / 'empty.webm'
+    empty.write_bytes(b'')
+    bad = tmp_path / 'bad.webm'
+    bad.write_bytes(b'\x00' * 100)
+    for path in (empty, bad):
+        with pytest.raises(ebml.EBMLError):
+            local_patch.patch_file(str(path), str(tmp_path / 'out.webm'), 1000)
+    assert sorted(os.listdir(tmp_path)) == ['bad.webm', 'empty.webm']
+
+# Without reflinks (FICLONE failing) the kernel copy is used, and without
+# that a plain copy
+@pytest.mark.parametrize('copy_file_range, method', [(True, 'copy_file_range'), (False, 'copy')])
+def test_clone_fallbacks(source, tmp_path, monkeypatch, copy_file_range, method):
+    if local_patch.fcntl is not None:
+        monkeypatch.setattr(local_patch.fcntl, 'ioctl', no_reflink)
+    if copy_file_range and not hasattr(os, 'copy_file_range'):
+        pytest.skip('no copy_file_range here')
+    if not copy_file_range and hasattr(os, 'copy_file_range'):
+        def fail(*args):
+            raise OSError('Invalid cross-device link')
+        monkeypatch.setattr(os, 'copy_file_range', fail)
+    before = source.read_bytes()
+    report = local_patch.patch_file(str(source), str(tmp_path / 'b.webm'), 2500)
+    assert report['clone'] == method
+    patched(report, before, source)
+
+def test_failed_kernel_copy_starts_over(source, tmp_path, monkeypatch):
+    if not hasattr(os, 'copy_file_range'):
+        pytest.skip('no copy_file_range here')
+    copy_file_range = os.copy_file_range
+    # Part of the file arrives before the kernel copy gives up
+    def partial(src, dst, count, *args):
+        if os.fstat(dst).st_size:
+            raise OSError('Invalid cross-device link')
+        return copy_file_range(src, dst, 100)
+    monkeypatch.setattr(os, 'copy_file_range', partial)
+    if local_patch.fcntl is not None:
+        monkeypatch.setattr(local_patch.fcntl, 'ioctl', no_reflink)
+    with open(source, 'rb') as src, open(tmp_path / 'b.webm', 'w+b') as dst:
+        assert local_patch.clone_into(src.fileno(), dst.fileno()) == 'copy'
+    assert (tmp_path / 'b.webm').read_bytes() == source.read_bytes()
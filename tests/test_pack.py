@@ -0,0 +1,105 @@
+import io
+import os
+import sys
+import json
+import zipfile
+
+import pytest
+
+import webm_batch
+import webm_core
+from tests.webm_files import make_webm
+
+LIMITS = {'max_kb': webm_core.PACK_MAX_KB, 'max_px': webm_core.PACK_MAX_PX, 'max_ms': webm_core.PACK_MAX_MS}
+
+posix_only = pytest.mark.skipif(os.name != 'posix', reason='fake ffmpeg is a script')
+
+# An ffmpeg that runs `body` (Python) with sys.argv as FFmpeg's would be
+def fake_ffmpeg(tmp_path, monkeypatch, body):
+    script = tmp_path / 'ffmpeg'
+    script.write_text(f'#!{sys.executable}\nimport sys, shutil\n{body}\n')
+    script.chmod(0o755)
+    monkeypatch.setattr(webm_core, 'FFMPEG_PATH', str(script))
+
+# Too wide for the pack, so it is planned as an encode
+def oversized():
+    data = bytes(make_webm(clusters=2, width=1024, height=512))
+    plan = webm_core.plan_sticker(data, LIMITS)
+    assert plan['mode'] == 'encode'
+    return data, plan
+
+def test_edit_mode_sticker():
+    data = bytes(make_webm(clusters=2, duration_ms=None))
+    plan = webm_core.plan_sticker(data, LIMITS)
+    name, output, report = webm_core.build_sticker('a.webm', data, plan, LIMITS)
+    assert plan['mode'] == 'edit' and output is not None and 'error' not in report
+
+@posix_only
+def test_ffmpeg_failure_is_an_encode_error(tmp_path, monkeypatch):
+    fake_ffmpeg(tmp_path, monkeypatch, 'sys.stderr.write("Invalid data found"); sys.exit(1)')
+    data, plan = oversized()
+    with pytest.raises(webm_core.EncodeError, match='Invalid data found'):
+        webm_core.encode_sticker(data, plan, LIMITS, {})
+    name, output, report = webm_core.build_sticker('a.webm', data, plan, LIMITS)
+    assert output is None and 'Invalid data found' in report['error']
+
+@posix_only
+def test_missing_output_is_reported(tmp_path, monkeypatch):
+    fake_ffmpeg(tmp_path, monkeypatch, 'pass')
+    data, plan = oversized()
+    name, output, report = webm_core.build_sticker('a.webm', data, plan, LIMITS)
+    assert output is None and 'No such file' in report['error']
+
+@posix_only
+def test_batch_cli_reports_sticker_errors(tmp_path, monkeypatch):
+    fake_ffmpeg(tmp_path, monkeypatch, 'sys.exit(1)')
+    data, _ = oversized()
+    (tmp_path / 'a.webm').write_bytes(data)
+    report = webm_batch.run_job('sticker', str(tmp_path / 'a.webm'), str(tmp_path / 'out.webm'), LIMITS)
+    assert report['error'].startswith('FFmpeg error') and 'output' not in report
+    assert not (tmp_path / 'out.webm').exists()
+
+@posix_only
+def test_pack_route_reports_failed_sticker(tmp_path, monkeypatch):
+    pytest.importorskip('flask')
+    import app
+    # Workers that do not inherit the patched path fail on a missing ffmpeg
+    # instead, which must be reported the same way
+    fake_ffmpeg(tmp_path, monkeypatch, 'sys.exit(1)')
+    data, _ = oversized()
+    files = [(io.BytesIO(data), 'big.webm'), (io.BytesIO(bytes(make_webm(clusters=2))), 'small.webm')]
+    response = app.app.test_client().post('/pack', data={'files': files})
+    assert response.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(response.data))
+    stickers = json.loads(archive.read('pack_report.json'))['stickers']
+    assert stickers['big.webm']['error']
+    assert 'error' not in stickers['small.webm']
+    assert sorted(info.filename for info in archive.infolist()) == ['pack_report.json', 'small.webm']
+
+# Kills the worker it runs in, which breaks the process pool
+def crash(name, data, plan, limits):
+    os._exit(1)
+
+def post_pack(files):
+    import app
+    response = app.app.test_client().post('/pack', data={'files': [(io.BytesIO(data), name) for name, data in files]})
+    assert response.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(response.data))
+    return archive, json.loads(archive.read('pack_report.json'))['stickers']
+
+@pytest.mark.parametrize('build', [lambda *args: None, crash])
+def test_pack_survives_worker_failures(build, monkeypatch):
+    pytest.importorskip('flask')
+    import app
+    files = [('a.webm', bytes(make_webm(clusters=2))), ('b.webm', bytes(make_webm(clusters=2)))]
+    # A lambda cannot be sent to a worker; crash() takes the worker down
+    monkeypatch.setattr(webm_core, 'build_sticker', build)
+    archive, stickers = post_pack(files)
+    assert sorted(stickers) == ['a.webm', 'b.webm']
+    assert all(report['error'].startswith('Encode failed') for report in stickers.values())
+    assert [info.filename for info in archive.infolist()] == ['pack_report.json']
+    # The next request gets a working pool
+    monkeypatch.undo()
+    archive, stickers = post_pack(files)
+    assert not any('error' in report for report in stickers.values())
+    assert app.pack_pool is app.get_pack_pool()
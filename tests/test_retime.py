@@ -0,0 +1,70 @@
+import pytest
+
+import ebml
+from tests.webm_files import make_webm, check_positions
+
+# Real playback length in seconds
+def real_seconds(data):
+    segment, level1 = ebml.parse_segment(data)
+    return ebml.content_duration(data, level1) * ebml.timestamp_scale(data, level1) / 1e9
+
+# (track, payload) of every frame, which retiming must never touch
+def frames(data):
+    segment, level1 = ebml.parse_segment(data)
+    return [(track, bytes(data[block.data_offset + 4:block.end])) for _, track, _, _, _, block in ebml.iter_blocks(data, level1)]
+
+# Frame start times in seconds
+def frame_times(data):
+    segment, level1 = ebml.parse_segment(data)
+    scale = ebml.timestamp_scale(data, level1)
+    return [frame[0] * scale / 1e9 for frame in ebml.iter_blocks(data, level1)]
+
+@pytest.mark.parametrize('layout, factor, method', [
+    ({}, 0.5, 'timestamps'),
+    ({'duration_ms': None}, 0.5, 'timestamps'),
+    ({'timestamp_scale': 100000}, 40, 'scale'),
+    ({'clusters': 1}, 100, 'rewrite'),
+    ({'clusters': 1, 'duration_ms': None, 'seek_head': False}, 100, 'rewrite'),
+    ({'clusters': 1, 'unknown': True}, 100, 'rewrite'),
+])
+def test_retime(layout, factor, method):
+    source = make_webm(**layout)
+    target = real_seconds(source) * factor
+    data, report = ebml.edit_segment(bytearray(source), retime=target)
+    assert report['retime'] == method
+    # Within a tick of the target; Duration matches the content exactly
+    assert real_seconds(data) == pytest.approx(target, abs=0.001)
+    assert check_positions(data) == pytest.approx(real_seconds(data) * 1000)
+    assert frames(data) == frames(source)
+    assert frame_times(data) == pytest.approx([time * factor for time in frame_times(source)], abs=0.002)
+    if 'rewrite' not in report.values():
+        assert len(data) == len(source)
+
+def test_rewrite_scales_default_duration():
+    source = make_webm(clusters=1)
+    data, _ = ebml.edit_segment(bytearray(source), retime=real_seconds(source) * 100)
+    segment, level1 = ebml.parse_segment(data)
+    video = ebml.track_entries(data, level1)[1]
+    assert ebml.read_uint(data, video[ebml.DEFAULT_DURATION]) == 3300000000
+
+def test_retime_with_cues_and_finalize():
+    source = make_webm(clusters=2, unknown=True, marker=b'\xff')
+    data, report = ebml.edit_segment(bytearray(source), finalize=True, cues=True, retime=200.0)
+    assert report == {'retime': 'rewrite', 'duration': 'rewrite', 'finalize': 'rewrite', 'cues': 'rewrite'}
+    assert real_seconds(data) == pytest.approx(200.0)
+    assert check_positions(data) == pytest.approx(200000)
+    segment, level1 = ebml.parse_segment(data)
+    assert not any(element.unknown_size for element in [segment] + level1)
+
+def test_audio_is_rejected():
+    with pytest.raises(ebml.EBMLError):
+        ebml.edit_segment(make_webm(audio=True), retime=2.0)
+
+@pytest.mark.parametrize('seconds', [0, -1])
+def test_target_must_be_positive(seconds):
+    with pytest.raises(ebml.EBMLError):
+        ebml.edit_segment(make_webm(), retime=seconds)
+
+def test_no_frames_is_rejected():
+    with pytest.raises(ebml.EBMLError):
+        ebml.edit_segment(make_webm(clusters=0), retime=2.0)
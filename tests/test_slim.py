@@ -0,0 +1,61 @@
+import pytest
+
+import ebml
+from tests.webm_files import make_webm, check_positions, cue_targets
+
+def slimmed(source):
+    chunks, report = ebml.slim(source)
+    data = bytearray(b''.join(chunks))
+    assert len(data) == report['bytes']
+    return data, report
+
+# Bytes of every video block element, which slimming must copy verbatim
+def video_blocks(data):
+    segment, level1 = ebml.parse_segment(data)
+    return [(timestamp, bytes(data[element.offset:element.end]))
+            for timestamp, track, _, _, element, _ in ebml.iter_blocks(data, level1) if track == 1]
+
+def level1_ids(data):
+    return [element.id for element in ebml.parse_segment(data)[1]]
+
+@pytest.mark.parametrize('layout', [
+    {'audio': True, 'tags': True, 'void_after_seek': 30, 'void_in_info': 10, 'void_after_info': 10},
+    {'audio': True, 'unknown': True},
+    {'seek_head': False, 'cues': False},
+    {},
+])
+def test_slim(layout):
+    source = make_webm(gop=10, **layout)
+    data, report = slimmed(source)
+    assert video_blocks(data) == video_blocks(source)
+    # Cues gain a point per keyframe, so only dropping audio always shrinks the file
+    assert report['saved_bytes'] == len(source) - len(data)
+    if layout.get('audio'):
+        assert report['saved_bytes'] > 0
+    assert report['removed_tracks'] == (1 if layout.get('audio') else 0)
+    assert report['removed_blocks'] == (40 if layout.get('audio') else 0)
+
+    ids = level1_ids(data)
+    assert ebml.TAGS not in ids and ebml.VOID not in ids
+    assert (ebml.SEEK_HEAD in ids) == layout.get('seek_head', True)
+    assert (ebml.CUES in ids) == layout.get('cues', True)
+    segment, level1 = ebml.parse_segment(data)
+    assert not any(element.unknown_size for element in [segment] + level1)
+    assert list(ebml.track_entries(data, level1)) == [1]
+    info = ebml.first_child(level1, ebml.INFO)
+    assert ebml.find_child(data, info, ebml.VOID) is None
+    assert check_positions(data) == 4000
+    if ebml.CUES in ids:
+        keyframes = [(timestamp, block.offset) for timestamp, _, _, block in ebml.iter_keyframes(data, level1, 1)]
+        assert cue_targets(data) == keyframes
+
+def test_slim_is_idempotent():
+    once, _ = slimmed(make_webm(audio=True, tags=True))
+    twice, report = slimmed(once)
+    assert twice == once and report['saved_bytes'] == 0
+
+def test_slim_without_video():
+    source = make_webm()
+    source = source.replace(b'V_VP9', b'A_VP9').replace(bytes([0x83, 0x81, 0x01]), bytes([0x83, 0x81, 0x02]), 1)
+    with pytest.raises(ebml.EBMLError):
+        ebml.slim(source)
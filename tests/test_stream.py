@@ -0,0 +1,78 @@
+import io
+import random
+
+import pytest
+
+import ebml
+from ebml_stream import PushParser, iter_events
+from tests.webm_files import make_webm
+
+def events_for(data, sizes, parser=None):
+    parser = parser or PushParser()
+    events = []
+    pos = 0
+    for size in sizes:
+        events += parser.feed(data[pos:pos + size])
+        pos += size
+    events += parser.feed(data[pos:])
+    events += parser.close()
+    return [(kind, element.id, element.offset, element.data_offset, element.size, payload)
+            for kind, element, payload in events], parser
+
+def fixed(size, total):
+    return [size] * (total // size)
+
+@pytest.mark.parametrize('layout', [{}, {'unknown': True}, {'audio': True, 'tags': True, 'void_in_info': 10}])
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 12, 13, 100, 4096])
+def test_chunk_size_does_not_change_events(layout, size):
+    data = bytes(make_webm(**layout))
+    whole, _ = events_for(data, [])
+    sliced, parser = events_for(data, fixed(size, len(data)))
+    assert sliced == whole
+    assert not parser.truncated and parser.offset == len(data)
+
+def test_random_chunks_match_whole():
+    data = bytes(make_webm(unknown=True, audio=True))
+    whole, _ = events_for(data, [])
+    rng = random.Random(7)
+    for _ in range(20):
+        sizes = [rng.randint(0, 50) for _ in range(len(data) // 20)]
+        assert events_for(data, sizes)[0] == whole
+
+@pytest.mark.parametrize('layout', [{}, {'unknown': True}])
+def test_level1_matches_parse_segment(layout):
+    data = bytes(make_webm(**layout))
+    segment, level1 = ebml.parse_segment(bytearray(data))
+    events, _ = events_for(data, fixed(5, len(data)))
+    ends = {offset: (element_id, size) for kind, element_id, offset, _, size, _ in events if kind == 'end'}
+    for element in [segment] + level1:
+        assert ends[element.offset] == (element.id, element.size)
+
+def test_captured_and_peeked_payloads():
+    data = bytes(make_webm())
+    events, _ = events_for(data, fixed(3, len(data)), PushParser(peek={ebml.SIMPLE_BLOCK: 4}))
+    payloads = {}
+    for kind, element_id, _, _, _, payload in events:
+        if kind == 'end' and payload is not None:
+            payloads.setdefault(element_id, []).append(payload)
+    assert payloads[ebml.DOC_TYPE] == [b'webm']
+    assert payloads[ebml.CODEC_ID] == [b'V_VP9']
+    # Track 1, timecode 0, keyframe, then the first payload byte
+    assert payloads[ebml.SIMPLE_BLOCK][0] == b'\x81\x00\x00\x80'
+    assert len(payloads[ebml.SIMPLE_BLOCK]) == 120 and all(len(payload) == 4 for payload in payloads[ebml.SIMPLE_BLOCK])
+
+def test_truncated_input():
+    data = bytes(make_webm())
+    for cut in (5, 100, len(data) - 3):
+        _, parser = events_for(data[:cut], fixed(11, cut))
+        assert parser.truncated
+
+# Unknown sizes are only filled in at the end event, so compare those
+def test_iter_events_matches_feed():
+    data = bytes(make_webm(unknown=True))
+    events = [(element.id, element.offset, element.size) for kind, element, _ in iter_events(io.BytesIO(data), 17) if kind == 'end']
+    assert events == [(element_id, offset, size) for kind, element_id, offset, _, size, _ in events_for(data, [])[0] if kind == 'end']
+
+def test_rejects_garbage():
+    with pytest.raises(ebml.EBMLError):
+        PushParser().feed(b'\x00' * 16)
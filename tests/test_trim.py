@@ -0,0 +1,64 @@
+import pytest
+
+import ebml
+from tests.webm_files import make_webm, check_positions, cue_targets, FRAME_MS
+
+def trimmed(source, start=0.0, end=None):
+    chunks, report = ebml.trim(source, start, end)
+    data = bytearray(b''.join(chunks))
+    assert len(data) == report['bytes']
+    return data, report
+
+# (timestamp, track, payload) of every frame
+def frames(data):
+    segment, level1 = ebml.parse_segment(data)
+    return [(timestamp, track, bytes(data[block.data_offset + 4:block.end]))
+            for timestamp, track, _, _, _, block in ebml.iter_blocks(data, level1)]
+
+@pytest.mark.parametrize('layout', [{}, {'unknown': True}, {'audio': True, 'tags': True}, {'seek_head': False, 'cues': False}])
+@pytest.mark.parametrize('start, end, cut', [
+    (0.0, None, 0),
+    (1.5, 3.0, 1330),
+    (1.33, 2.0, 1330),
+    (0.1, 0.5, 0),
+])
+def test_trim(layout, start, end, cut):
+    source = make_webm(gop=10, **layout)
+    data, report = trimmed(source, start, end)
+    end_tick = end * 1000 if end is not None else float('inf')
+    expected = [(timestamp - cut, track, payload) for timestamp, track, payload in frames(source) if cut <= timestamp < end_tick]
+    assert frames(data) == expected
+    assert report['start'] == cut / 1000
+    assert report['frames'] == len(expected)
+    assert report['dropped_frames'] == len(frames(source)) - len(expected)
+    # Rebased to zero on a keyframe, Duration covering the last frame
+    assert expected[0][0] == 0
+    segment, level1 = ebml.parse_segment(data)
+    duration = ebml.content_duration(data, level1)
+    if not layout.get('audio'):
+        assert duration == max(timestamp for timestamp, _, _ in expected) + FRAME_MS
+    assert check_positions(data) == pytest.approx(duration)
+    assert report['duration'] == pytest.approx(duration / 1000)
+    assert not any(element.unknown_size for element in [segment] + level1)
+    keyframes = [(timestamp, block.offset) for timestamp, _, _, block in ebml.iter_keyframes(data, level1, 1)]
+    assert cue_targets(data) == keyframes
+
+def test_trim_timestamp_scale():
+    source = make_webm(gop=10, timestamp_scale=100000)
+    data, report = trimmed(source, 0.15, 0.2)
+    # Ticks are 0.1 ms: the keyframe at tick 1330 is the cut, 2000 the end
+    assert report['start'] == pytest.approx(0.133)
+    assert [timestamp for timestamp, _, _ in frames(data)] == [timestamp - 1330 for timestamp, _, _ in frames(source) if 1330 <= timestamp < 2000]
+
+@pytest.mark.parametrize('start, end', [(-1, None), (2.0, 1.0), (1.0, 1.0)])
+def test_bad_range(start, end):
+    with pytest.raises(ebml.EBMLError):
+        ebml.trim(make_webm(), start, end)
+
+def test_late_start_snaps_to_last_keyframe():
+    data, report = trimmed(make_webm(gop=10), 10.0, 11.0)
+    assert report['start'] == pytest.approx(3.66) and report['frames'] == 10
+
+def test_no_frames():
+    with pytest.raises(ebml.EBMLError):
+        ebml.trim(make_webm(clusters=0))
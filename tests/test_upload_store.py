@@ -0,0 +1,120 @@
+import io
+import os
+import time
+import hashlib
+
+import pytest
+
+import upload_store
+
+DATA = bytes(range(256)) * 1024
+
+@pytest.fixture
+def store(tmp_path):
+    return upload_store.UploadStore(str(tmp_path), 1024 * 1024)
+
+# A request body whose connection drops after `size` bytes
+class DroppedStream:
+    def __init__(self, data, size):
+        self.stream = io.BytesIO(data[:size])
+
+    def read(self, size):
+        block = self.stream.read(min(size, 1000))
+        if not block:
+            raise OSError('connection reset')
+        return block
+
+def test_chunks_and_finalize(store):
+    upload_id = store.create('a.webm', len(DATA))['upload_id']
+    assert store.write(upload_id, 0, io.BytesIO(DATA[:100000])) == 100000
+    # A retried chunk overlapping the committed bytes only adds the rest
+    assert store.write(upload_id, 50000, io.BytesIO(DATA[50000:])) == len(DATA)
+    status = store.finalize(upload_id)
+    assert status['finalized'] and status['sha256'] == hashlib.sha256(DATA).hexdigest()
+    path, filename = store.open_path(upload_id)
+    assert filename == 'a.webm' and open(path, 'rb').read() == DATA
+    # Finalizing again is harmless, writing is not allowed any more
+    assert store.finalize(upload_id) == status
+    with pytest.raises(upload_store.UploadError, match='already finalized'):
+        store.write(upload_id, len(DATA), io.BytesIO(b''))
+
+def test_chunk_past_the_committed_offset_is_refused(store):
+    upload_id = store.create('a.webm', len(DATA))['upload_id']
+    store.write(upload_id, 0, io.BytesIO(DATA[:10]))
+    with pytest.raises(upload_store.UploadError, match='only 10 bytes'):
+        store.write(upload_id, 20, io.BytesIO(DATA[20:]))
+    assert store.status(upload_id)['offset'] == 10
+
+def test_resume_after_a_failed_chunk(store):
+    upload_id = store.create('a.webm', len(DATA))['upload_id']
+    with pytest.raises(OSError):
+        store.write(upload_id, 0, DroppedStream(DATA, 123456))
+    # What arrived before the drop is kept and the hash goes on from there,
+    # in this store or a new one (another process, a restart)
+    offset = store.status(upload_id)['offset']
+    assert offset == 123456
+    resumed = upload_store.UploadStore(store.directory, store.max_bytes)
+    resumed.write(upload_id, offset, io.BytesIO(DATA[offset:]))
+    assert resumed.finalize(upload_id)['sha256'] == hashlib.sha256(DATA).hexdigest()
+
+def test_finalize_checks_the_size(store):
+    upload_id = store.create('a.webm', len(DATA))['upload_id']
+    store.write(upload_id, 0, io.BytesIO(DATA[:-1]))
+    with pytest.raises(upload_store.UploadError, match='incomplete'):
+        store.finalize(upload_id)
+    with pytest.raises(upload_store.UploadError, match='not finalized'):
+        store.open_path(upload_id)
+    with pytest.raises(upload_store.UploadError, match='past the declared'):
+        store.write(upload_id, 0, io.BytesIO(DATA + b'x'))
+    store.write(upload_id, len(DATA) - 1, io.BytesIO(DATA[-1:]))
+    assert store.finalize(upload_id)['sha256'] == hashlib.sha256(DATA).hexdigest()
+
+def test_limits_and_unknown_ids(store):
+    with pytest.raises(upload_store.UploadError, match='limit'):
+        store.create('a.webm', store.max_bytes + 1)
+    for upload_id in ('0' * 32, '../x', ''):
+        with pytest.raises(upload_store.UploadError, match='Unknown upload ID'):
+            store.write(upload_id, 0, io.BytesIO(b'x'))
+    assert os.listdir(store.directory) == []
+
+def test_uploads_expire_after_the_ttl(store):
+    stale = store.create('a.webm', 10)['upload_id']
+    fresh = store.create('b.webm', 10)['upload_id']
+    store.write(fresh, 0, io.BytesIO(b'12345'))
+    old = time.time() - store.ttl_seconds - 1
+    os.utime(os.path.join(store.directory, stale + '.part'), (old, old))
+    store.expire()
+    with pytest.raises(upload_store.UploadError):
+        store.status(stale)
+    assert store.status(fresh)['offset'] == 5
+    assert sorted(os.listdir(store.directory)) == [fresh + '.json', fresh + '.part']
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_lock_is_held_across_processes(store):
+    upload_id = store.create('a.webm', len(DATA))['upload_id']
+    ready, go = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        with store._locked(upload_id):
+            os.write(go, b'1')
+            time.sleep(0.3)
+            os.write(os.open(store._path(upload_id, '.part'), os.O_WRONLY | os.O_APPEND), DATA[:10])
+        os._exit(0)
+    os.read(ready, 1)
+    # Waits for the other process, then sees the bytes it committed
+    assert store.write(upload_id, 10, io.BytesIO(DATA[10:20])) == 20
+    os.waitpid(pid, 0)
+
+def test_routes_answer_409_with_the_offset_to_resume_from(tmp_path, monkeypatch):
+    pytest.importorskip('flask')
+    import app
+    monkeypatch.setattr(app, 'uploads', upload_store.UploadStore(str(tmp_path), 1024 * 1024))
+    client = app.app.test_client()
+    upload_id = client.post('/uploads', data={'filename': 'a.webm', 'size': '20'}).get_json()['upload_id']
+    response = client.put(f'/uploads/{upload_id}?offset=0', data=b'x' * 8)
+    assert response.status_code == 200 and response.headers['Upload-Offset'] == '8'
+    response = client.put(f'/uploads/{upload_id}?offset=12', data=b'x' * 8)
+    assert response.status_code == 409 and response.get_json()['offset'] == 8
+    response = client.post(f'/uploads/{upload_id}/finalize')
+    assert response.status_code == 409 and 'incomplete' in response.get_json()['error']
+    assert client.put(f'/uploads/{"0" * 32}?offset=0', data=b'x').status_code == 404
@@ -0,0 +1,88 @@
+import os
+import sys
+import json
+
+import pytest
+
+import webm_batch
+from tests.webm_files import make_webm, check_positions, duration_value
+
+PATCH = {'duration_ms': 2500, 'finalize': False, 'cues': False, 'retime': False, 'slim': False}
+
+@pytest.fixture
+def tree(tmp_path):
+    for name in ('a.webm', 'sub/b.webm', 'sub/deeper/c.webm', 'notes.txt'):
+        path = tmp_path / 'in' / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(bytes(make_webm()) if name.endswith('.webm') else b'x')
+    return tmp_path / 'in'
+
+def test_collect_files(tree):
+    files = webm_batch.collect_files([str(tree)])
+    assert [relative for _, relative in files] == ['a.webm', os.path.join('sub', 'b.webm'), os.path.join('sub', 'deeper', 'c.webm')]
+    assert all(os.path.isfile(path) for path, _ in files)
+    files = webm_batch.collect_files([str(tree / 'sub' / '*.webm'), str(tree / 'missing.webm')])
+    assert files == [(str(tree / 'sub' / 'b.webm'), 'b.webm')]
+
+def test_output_path(tmp_path):
+    path = str(tmp_path / 'in' / 'sub' / 'b.webm')
+    relative = os.path.join('sub', 'b.webm')
+    assert webm_batch.output_path('patch', path, relative, None) == str(tmp_path / 'in' / 'sub' / 'b_fixed.webm')
+    assert webm_batch.output_path('sticker', path, relative, None) == str(tmp_path / 'in' / 'sub' / 'b_sticker.webm')
+    assert webm_batch.output_path('compress', path, relative, str(tmp_path / 'out')) == str(tmp_path / 'out' / 'sub' / 'b.webm')
+    assert webm_batch.output_path('patch', path, relative, str(tmp_path / 'out'), in_place=True) == path
+    assert webm_batch.output_path('inspect', path, relative, str(tmp_path / 'out')) is None
+
+# A plain Duration fix goes through local_patch, other edits through edit_webm
+@pytest.mark.parametrize('edits, key', [({}, 'clone'), ({'cues': True}, 'cues')])
+def test_patch_job(tree, tmp_path, edits, key):
+    source = str(tree / 'sub' / 'b.webm')
+    before = open(source, 'rb').read()
+    output = str(tmp_path / 'out' / 'sub' / 'b.webm')
+    report = webm_batch.run_job('patch', source, output, dict(PATCH, **edits))
+    assert 'error' not in report and report['output'] == output
+    data = open(output, 'rb').read()
+    check_positions(data)
+    assert duration_value(data) == 2.5
+    assert open(source, 'rb').read() == before
+    assert key in report['result']
+
+def test_inspect_job(tree):
+    report = webm_batch.run_job('inspect', str(tree / 'a.webm'), None, {})
+    assert 'error' not in report and 'output' not in report
+    assert report['result']
+
+@pytest.mark.parametrize('operation', ['patch', 'inspect'])
+def test_job_errors_are_reported(tmp_path, operation):
+    bad = tmp_path / 'bad.webm'
+    bad.write_bytes(b'\x00' * 100)
+    for path in (str(bad), str(tmp_path / 'missing.webm')):
+        report = webm_batch.run_job(operation, path, str(tmp_path / 'out.webm'), PATCH)
+        assert report['error'] and 'output' not in report and report['seconds'] >= 0
+    assert not (tmp_path / 'out.webm').exists()
+
+def run_main(monkeypatch, *args):
+    monkeypatch.setattr(sys, 'argv', ['webm_batch', *args])
+    return webm_batch.main()
+
+def test_main_patches_in_place_and_writes_the_summary(tree, tmp_path, monkeypatch, capsys):
+    (tree / 'sub' / 'bad.webm').write_bytes(b'\x00' * 100)
+    summary_path = str(tmp_path / 'report.json')
+    assert run_main(monkeypatch, 'patch', str(tree), '--duration', '2500', '--in-place', '--workers', '2', '--json', summary_path) == 1
+    for name in ('a.webm', 'sub/b.webm', 'sub/deeper/c.webm'):
+        assert duration_value(open(tree / name, 'rb').read()) == 2.5
+    report = json.load(open(summary_path))
+    assert report['summary']['files'] == 4 and report['summary']['failed'] == 1
+    assert len(capsys.readouterr().out.splitlines()) == 4
+
+# Kills the worker process it runs in
+def crash(operation, path, output, options):
+    os._exit(1)
+
+def test_main_survives_a_lost_worker(tree, tmp_path, monkeypatch):
+    monkeypatch.setattr(webm_batch, 'run_job', crash)
+    summary_path = str(tmp_path / 'report.json')
+    assert run_main(monkeypatch, 'inspect', str(tree), '--workers', '1', '--json', summary_path) == 1
+    report = json.load(open(summary_path))
+    assert report['summary']['failed'] == report['summary']['files'] == 3
+    assert all(entry['error'].startswith('Worker failed') for entry in report['files'])
@@ -0,0 +1,158 @@
+# Synthetic WebM files for the tests: a VP9 video track (plus optional Opus
+# audio) with placeholder frame payloads, laid out the way ffmpeg writes them
+# (SeekHead, Info, Tracks, Tags, Clusters, Cues), and a checker that every
+# SeekHead and Cues position lands on the element it names.
+import struct
+
+import ebml
+from ebml import encode_element as element, uint_element as uint, float_element
+
+UNKNOWN_SIZE = b'\x01\xff\xff\xff\xff\xff\xff\xff'
+FRAME_MS = 33
+
+def ebml_header(doc_type=b'webm'):
+    return element(ebml.EBML_HEADER, uint(0x4286, 1) + uint(0x42F7, 1) + uint(0x42F2, 4) + uint(0x42F3, 8)
+                   + element(ebml.DOC_TYPE, doc_type) + uint(0x4287, 4) + uint(0x4285, 2))
+
+def simple_block(track, timecode, keyframe, payload):
+    return element(ebml.SIMPLE_BLOCK, ebml.encode_vint(track) + struct.pack('>h', timecode)
+                   + bytes([0x80 if keyframe else 0]) + payload)
+
+def tracks_element(audio=False, width=512, height=512):
+    video = element(ebml.TRACK_ENTRY, uint(ebml.TRACK_NUMBER, 1) + uint(0x73C5, 1) + uint(ebml.TRACK_TYPE, 1)
+                    + element(ebml.CODEC_ID, b'V_VP9') + uint(ebml.DEFAULT_DURATION, FRAME_MS * 1000000)
+                    + element(ebml.VIDEO, uint(ebml.PIXEL_WIDTH, width) + uint(ebml.PIXEL_HEIGHT, height)
+                              + uint(ebml.ALPHA_MODE, 1)))
+    sound = b''
+    if audio:
+        sound = element(ebml.TRACK_ENTRY, uint(ebml.TRACK_NUMBER, 2) + uint(0x73C5, 2) + uint(ebml.TRACK_TYPE, 2)
+                        + element(ebml.CODEC_ID, b'A_OPUS') + element(ebml.CODEC_PRIVATE, b'OpusHead' + bytes(11)))
+    return element(ebml.TRACKS, video + sound)
+
+# Clusters of `frames` video frames each, one second apart, with a keyframe
+# every `gop` frames. Frame n's payload repeats the byte n % 256.
+def cluster_elements(count, frames, audio=False, gop=30, unknown=False, marker=UNKNOWN_SIZE):
+    clusters = []
+    frame = 0
+    for index in range(count):
+        body = uint(ebml.TIMESTAMP, index * 1000)
+        for n in range(frames):
+            keyframe = frame % gop == 0
+            body += simple_block(1, n * FRAME_MS, keyframe, bytes([frame % 256]) * (200 if keyframe else 40))
+            if audio and n % 3 == 0:
+                body += simple_block(2, n * FRAME_MS, True, b'\x01' * 20)
+            frame += 1
+        size = marker if unknown else ebml.encode_vint(len(body), 8)
+        clusters.append(ebml.encode_id(ebml.CLUSTER) + size + body)
+    return clusters
+
+# A complete file. `duration_ms` None leaves Info without a Duration (like
+# MediaRecorder output); the void_* arguments add Void padding of that many
+# bytes after the SeekHead, inside Info or after Info. `unknown` writes
+# `marker` as the Segment and Cluster sizes.
+def make_webm(clusters=4, frames=30, duration_ms=4000.0, seek_head=True, cues=True, void_after_seek=0,
+              void_in_info=0, void_after_info=0, unknown=False, audio=False, tags=False, gop=30,
+              timestamp_scale=1000000, width=512, height=512, marker=UNKNOWN_SIZE):
+    info_body = uint(ebml.TIMESTAMP_SCALE, timestamp_scale) + element(ebml.MUXING_APP, b'Lavf') + element(ebml.WRITING_APP, b'Lavf')
+    if duration_ms is not None:
+        info_body += float_element(ebml.DURATION, duration_ms * 1e6 / timestamp_scale)
+    if void_in_info:
+        info_body += ebml.void_element(void_in_info)
+    info = element(ebml.INFO, info_body)
+    tracks = tracks_element(audio, width, height)
+    cluster_blobs = cluster_elements(clusters, frames, audio, gop, unknown, marker)
+    tag_blob = element(ebml.TAGS, element(0x7373, element(0x67C8, element(0x45A3, b'ENCODER') + element(0x4487, b'Lavf')))) if tags else b''
+    after_seek = ebml.void_element(void_after_seek) if void_after_seek else b''
+    after_info = ebml.void_element(void_after_info) if void_after_info else b''
+
+    # Positions relative to the Segment data for a SeekHead of `seek_length`
+    def layout(seek_length):
+        pos = seek_length + len(after_seek)
+        positions = {'info': pos}
+        pos += len(info) + len(after_info)
+        positions['tracks'] = pos
+        pos += len(tracks)
+        positions['tags'] = pos
+        pos += len(tag_blob)
+        positions['clusters'] = []
+        for blob in cluster_blobs:
+            positions['clusters'].append(pos)
+            pos += len(blob)
+        positions['cues'] = pos
+        return positions
+
+    seek_blob = b''
+    if seek_head:
+        # The SeekHead's own length moves what it points at; iterate to a fixpoint
+        for _ in range(4):
+            positions = layout(len(seek_blob))
+            entries = [(ebml.encode_id(ebml.INFO), positions['info']), (ebml.encode_id(ebml.TRACKS), positions['tracks'])]
+            if tags:
+                entries.append((ebml.encode_id(ebml.TAGS), positions['tags']))
+            if cues:
+                entries.append((ebml.encode_id(ebml.CUES), positions['cues']))
+            seek_blob = ebml.encode_seek_head(entries)
+    positions = layout(len(seek_blob))
+    cue_blob = b''
+    if cues:
+        points = b''.join(
+            element(ebml.CUE_POINT, uint(ebml.CUE_TIME, index * 1000) + element(ebml.CUE_TRACK_POSITIONS,
+                    uint(ebml.CUE_TRACK, 1) + uint(ebml.CUE_CLUSTER_POSITION, position) + uint(ebml.CUE_RELATIVE_POSITION, 12)))
+            for index, position in enumerate(positions['clusters'])
+        )
+        cue_blob = element(ebml.CUES, points)
+    body = seek_blob + after_seek + info + after_info + tracks + tag_blob + b''.join(cluster_blobs) + cue_blob
+    segment = ebml.encode_id(ebml.SEGMENT) + (marker if unknown else ebml.encode_vint(len(body), 8)) + body
+    return bytearray(ebml_header() + segment)
+
+# The Duration value as stored, or None
+def duration_value(data):
+    segment, level1 = ebml.parse_segment(data)
+    duration = ebml.find_child(data, ebml.first_child(level1, ebml.INFO), ebml.DURATION)
+    return ebml.read_float(data, duration) if duration is not None else None
+
+# Assert that SeekHead entries and CueClusterPositions point at the elements
+# they name and that a known Segment size covers the file. Returns the
+# Duration in milliseconds (None without one).
+def check_positions(data):
+    segment, level1 = ebml.parse_segment(data)
+    by_position = {element.offset - segment.data_offset: element for element in level1}
+    for seek_head in (element for element in level1 if element.id == ebml.SEEK_HEAD):
+        for seek_id, position in ebml._seek_entries(data, seek_head):
+            target = by_position.get(position)
+            assert target is not None and ebml.encode_id(target.id) == seek_id, (seek_id.hex(), position)
+    for cues in (element for element in level1 if element.id == ebml.CUES):
+        for point in ebml.children(data, cues):
+            for field in ebml.children(data, point):
+                if field.id != ebml.CUE_TRACK_POSITIONS:
+                    continue
+                position = ebml.read_uint(data, ebml.find_child(data, field, ebml.CUE_CLUSTER_POSITION))
+                target = by_position.get(position)
+                assert target is not None and target.id == ebml.CLUSTER, position
+    if not segment.unknown_size:
+        assert segment.end == len(data)
+    info = ebml.first_child(level1, ebml.INFO)
+    duration = ebml.find_child(data, info, ebml.DURATION)
+    if duration is None:
+        return None
+    return ebml.read_float(data, duration) * ebml.timestamp_scale(data, level1) / 1e6
+
+# (CueTime, block) for every CuePoint, asserting that its Cluster and
+# relative positions land on a video keyframe with that timestamp
+def cue_targets(data):
+    segment, level1 = ebml.parse_segment(data)
+    cues = ebml.first_child(level1, ebml.CUES)
+    assert cues is not None
+    clusters = {element.offset - segment.data_offset: element for element in level1 if element.id == ebml.CLUSTER}
+    targets = []
+    for point in ebml.children(data, cues):
+        time = ebml.read_uint(data, ebml.find_child(data, point, ebml.CUE_TIME))
+        positions = ebml.find_child(data, point, ebml.CUE_TRACK_POSITIONS)
+        cluster = clusters[ebml.read_uint(data, ebml.find_child(data, positions, ebml.CUE_CLUSTER_POSITION))]
+        block = ebml.read_element(data, cluster.data_offset + ebml.read_uint(data, ebml.find_child(data, positions, ebml.CUE_RELATIVE_POSITION)))
+        assert block.id == ebml.SIMPLE_BLOCK
+        track, timecode, flags, _ = ebml.read_block_header(data, block)
+        cluster_time = ebml.read_uint(data, ebml.find_child(data, cluster, ebml.TIMESTAMP))
+        assert track == 1 and flags & 0x80 and cluster_time + timecode == time
+        targets.append((time, block.offset))
+    return targets
@@ -0,0 +1,202 @@
+# Resumable uploads written straight to disk.
+#
+# An upload is created with its file name and total size, then receives
+# chunks at given offsets. A chunk may start anywhere up to the committed
+# offset (bytes already stored are skipped, so a retried chunk is harmless);
+# a chunk starting past it is refused with the committed offset so the
+# client can resume from there. The SHA-256 is updated as bytes are
+# committed, so finalizing does not read the file again. State lives next
+# to the data so an upload can be resumed after a restart. Chunks and
+# finalizing are serialized per upload with a file lock, so several worker
+# processes can share the directory.
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import threading
+import contextlib
+
+try:
+    import fcntl
+    msvcrt = None
+except ImportError:  # Windows
+    import msvcrt
+
+READ_SIZE = 64 * 1024
+ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+class UploadError(ValueError):
+    pass
+
+class UploadStore:
+    def __init__(self, directory, max_bytes, ttl_seconds=24 * 3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._locks = {}
+        self._hashes = {}  # upload ID -> (offset, running SHA-256)
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, upload_id, suffix):
+        if not ID_PATTERN.match(upload_id or ''):
+            raise UploadError('Unknown upload ID')
+        return os.path.join(self.directory, upload_id + suffix)
+
+    def _upload_lock(self, upload_id):
+        with self._lock:
+            return self._locks.setdefault(upload_id, threading.Lock())
+
+    # Held across threads and processes: flock on the data file, or on
+    # Windows a byte lock past the largest allowed size, where it cannot get
+    # in the way of reading or writing the data
+    @contextlib.contextmanager
+    def _locked(self, upload_id):
+        with self._upload_lock(upload_id):
+            try:
+                f = open(self._path(upload_id, '.part'), 'rb')
+            except FileNotFoundError:
+                raise UploadError('Unknown upload ID') from None
+            with f:
+                if msvcrt is None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                    yield
+                    return
+                f.seek(self.max_bytes)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                try:
+                    yield
+                finally:
+                    f.seek(self.max_bytes)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _load(self, upload_id):
+        try:
+            with open(self._path(upload_id, '.json')) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise UploadError('Unknown upload ID') from None
+
+    def _save(self, upload_id, meta):
+        path = self._path(upload_id, '.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(path + '.tmp', path)
+
+    # Running hash of the committed bytes, rebuilt from disk when this
+    # process has not seen the upload yet (e.g. after a restart)
+    def _hash(self, upload_id, offset):
+        cached = self._hashes.get(upload_id)
+        if cached is not None and cached[0] == offset:
+            return cached[1]
+        digest = hashlib.sha256()
+        with open(self._path(upload_id, '.part'), 'rb') as f:
+            remaining = offset
+            while remaining:
+                block = f.read(min(READ_SIZE, remaining))
+                if not block:
+                    break
+                digest.update(block)
+                remaining -= len(block)
+        return digest
+
+    def create(self, filename, size):
+        if size < 0:
+            raise UploadError('Upload size must not be negative')
+        if size > self.max_bytes:
+            raise UploadError(f'Upload is larger than the {self.max_bytes // (1024 * 1024)}MB limit')
+        self.expire()
+        upload_id = uuid.uuid4().hex
+        open(self._path(upload_id, '.part'), 'wb').close()
+        self._save(upload_id, {'filename': filename, 'size': size, 'created': time.time(), 'sha256': None})
+        return self.status(upload_id)
+
+    def status(self, upload_id):
+        meta = self._load(upload_id)
+        return {
+            'upload_id': upload_id,
+            'filename': meta['filename'],
+            'size': meta['size'],
+            'offset': os.path.getsize(self._path(upload_id, '.part')),
+            'finalized': meta['sha256'] is not None,
+            'sha256': meta['sha256'],
+        }
+
+    # Store the bytes read from `stream` at `offset`. Returns the committed
+    # offset afterwards. Raises UploadError when the chunk starts past the
+    # committed offset or would run past the declared size.
+    def write(self, upload_id, offset, stream):
+        with self._locked(upload_id):
+            meta = self._load(upload_id)
+            if meta['sha256'] is not None:
+                raise UploadError('Upload is already finalized')
+            path = self._path(upload_id, '.part')
+            committed = os.path.getsize(path)
+            if offset > committed:
+                raise UploadError(f'Chunk starts at {offset} but only {committed} bytes are committed')
+            digest = self._hash(upload_id, committed)
+
+            skip = committed - offset
+            with open(path, 'ab') as f:
+                try:
+                    while True:
+                        block = stream.read(READ_SIZE)
+                        if not block:
+                            break
+                        if skip:
+                            dropped = min(skip, len(block))
+                            block = block[dropped:]
+                            skip -= dropped
+                        if committed + len(block) > meta['size']:
+                            raise UploadError('Chunk runs past the declared upload size')
+                        f.write(block)
+                        digest.update(block)
+                        committed += len(block)
+                finally:
+                    # Whatever reached the file before a dropped connection
+                    # or an error stays committed
+                    f.flush()
+                    os.fsync(f.fileno())
+                    self._hashes[upload_id] = (committed, digest)
+            return committed
+
+    def finalize(self, upload_id):
+        with self._locked(upload_id):
+            meta = self._load(upload_id)
+            if meta['sha256'] is None:
+                committed = os.path.getsize(self._path(upload_id, '.part'))
+                if committed != meta['size']:
+                    raise UploadError(f'Upload is incomplete: {committed} of {meta["size"]} bytes')
+                meta['sha256'] = self._hash(upload_id, committed).hexdigest()
+                self._save(upload_id, meta)
+                self._hashes.pop(upload_id, None)
+        return self.status(upload_id)
+
+    # (path, filename) of a finalized upload
+    def open_path(self, upload_id):
+        meta = self._load(upload_id)
+        if meta['sha256'] is None:
+            raise UploadError('Upload is not finalized')
+        return self._path(upload_id, '.part'), meta['filename']
+
+    # Drop uploads that have not changed for longer than the TTL
+    def expire(self):
+        cutoff = time.time() - self.ttl_seconds
+        for name in os.listdir(self.directory):
+            upload_id, suffix = os.path.splitext(name)
+            if suffix != '.json' or not ID_PATTERN.match(upload_id):
+                continue
+            try:
+                # The data file changes with every chunk, the state file only
+                # at creation and finalization
+                if os.path.getmtime(self._path(upload_id, '.part')) >= cutoff:
+                    continue
+                for suffix in ('.json', '.part'):
+                    os.unlink(self._path(upload_id, suffix))
+            except FileNotFoundError:
+                pass
+            self._hashes.pop(upload_id, None)
+            with self._lock:
+                self._locks.pop(upload_id, None)
@@ -0,0 +1,220 @@
+# Batch processing of local files with the same engine as the web app, run
+# on a process pool without going through HTTP:
+#   python -m webm_batch patch stickers/ --duration 3000 --slim
+#   python -m webm_batch compress 'clips/*.webm' --target-kb 256 --out small/
+#   python -m webm_batch inspect stickers/
+#   python -m webm_batch sticker raw/ --out pack/
+# One JSON line per file (its report, timings and output path, or its error)
+# is printed as files complete; a summary goes to stderr.
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import subprocess
+import concurrent.futures
+
+import webm_core
+import local_patch
+
+SUFFIXES = {'patch': '_fixed', 'compress': '_compressed', 'sticker': '_sticker'}
+
+# (path, name relative to the source) for every .webm under the given
+# directories (recursively) or matching the given globs
+def collect_files(sources):
+    files = []
+    for source in sources:
+        if os.path.isdir(source):
+            for path in sorted(glob.glob(os.path.join(source, '**', '*.webm'), recursive=True)):
+                files.append((path, os.path.relpath(path, source)))
+        else:
+            for path in sorted(glob.glob(source)):
+                if os.path.isfile(path):
+                    files.append((path, os.path.basename(path)))
+    return files
+
+# Where the result for `path` goes: under `out` with the same relative name,
+# else next to the source with the operation's suffix. None for inspect.
+def output_path(operation, path, relative, out, in_place=False):
+    if operation not in SUFFIXES:
+        return None
+    if in_place:
+        return path
+    if out:
+        return os.path.join(out, relative)
+    root, ext = os.path.splitext(path)
+    return f'{root}{SUFFIXES[operation]}{ext}'
+
+def write_output(path, data):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+# Run one operation on one file; runs in a pool process. Returns the report.
+def run_job(operation, path, output, options):
+    started = time.monotonic()
+    report = {'path': path, 'operation': operation}
+    try:
+        if operation == 'inspect':
+            report['result'] = webm_core.inspect_file(path)
+        elif operation == 'patch':
+            edits = {key: options[key] for key in ('finalize', 'cues', 'retime', 'slim')}
+            if any(edits.values()):
+                with open(path, 'rb') as f:
+                    data = bytearray(f.read())
+                data, report['result'] = webm_core.edit_webm(data, options['duration_ms'], **edits)
+                write_output(output, data)
+            else:
+                # Duration only: clone and patch the head in place
+                os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+                patched = local_patch.patch_file(path, output, options['duration_ms'])
+                report['result'] = {key: patched[key] for key in ('duration', 'clone', 'bytes_written')}
+            report['output'] = output
+        elif operation == 'compress':
+            data, report['result'] = webm_core.compress_webm(path, options)
+            write_output(output, data)
+            report['output'] = output
+        elif operation == 'sticker':
+            with open(path, 'rb') as f:
+                data = f.read()
+            plan = webm_core.plan_sticker(data, options)
+            _, data, report['result'] = webm_core.build_sticker(os.path.basename(path), data, plan, options)
+            if data is None:
+                report['error'] = report['result'].pop('error')
+            else:
+                write_output(output, bytes(data))
+                report['output'] = output
+    except subprocess.TimeoutExpired:
+        report['error'] = 'FFmpeg timeout (max 5 minutes)'
+    except (OSError, ValueError, RuntimeError) as e:
+        report['error'] = str(e)
+    report['seconds'] = round(time.monotonic() - started, 3)
+    return report
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m webm_batch', description='Patch, compress, inspect or build stickers from local WebM files')
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('sources', nargs='+', help='Directories (searched recursively) or globs of .webm files')
+    common.add_argument('--out', help='Write results here under their relative names instead of next to the sources')
+    common.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes')
+    common.add_argument('--json', help='Also write all reports and the summary to this path')
+    operations = parser.add_subparsers(dest='operation', required=True)
+
+    patch = operations.add_parser('patch', parents=[common], help='Set the Duration and apply container edits')
+    patch.add_argument('--duration', type=float, default=3000, help='Duration in milliseconds')
+    patch.add_argument('--finalize', action='store_true', help='Write real sizes over unknown-size markers')
+    patch.add_argument('--cues', action='store_true', help='Index keyframes in Cues at the front of the file')
+    patch.add_argument('--retime', action='store_true', help='Make the duration real by rescaling timestamps')
+    patch.add_argument('--slim', action='store_true', help='Strip audio, Tags, padding and other extras')
+    patch.add_argument('--in-place', action='store_true', help='Replace the source files')
+
+    compress = operations.add_parser('compress', parents=[common], help='Re-encode to VP9 keeping alpha')
+    compress.add_argument('--crf', type=int, default=30, help='Quality (15-35, lower = better quality)')
+    compress.add_argument('--bitrate', default='500k')
+    compress.add_argument('--target-kb', type=float, help='Aim the bitrate at this size instead of crf/bitrate')
+    compress.add_argument('--real-duration', type=float, help='Real clip length in seconds for --target-kb')
+    compress.add_argument('--duration', type=float, help='Duration in milliseconds to write into the output')
+    compress.add_argument('--denoise', default='off', choices=['off', 'auto'] + list(webm_core.DENOISE_FILTERS))
+    compress.add_argument('--denoise-report', action='store_true')
+    compress.add_argument('--decimate', default='off', choices=['off'] + list(webm_core.DECIMATE_FILTERS))
+    compress.add_argument('--alpha-cleanup', default='off', choices=('off',) + webm_core.ALPHA_CLEANUP_MODES)
+    compress.add_argument('--keyframe-policy', default='default', choices=webm_core.KEYFRAME_POLICIES)
+    compress.add_argument('--keyframe-interval', type=int, default=30)
+    compress.add_argument('--alt-ref', default='off', choices=('off', 'auto'))
+    compress.add_argument('--autocrop', action='store_true')
+    compress.add_argument('--autocrop-align', type=int, default=8, choices=(2, 4, 8, 16, 32, 64))
+    compress.add_argument('--slim', action='store_true')
+
+    operations.add_parser('inspect', parents=[common], help='Report container metadata')
+
+    sticker = operations.add_parser('sticker', parents=[common], help='Fit files to sticker limits')
+    sticker.add_argument('--max-kb', type=float, default=webm_core.PACK_MAX_KB)
+    sticker.add_argument('--max-px', type=int, default=webm_core.PACK_MAX_PX)
+    sticker.add_argument('--max-ms', type=float, default=webm_core.PACK_MAX_MS)
+
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+    if args.operation == 'patch' and (args.duration < 0 or (args.retime and args.duration <= 0)):
+        parser.error('--duration must be non-negative (positive with --retime)')
+    if args.operation == 'compress' and not 15 <= args.crf <= 35:
+        parser.error('--crf must be between 15 and 35')
+    if args.operation == 'compress' and args.keyframe_interval < 1:
+        parser.error('--keyframe-interval must be at least 1')
+    if args.operation == 'sticker' and min(args.max_kb, args.max_px, args.max_ms) <= 0:
+        parser.error('Sticker limits must be positive')
+    return args
+
+# The options run_job() expects for the chosen operation
+def job_options(args):
+    if args.operation == 'patch':
+        return {'duration_ms': args.duration, 'finalize': args.finalize, 'cues': args.cues,
+                'retime': args.retime, 'slim': args.slim}
+    if args.operation == 'compress':
+        return {
+            'decimate': args.decimate,
+            'autocrop': args.autocrop,
+            'autocrop_align': args.autocrop_align,
+            'alpha_cleanup': args.alpha_cleanup,
+            'denoise': args.denoise,
+            'keyframe_policy': args.keyframe_policy,
+            'keyframe_interval': args.keyframe_interval,
+            'alt_ref': args.alt_ref,
+            'target_size_bytes': max(1, int(args.target_kb * 1024)) if args.target_kb else None,
+            'crf': args.crf,
+            'bitrate': args.bitrate,
+            'real_duration': args.real_duration,
+            'denoise_report': args.denoise_report,
+            'slim': args.slim,
+            'duration_ms': args.duration,
+        }
+    if args.operation == 'sticker':
+        return {'max_kb': args.max_kb, 'max_px': args.max_px, 'max_ms': args.max_ms}
+    return {}
+
+def main():
+    args = parse_args()
+    files = collect_files(args.sources)
+    if not files:
+        print('No .webm files found', file=sys.stderr)
+        return 1
+    options = job_options(args)
+
+    started = time.monotonic()
+    reports = []
+    with concurrent.futures.ProcessPoolExecutor(min(args.workers, len(files))) as pool:
+        futures = {
+            pool.submit(run_job, args.operation, path,
+                        output_path(args.operation, path, relative, args.out, getattr(args, 'in_place', False)), options): path
+            for path, relative in files
+        }
+        for future in concurrent.futures.as_completed(futures):
+            # A job lost with its worker (killed, out of memory, a broken
+            # pool) is reported like any other failure
+            try:
+                report = future.result()
+            except Exception as e:
+                report = {'path': futures[future], 'operation': args.operation, 'error': f'Worker failed: {e}', 'seconds': 0}
+            reports.append(report)
+            print(json.dumps(report), flush=True)
+
+    wall_seconds = time.monotonic() - started
+    busy_seconds = sum(report['seconds'] for report in reports)
+    failed = sum(1 for report in reports if 'error' in report)
+    summary = {
+        'operation': args.operation,
+        'files': len(reports),
+        'failed': failed,
+        'workers': min(args.workers, len(files)),
+        'wall_seconds': round(wall_seconds, 3),
+        'busy_seconds': round(busy_seconds, 3),
+    }
+    print(f'{len(reports)} files, {failed} failed, {wall_seconds:.2f}s wall, {busy_seconds:.2f}s busy', file=sys.stderr)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'summary': summary, 'files': sorted(reports, key=lambda report: report['path'])}, f, indent=2)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
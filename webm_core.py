@@ -0,0 +1,645 @@
+# The processing engine behind the web app and the batch CLI: Duration and
+# container edits, the VP9 encode pipeline with its analysis passes, and
+# sticker planning and building. Nothing here knows about HTTP.
+import os
+import re
+import time
+import threading
+import subprocess
+import tempfile
+import ebml
+import frame_stats
+import inspect_webm
+
+# Determine FFmpeg path - use local ffmpeg folder if exists, otherwise system ffmpeg
+def get_ffmpeg_path():
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    local_ffmpeg = os.path.join(script_dir, 'ffmpeg', 'ffmpeg.exe')
+    if os.path.exists(local_ffmpeg):
+        return local_ffmpeg
+    return 'ffmpeg'  # Fall back to system ffmpeg
+
+FFMPEG_PATH = get_ffmpeg_path()
+
+# Sticker pack limits: each sticker at most 256 KB, 512 px on its longer
+# side and 3 seconds long
+PACK_MAX_KB = 256
+PACK_MAX_PX = 512
+PACK_MAX_MS = 3000
+PACK_DEFAULT_FPS = 30  # assumed when the frame count cannot be estimated
+
+# Denoise prefilters, from cheapest to most aggressive.
+# hqdn3d/nlmeans don't carry an alpha plane, so the colour planes are filtered
+# on their own and the original alpha is merged back afterwards.
+DENOISE_FILTERS = {
+    'light': 'hqdn3d=1.5:1.5:3:3',
+    'medium': 'hqdn3d=3:3:6:6',
+    'strong': 'nlmeans=s=3:p=5:r=9',
+}
+
+# Frame decimation modes. hi=0 keeps any frame with a changed 8x8 block, so
+# only exact repeats go; the mpdecimate defaults also drop near-static frames.
+DECIMATE_FILTERS = {
+    'duplicates': 'mpdecimate=hi=0:lo=0:frac=0',
+    'near-static': 'mpdecimate',
+}
+
+# Colour used under fully transparent pixels (tv-range black) and the blur
+# radius used to pull edge colours outwards for the 'edge' cleanup mode
+ALPHA_CLEANUP_MODES = ('zero', 'edge')
+ALPHA_FILL_YUV = (16, 128, 128)
+ALPHA_EDGE_SIGMA = 12
+
+# Keyframe placement policies for short loops. 'default' leaves it to libvpx.
+# A GOP longer than any sticker means a single keyframe unless more are forced.
+KEYFRAME_POLICIES = ('default', 'single', 'scene', 'interval')
+LONG_GOP = 9999
+SCENE_CUT_THRESHOLD = 0.3
+
+# Look-ahead used when alt-ref frames are enabled for opaque sources
+ALT_REF_LAG_IN_FRAMES = 25
+
+# Noise estimate = PSNR of sampled frames against a spatially denoised copy.
+# Clean sources barely change under the reference filter, dithered or grainy
+# ones lose a lot of high-frequency energy. (min PSNR in dB, level) pairs.
+NOISE_SAMPLE_EVERY = 5
+NOISE_PSNR_LEVELS = [
+    (44.0, None),
+    (38.0, 'light'),
+    (32.0, 'medium'),
+    (0.0, 'strong'),
+]
+
+# An FFmpeg encode that exited with an error
+class EncodeError(RuntimeError):
+    pass
+
+# Decode the input through an analysis filter graph and return FFmpeg's log
+def run_ffmpeg_analysis(input_path, video_filter, timeout=120):
+    cmd = [
+        FFMPEG_PATH,
+        '-hide_banner',
+        '-c:v', 'libvpx-vp9',
+        '-i', input_path,
+        '-vf', video_filter,
+        '-an',
+        '-f', 'null',
+        '-'
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+    if result.returncode != 0:
+        raise RuntimeError(f'FFmpeg analysis error: {result.stderr}')
+    return result.stderr
+
+def estimate_noise_psnr(input_path):
+    log = run_ffmpeg_analysis(
+        input_path,
+        f'select=not(mod(n\\,{NOISE_SAMPLE_EVERY})),format=yuv420p,split[orig][ref];'
+        '[ref]hqdn3d=4:3:0:0[den];[orig][den]psnr'
+    )
+    match = re.search(r'PSNR .*?average:(\S+)', log)
+    if not match:
+        raise RuntimeError('Noise analysis produced no PSNR summary')
+    return float(match.group(1))  # 'inf' parses to float('inf')
+
+def pick_denoise_level(noise_psnr):
+    for min_psnr, level in NOISE_PSNR_LEVELS:
+        if noise_psnr >= min_psnr:
+            return level
+    return NOISE_PSNR_LEVELS[-1][1]
+
+# Filter graph segment that denoises colour planes and keeps alpha untouched
+def denoise_filter(level):
+    return (
+        'format=yuva420p,split[dn_color][dn_alpha];'
+        '[dn_alpha]alphaextract[dn_mask];'
+        f'[dn_color]{DENOISE_FILTERS[level]}[dn_clean];'
+        '[dn_clean][dn_mask]alphamerge'
+    )
+
+# Inclusive (x1, y1, x2, y2) box of the pixels that are non-zero in any of
+# the 8-bit width x height planes in `frames`, or None when all are zero.
+# Planes are ORed together byte for byte, so one faint pixel in one frame
+# counts. Raises ValueError on a plane of the wrong size.
+def alpha_bbox(frames, width, height):
+    mask = 0
+    for frame in frames:
+        if len(frame) != width * height:
+            raise ValueError(f'Frame is {len(frame)} bytes, expected {width}x{height}')
+        mask |= int.from_bytes(frame, 'big')
+    if not mask:
+        return None
+    plane = mask.to_bytes(width * height, 'big')
+    y1 = (len(plane) - len(plane.lstrip(b'\0'))) // width
+    y2 = (len(plane.rstrip(b'\0')) - 1) // width
+    columns = 0
+    for y in range(y1, y2 + 1):
+        columns |= int.from_bytes(plane[y * width:(y + 1) * width], 'big')
+    row = columns.to_bytes(width, 'big')
+    return width - len(row.lstrip(b'\0')), y1, len(row.rstrip(b'\0')) - 1, y2
+
+# Union bounding box of non-transparent pixels across all frames.
+# alphaextract turns the alpha plane into a gray image that is streamed out
+# raw and reduced by alpha_bbox(), one frame in memory at a time. With
+# invert=True the alpha plane is negated first, giving the box of pixels
+# that are not fully opaque instead. The frame size comes from the container.
+# Returns (width, height, (x1, y1, x2, y2) or None when every frame is empty).
+def detect_alpha_bbox(input_path, invert=False, timeout=120):
+    video = next((track for track in inspect_file(input_path)['tracks'] if track.get('type') == 'video'), None)
+    if not video or not video.get('pixel_width') or not video.get('pixel_height'):
+        raise RuntimeError('Crop analysis found no video size')
+    width, height = video['pixel_width'], video['pixel_height']
+    negate = 'lutyuv=a=negval,' if invert else ''
+    cmd = [
+        FFMPEG_PATH,
+        '-hide_banner',
+        '-c:v', 'libvpx-vp9',
+        '-i', input_path,
+        '-vf', f'format=yuva420p,{negate}alphaextract',
+        '-an',
+        '-f', 'rawvideo',
+        '-pix_fmt', 'gray',
+        '-'
+    ]
+    expired = []
+    mismatch = None
+    with tempfile.TemporaryFile() as log:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=log)
+
+        def expire():
+            expired.append(True)
+            process.kill()
+
+        timer = threading.Timer(timeout, expire)
+        timer.start()
+        try:
+            box = alpha_bbox(iter(lambda: process.stdout.read(width * height), b''), width, height)
+        except ValueError as e:
+            mismatch = e
+            process.kill()
+        finally:
+            timer.cancel()
+            process.stdout.close()
+            process.wait()
+        if expired:
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        if process.returncode != 0 and mismatch is None:
+            log.seek(0)
+            raise RuntimeError(f'FFmpeg analysis error: {log.read().decode(errors="replace")}')
+    if mismatch is not None:
+        raise RuntimeError(f'Crop analysis: {mismatch}')
+    return width, height, box
+
+# Grow an inclusive pixel box outwards to `align`-sized blocks, clamped to the
+# frame. Returns (w, h, x, y) for the crop filter; offsets are always even so
+# chroma stays aligned, and sides are even unless they run into an odd frame edge.
+def aligned_crop(box, width, height, align):
+    x1, y1, x2, y2 = box
+    left = x1 - x1 % align
+    top = y1 - y1 % align
+    right = min(width, -(-(x2 + 1) // align) * align)
+    bottom = min(height, -(-(y2 + 1) // align) * align)
+    return right - left, bottom - top, left, top
+
+# Input frame indices mpdecimate keeps, plus the last frame so a trailing
+# hold still ends at its original timestamp. showinfo runs before and after
+# the decimator and frames are matched by pts.
+# Returns (input_frame_count, kept_indices).
+def detect_kept_frames(input_path, mode):
+    log = run_ffmpeg_analysis(
+        input_path,
+        f'format=yuva420p,showinfo,{DECIMATE_FILTERS[mode]},showinfo'
+    )
+    frames = {}
+    for instance, n, pts in re.findall(r'\[Parsed_showinfo_(\d+) @ [^\]]*\] n:\s*(\d+) pts:\s*(-?\d+)', log):
+        frames.setdefault(int(instance), []).append((int(n), int(pts)))
+    if len(frames) != 2:
+        raise RuntimeError('Decimation analysis produced no frame list')
+    before, after = (frames[instance] for instance in sorted(frames))
+    kept_pts = {pts for _, pts in after}
+    kept = [n for n, pts in before if pts in kept_pts]
+    if not kept or kept[-1] != before[-1][0]:
+        kept.append(before[-1][0])
+    return len(before), kept
+
+# Presentation times (seconds) of frames that start a new scene
+def detect_scene_cuts(input_path):
+    log = run_ffmpeg_analysis(
+        input_path,
+        f'format=yuv420p,select=gt(scene\\,{SCENE_CUT_THRESHOLD}),showinfo'
+    )
+    times = re.findall(r'\[Parsed_showinfo_\d+ @ [^\]]*\] n:\s*\d+ pts:\s*-?\d+ pts_time:(-?[\d.]+)', log)
+    return [float(t) for t in times if float(t) > 0]
+
+# select expression keeping the given frame indices, with runs collapsed
+def select_frames_filter(kept):
+    runs = []
+    for n in kept:
+        if runs and runs[-1][1] == n - 1:
+            runs[-1][1] = n
+        else:
+            runs.append([n, n])
+    terms = [f'eq(n\\,{a})' if a == b else f'between(n\\,{a}\\,{b})' for a, b in runs]
+    return 'select=' + '+'.join(terms)
+
+# Build the -vf chain and extra output args for an encode, running whatever
+# analysis passes the options ask for and recording their results in `report`.
+# Stages run cheapest-first on the fewest pixels: decimate, crop, alpha
+# cleanup, denoise, and end with the output pixel format. Keyframe and
+# alpha/alt-ref settings are returned in the extra output args.
+def plan_filters(input_path, options, report):
+    prefilters = []
+    extra_args = []
+    
+    # Drop repeated frames before anything else touches them. The kept
+    # frames keep their original timestamps, so the WebM is written VFR.
+    decimate = options.get('decimate', 'off')
+    if decimate != 'off':
+        analysis_started = time.monotonic()
+        frame_count, kept = detect_kept_frames(input_path, decimate)
+        report['decimate'] = {
+            'mode': decimate,
+            'frames_in': frame_count,
+            'frames_kept': len(kept),
+            'frames_removed': frame_count - len(kept),
+            'analysis_seconds': round(time.monotonic() - analysis_started, 3)
+        }
+        if len(kept) < frame_count:
+            prefilters.append(select_frames_filter(kept))
+            extra_args.extend(['-fps_mode', 'vfr'])
+    
+    # Crop next so every later stage works on fewer pixels
+    if options.get('autocrop'):
+        analysis_started = time.monotonic()
+        width, height, box = detect_alpha_bbox(input_path)
+        report['autocrop'] = {
+            'source': [width, height],
+            'analysis_seconds': round(time.monotonic() - analysis_started, 3)
+        }
+        if box:
+            crop_w, crop_h, crop_x, crop_y = aligned_crop(box, width, height, options.get('autocrop_align', 8))
+            if (crop_w, crop_h) != (width, height):
+                prefilters.append(f'crop={crop_w}:{crop_h}:{crop_x}:{crop_y}')
+                report['autocrop']['crop'] = [crop_w, crop_h, crop_x, crop_y]
+                report['autocrop']['pixel_savings_percent'] = round(
+                    (1 - (crop_w * crop_h) / (width * height)) * 100, 2
+                )
+    
+    # Flatten colour that sits under fully transparent pixels
+    alpha_cleanup = options.get('alpha_cleanup', 'off')
+    if alpha_cleanup != 'off':
+        prefilters.append(alpha_cleanup_filter(alpha_cleanup))
+        report['alpha_cleanup'] = {'mode': alpha_cleanup}
+    
+    denoise = options.get('denoise', 'off')
+    denoise_level = None
+    if denoise == 'auto':
+        analysis_started = time.monotonic()
+        noise_psnr = estimate_noise_psnr(input_path)
+        denoise_level = pick_denoise_level(noise_psnr)
+        report['denoise'] = {
+            'noise_psnr': noise_psnr if noise_psnr != float('inf') else None,
+            'analysis_seconds': round(time.monotonic() - analysis_started, 3)
+        }
+    elif denoise != 'off':
+        denoise_level = denoise
+        report['denoise'] = {}
+    
+    if 'denoise' in report:
+        report['denoise']['level'] = denoise_level
+    if denoise_level:
+        prefilters.append(denoise_filter(denoise_level))
+    
+    # Keyframe placement
+    policy = options.get('keyframe_policy', 'default')
+    if policy != 'default':
+        report['keyframes'] = {'policy': policy}
+    if policy == 'single':
+        extra_args.extend(['-g', str(LONG_GOP)])
+    elif policy == 'scene':
+        analysis_started = time.monotonic()
+        cuts = detect_scene_cuts(input_path)
+        extra_args.extend(['-g', str(LONG_GOP)])
+        if cuts:
+            extra_args.extend(['-force_key_frames', ','.join(f'{t:.3f}' for t in cuts)])
+        report['keyframes']['scene_cuts'] = cuts
+        report['keyframes']['analysis_seconds'] = round(time.monotonic() - analysis_started, 3)
+    elif policy == 'interval':
+        interval = str(options.get('keyframe_interval', 30))
+        extra_args.extend(['-g', interval, '-keyint_min', interval])
+        report['keyframes']['interval'] = int(interval)
+    
+    # libvpx's alpha path is run with alt-ref frames and look-ahead disabled.
+    # When every pixel of every frame is opaque the alpha plane carries nothing,
+    # so it is dropped and alt-ref/lag-in-frames are enabled instead.
+    alpha = True
+    if options.get('alt_ref') == 'auto':
+        analysis_started = time.monotonic()
+        _, _, translucent = detect_alpha_bbox(input_path, invert=True)
+        alpha = translucent is not None
+        report['alt_ref'] = {
+            'alpha_used': alpha,
+            'enabled': not alpha,
+            'analysis_seconds': round(time.monotonic() - analysis_started, 3)
+        }
+    
+    if alpha:
+        extra_args.extend([
+            '-pix_fmt', 'yuva420p',
+            '-auto-alt-ref', '0',
+            '-lag-in-frames', '0',
+            '-metadata:s:v:0', 'alpha_mode=1'
+        ])
+        return prefilters + ['format=yuva420p'], extra_args
+    
+    extra_args.extend([
+        '-pix_fmt', 'yuv420p',
+        '-auto-alt-ref', '1',
+        '-lag-in-frames', str(ALT_REF_LAG_IN_FRAMES)
+    ])
+    return prefilters + ['format=yuv420p'], extra_args
+
+# Expressions that are true where a pixel (luma) or any of the four pixels a
+# 4:2:0 chroma sample covers (chroma) is at least partly visible
+ALPHA_VISIBLE_LUMA = 'gt(alpha(X\\,Y)\\,0)'
+ALPHA_VISIBLE_CHROMA = (
+    'gt(alpha(2*X\\,2*Y)+alpha(2*X+1\\,2*Y)+alpha(2*X\\,2*Y+1)+alpha(2*X+1\\,2*Y+1)\\,0)'
+)
+
+# Filter graph segment that replaces colour under alpha=0 with something cheap
+# to code. Visible pixels, including chroma samples that touch any visible
+# pixel, and the alpha plane itself are left bit-exact.
+#   zero: flat tv-range black
+#   edge: normalized blur of the visible colours (premultiply, blur colour and
+#         alpha together, unpremultiply), so edges bleed smoothly outwards and
+#         chroma subsampling around the silhouette stays clean
+def alpha_cleanup_filter(mode):
+    fill_y, fill_u, fill_v = ALPHA_FILL_YUV
+    if mode == 'zero':
+        return (
+            'format=yuva420p,geq='
+            f'lum=if({ALPHA_VISIBLE_LUMA}\\,lum(X\\,Y)\\,{fill_y}):'
+            f'cb=if({ALPHA_VISIBLE_CHROMA}\\,cb(X\\,Y)\\,{fill_u}):'
+            f'cr=if({ALPHA_VISIBLE_CHROMA}\\,cr(X\\,Y)\\,{fill_v}):'
+            'a=alpha(X\\,Y)'
+        )
+    # maskedmerge takes the second input where the mask is 255, so the mask is
+    # 255 exactly where the colour is invisible and 0 on the alpha plane
+    return (
+        'format=yuva420p,split=3[ac_orig][ac_fill][ac_src];'
+        f'[ac_fill]premultiply=inplace=1,gblur=sigma={ALPHA_EDGE_SIGMA},unpremultiply=inplace=1[ac_filled];'
+        '[ac_src]geq='
+        f'lum=if({ALPHA_VISIBLE_LUMA}\\,0\\,255):'
+        f'cb=if({ALPHA_VISIBLE_CHROMA}\\,0\\,255):'
+        f'cr=if({ALPHA_VISIBLE_CHROMA}\\,0\\,255):'
+        'a=0[ac_mask];'
+        '[ac_orig][ac_filled][ac_mask]maskedmerge'
+    )
+
+def build_encode_cmd(input_path, output_path, video_filters, rate_args, extra_args=()):
+    ffmpeg_cmd = [
+        FFMPEG_PATH,
+        '-c:v', 'libvpx-vp9',
+        '-i', input_path,
+        '-vf', ','.join(video_filters),
+        '-c:v', 'libvpx-vp9',
+        '-row-mt', '1',
+        '-cpu-used', '4',
+        '-deadline', 'good'
+    ]
+    ffmpeg_cmd.extend(rate_args)
+    ffmpeg_cmd.extend(extra_args)
+    ffmpeg_cmd.extend([
+        '-an',
+        '-y',
+        output_path
+    ])
+    return ffmpeg_cmd
+
+# Constrained bitrate aimed at a file of `target_size_bytes` for a clip of
+# `seconds`
+def target_rate_args(target_size_bytes, seconds):
+    # Reserve margin for container overhead and encoder variance (~42%)
+    # VP9 with alpha and WebM container adds overhead
+    target_video_bits = max(int(target_size_bytes * 8 * 0.58), 8000)
+    video_bitrate = max(int(target_video_bits / seconds), 20000)  # bits per second
+    return [
+        '-b:v', str(video_bitrate),
+        '-maxrate', str(video_bitrate),
+        '-bufsize', str(int(video_bitrate * 1.5))
+    ]
+
+# Run an encode command, returning the CompletedProcess and wall time in seconds
+def run_encode(ffmpeg_cmd):
+    started = time.monotonic()
+    result = subprocess.run(
+        ffmpeg_cmd,
+        capture_output=True,
+        text=True,
+        timeout=300  # 5 minute timeout
+    )
+    return result, time.monotonic() - started
+
+# Convert milliseconds to seconds and write the EBML Duration. Files without
+# a Duration (e.g. MediaRecorder output) get one inserted. Unknown
+# Segment/Cluster sizes from live capture are finalized and a keyframe seek
+# index is built in the same pass when asked. Retiming makes the clip really
+# play for the requested time instead, with a Duration that matches. Slimming
+# runs first. Returns (data, report); raises ebml.EBMLError for files that
+# cannot be edited.
+def edit_webm(file_data, duration_ms, finalize=False, cues=False, retime=False, slim=False):
+    slim_report = None
+    if slim:
+        chunks, slim_report = ebml.slim(file_data)
+        file_data = bytearray(b''.join(chunks))
+    
+    if retime:
+        if duration_ms <= 0:
+            raise ebml.EBMLError('Retiming needs a positive duration')
+        file_data, report = ebml.edit_segment(file_data, finalize=finalize, cues=cues, retime=duration_ms / 1000.0)
+    else:
+        file_data, report = ebml.edit_segment(file_data, duration=duration_ms / 1000.0, finalize=finalize, cues=cues)
+    if slim_report:
+        report['slim'] = slim_report
+    return file_data, report
+
+# What a pack sticker needs, from its container metadata alone. Stickers
+# that already meet the limits (VP9, small enough, short enough) only get
+# their Duration fixed; the rest are re-encoded. `cost` predicts the encode
+# work in decoded plus encoded pixels and is 0 for header-only edits.
+def plan_sticker(data, limits):
+    info = inspect_webm.inspect([bytes(data)], bytes(data[-inspect_webm.TAIL_BYTES:]), len(data))
+    video = next((track for track in info['tracks'] if track['type'] == 'video'), None)
+    if video is None or not video.get('pixel_width') or not video.get('pixel_height'):
+        raise ebml.EBMLError('No video track with a frame size')
+    width, height = video['pixel_width'], video['pixel_height']
+    real_ms = info.get('real_duration_ms') or limits['max_ms']
+    out_ms = min(real_ms, limits['max_ms'])
+    plan = {
+        'codec': video.get('codec'),
+        'source': [width, height],
+        'real_duration_ms': real_ms,
+        'duration_ms': out_ms,
+    }
+    fits = (video.get('codec') == 'V_VP9' and max(width, height) <= limits['max_px']
+            and len(data) <= limits['max_kb'] * 1024 and real_ms <= limits['max_ms'])
+    if fits:
+        plan.update(mode='edit', cost=0)
+        return plan
+    
+    # Scale the longer side down to the limit, keeping both sides even
+    scale = min(1.0, limits['max_px'] / max(width, height))
+    out_width = max(2, int(width * scale) // 2 * 2)
+    out_height = max(2, int(height * scale) // 2 * 2)
+    frames = info.get('frames_estimated') or round(real_ms / 1000 * PACK_DEFAULT_FPS)
+    frames_out = frames * out_ms / real_ms if real_ms else frames
+    plan.update(mode='encode', size=[out_width, out_height],
+                cost=round(frames * width * height + frames_out * out_width * out_height))
+    return plan
+
+# Build one pack sticker; runs in a pool process. Encodes when planned, then
+# slims and sets the Duration. Returns (name, data or None, report); any
+# failure (container, FFmpeg, analysis, temp files) is recorded as the
+# report's error so one sticker never takes down the pack.
+def build_sticker(name, data, plan, limits):
+    started = time.monotonic()
+    report = dict(plan, bytes_in=len(data))
+    try:
+        if plan['mode'] == 'encode':
+            data = encode_sticker(data, plan, limits, report)
+        data, report['edit'] = edit_webm(bytearray(data), plan['duration_ms'], slim=True)
+    except (OSError, ValueError, RuntimeError) as e:
+        report['error'] = str(e)
+        data = None
+    except subprocess.TimeoutExpired:
+        report['error'] = 'Encode timeout (max 5 minutes)'
+        data = None
+    report['seconds'] = round(time.monotonic() - started, 3)
+    if data is not None:
+        report['bytes'] = len(data)
+        report['within_limit'] = len(data) <= limits['max_kb'] * 1024
+    return name, data, report
+
+# Encode to the planned size and length at a bitrate aimed at the size
+# limit, once more at a lower rate if the first pass comes out too big
+def encode_sticker(data, plan, limits, report):
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.webm') as temp_input:
+        temp_input.write(data)
+        input_path = temp_input.name
+    output_path = tempfile.mktemp(suffix='_sticker.webm')
+    try:
+        video_filters, extra_args = plan_filters(input_path, {}, report)
+        width, height = plan['size']
+        if [width, height] != plan['source']:
+            video_filters.insert(0, f'scale={width}:{height}:flags=lanczos')
+        extra_args = extra_args + ['-t', f"{plan['duration_ms'] / 1000:.3f}", '-threads', '1']
+        target_bytes = limits['max_kb'] * 1024
+        report['passes'] = 0
+        for _ in range(2):
+            rate_args = target_rate_args(target_bytes, plan['duration_ms'] / 1000)
+            result, encode_time = run_encode(build_encode_cmd(input_path, output_path, video_filters, rate_args, extra_args))
+            if result.returncode != 0:
+                raise EncodeError(f'FFmpeg error: {result.stderr[-500:]}')
+            report['passes'] += 1
+            report['encode_seconds'] = round(report.get('encode_seconds', 0) + encode_time, 3)
+            output_bytes = os.path.getsize(output_path)
+            if output_bytes <= limits['max_kb'] * 1024:
+                break
+            target_bytes = int(target_bytes * limits['max_kb'] * 1024 / output_bytes * 0.9)
+        with open(output_path, 'rb') as f:
+            return f.read()
+    finally:
+        for path in (input_path, output_path):
+            if os.path.exists(path):
+                os.unlink(path)
+
+# Re-encode the file at `input_path` to VP9, keeping alpha. `options` holds
+# the plan_filters() options plus:
+#   target_size_bytes - aim the bitrate at this size over `real_duration`
+#                       seconds (3 when unknown) instead of crf/bitrate
+#   crf, bitrate      - quality and bitrate cap otherwise
+#   real_duration     - real length in seconds (metadata may be wrong)
+#   denoise_report    - encode again without the denoiser to measure it
+#   slim, duration_ms - container edits applied to the encoder output
+# Returns (data, report). Raises EncodeError when FFmpeg fails.
+def compress_webm(input_path, options):
+    report = {}
+    output_path = tempfile.mktemp(suffix='_compressed.webm')
+    temp_paths = [output_path]
+    try:
+        real_duration_seconds = options.get('real_duration')
+        if options.get('target_size_bytes'):
+            # Automatic bitrate calculation to hit target file size
+            # Use user-provided real duration instead of ffprobe (since metadata duration may differ)
+            # default fallback is 3 seconds
+            rate_args = target_rate_args(options['target_size_bytes'], real_duration_seconds or 3.0)
+        else:
+            # Manual bitrate selection with CRF for quality control
+            rate_args = [
+                '-crf', str(options.get('crf', 30)),
+                '-b:v', options.get('bitrate', '500k')
+            ]
+        
+        video_filters, extra_args = plan_filters(input_path, options, report)
+        denoise_level = report.get('denoise', {}).get('level')
+        
+        # Run FFmpeg
+        ffmpeg_cmd = build_encode_cmd(input_path, output_path, video_filters, rate_args, extra_args)
+        result, encode_time = run_encode(ffmpeg_cmd)
+        
+        if result.returncode != 0:
+            raise EncodeError(f'FFmpeg error: {result.stderr}')
+        
+        output_bytes = os.path.getsize(output_path)
+        report['encode_seconds'] = round(encode_time, 3)
+        report['bytes'] = output_bytes
+        
+        # Encode once more without the denoiser so the savings can be judged
+        # against the extra filter time
+        if denoise_level and options.get('denoise_report'):
+            baseline_path = tempfile.mktemp(suffix='_baseline.webm')
+            temp_paths.append(baseline_path)
+            baseline_filters = [f for f in video_filters if f != denoise_filter(denoise_level)]
+            baseline_cmd = build_encode_cmd(input_path, baseline_path, baseline_filters, rate_args, extra_args)
+            baseline_result, baseline_time = run_encode(baseline_cmd)
+            
+            if baseline_result.returncode != 0:
+                raise EncodeError(f'FFmpeg error: {baseline_result.stderr}')
+            
+            baseline_bytes = os.path.getsize(baseline_path)
+            report['denoise'].update({
+                'baseline_bytes': baseline_bytes,
+                'baseline_encode_seconds': round(baseline_time, 3),
+                'savings_percent': round((1 - output_bytes / baseline_bytes) * 100, 2) if baseline_bytes else 0.0
+            })
+            if real_duration_seconds:
+                report['denoise']['bitrate_kbps'] = round(output_bytes * 8 / real_duration_seconds / 1000, 1)
+                report['denoise']['baseline_bitrate_kbps'] = round(baseline_bytes * 8 / real_duration_seconds / 1000, 1)
+        
+        with open(output_path, 'rb') as f:
+            data = bytearray(f.read())
+        
+        # Drop what the muxer adds beyond the video itself (Void
+        # padding, CRC-32, default-valued track flags)
+        if options.get('slim'):
+            chunks, report['slim'] = ebml.slim(data)
+            data = bytearray(b''.join(chunks))
+        
+        if options.get('duration_ms') is not None:
+            data, _ = ebml.set_duration(data, options['duration_ms'] / 1000.0)
+        return data, report
+    
+    finally:
+        for path in temp_paths:
+            if os.path.exists(path):
+                os.unlink(path)
+
+# Container metadata of the file at `path`, read from its head and last
+# bytes as /inspect does
+def inspect_file(path):
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        f.seek(max(size - inspect_webm.TAIL_BYTES, 0))
+        tail = f.read()
+        f.seek(0)
+        return inspect_webm.inspect(frame_stats.iter_file(f), tail, size)